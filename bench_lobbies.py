@@ -0,0 +1,147 @@
+import argparse
+import csv
+import glob
+import random
+import statistics
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from go.bot.lobby_engine import LOBBY_MAX_PLAYERS, LobbyAssignment, LobbyTeam, assign_lobbies, lobbies_needed
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+RATINGS_GLOB = "*/go_official_*_ratings.csv"
+
+
+class SyntheticSession(BaseModel):
+    # in signup order
+    teams: List[LobbyTeam]
+    hosts_not_on_teams: List[int]
+    lobby_count: int
+
+
+class LobbyStats(BaseModel):
+    seconds: float
+    lobbies: int
+    # of the lobbies' average team rating
+    spread: float
+    variance: float
+    # assigned players / lobby seats
+    fill_rate: float
+    waitlist_teams: int
+    waitlist_players: int
+
+
+def load_rating_pool(data_dir: Path = DATA_DIR, pattern: str = RATINGS_GLOB) -> List[float]:
+    """
+    Player ratings from the official ratings exports, to draw synthetic players from.
+    """
+    ratings = []
+    for filename in sorted(glob.glob(str(data_dir / pattern))):
+        with open(filename, mode="r") as file:
+            for row in csv.DictReader(file):
+                try:
+                    ratings.append(float(row["go_rating"]))
+                except (TypeError, ValueError):
+                    # a few igns have unescaped commas and quotes that shift the columns
+                    continue
+    return ratings
+
+
+def make_session(
+    rng: random.Random,
+    pool: List[float],
+    team_count: int,
+    host_count: int,
+    host_teams: Optional[int] = None,
+    lobby_count: Optional[int] = None,
+) -> SyntheticSession:
+    """
+    team_count teams of 1-4 players.  host_teams of the host_count hosts play on a team (random if None),
+    the rest only host.  lobby_count defaults to what the bot would open for that many players.
+    """
+    if host_teams is None:
+        host_teams = rng.randint(0, min(host_count, team_count))
+    host_teams = min(host_teams, host_count, team_count)
+
+    hosts = list(range(1, host_count + 1))
+    host_team_ids = set(rng.sample(range(1, team_count + 1), host_teams))
+    teams = []
+    for team_id in range(1, team_count + 1):
+        team_size = rng.randint(1, 4)
+        # team rating is the sum of the players', same as GoDB.create_team
+        team_rating = sum(rng.choice(pool) for _ in range(team_size))
+        host_did = hosts.pop() if team_id in host_team_ids else None
+        teams.append(LobbyTeam(team_id=team_id, team_size=team_size, team_rating=team_rating, host_did=host_did))
+
+    if lobby_count is None:
+        player_count = sum(t.team_size for t in teams)
+        lobby_count = lobbies_needed(player_count) if player_count else 0
+    return SyntheticSession(teams=teams, hosts_not_on_teams=hosts, lobby_count=lobby_count)
+
+
+def lobby_stats(session: SyntheticSession, assignment: LobbyAssignment, seconds: float) -> LobbyStats:
+    sizes = {t.team_id: t.team_size for t in session.teams}
+    seats = len(assignment.lobbies) * LOBBY_MAX_PLAYERS
+    return LobbyStats(
+        seconds=seconds,
+        lobbies=len(assignment.lobbies),
+        spread=assignment.spread,
+        variance=statistics.pvariance(assignment.ratings) if assignment.ratings else 0.0,
+        fill_rate=sum(assignment.players) / seats if seats else 0.0,
+        waitlist_teams=len(assignment.waitlist),
+        waitlist_players=sum(sizes[team_id] for team_id in assignment.waitlist),
+    )
+
+
+def run_session(session: SyntheticSession) -> Tuple[LobbyAssignment, LobbyStats]:
+    start = time.perf_counter()
+    assignment = assign_lobbies(session.teams, session.hosts_not_on_teams, session.lobby_count)
+    seconds = time.perf_counter() - start
+    return assignment, lobby_stats(session, assignment, seconds)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="time and score lobby sorting on synthetic sessions")
+    parser.add_argument("--teams", type=int, nargs="+", default=[10, 25, 50, 100, 300], help="teams per session")
+    parser.add_argument("--hosts", type=int, nargs="+", default=[1, 2, 3, 5], help="hosts per session")
+    parser.add_argument("--sessions", type=int, default=20, help="sessions per teams/hosts combination")
+    parser.add_argument("--lobbies", type=int, default=None, help="override the bot's lobby count")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pool = load_rating_pool()
+    if not pool:
+        raise SystemExit("no ratings found in data/*/go_official_*_ratings.csv")
+    print(f"{len(pool)} player ratings, mean {statistics.mean(pool):,.0f}, stdev {statistics.pstdev(pool):,.0f}")
+    print()
+
+    rng = random.Random(args.seed)
+    print(
+        f"{'teams':>5} {'hosts':>5} {'lobbies':>7} {'avg ms':>8} {'max ms':>8} "
+        f"{'spread':>8} {'variance':>10} {'fill':>6} {'waitlist':>8}"
+    )
+    for team_count in args.teams:
+        for host_count in args.hosts:
+            lobbies = args.lobbies if args.lobbies is None else min(args.lobbies, host_count)
+            stats = [
+                run_session(make_session(rng, pool, team_count, host_count, lobby_count=lobbies))[1]
+                for _ in range(args.sessions)
+            ]
+            ms = [s.seconds * 1000 for s in stats]
+            # fill is only averaged over sessions that had a host to open a lobby
+            print(
+                f"{team_count:>5} {host_count:>5} {statistics.mean(s.lobbies for s in stats):>7.1f} "
+                f"{statistics.mean(ms):>8.2f} {max(ms):>8.2f} "
+                f"{statistics.mean(s.spread for s in stats):>8.1f} "
+                f"{statistics.mean(s.variance for s in stats):>10.1f} "
+                f"{statistics.mean([s.fill_rate for s in stats if s.lobbies] or [0.0]):>6.1%} "
+                f"{statistics.mean(s.waitlist_teams for s in stats):>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
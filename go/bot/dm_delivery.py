@@ -0,0 +1,133 @@
+import asyncio
+from enum import Enum
+from typing import Iterable, List, Optional, Set, Tuple
+
+import discord
+
+from go.bot.logger import create_logger
+
+logger = create_logger(__name__)
+
+# (discord_id, message)
+DmIntent = Tuple[int, str]
+
+
+class DmStatus(Enum):
+    SENT = "sent"
+    # worth trying again later
+    FAILED = "failed"
+    # unknown user or DMs closed to the bot, trying again won't help
+    UNDELIVERABLE = "undeliverable"
+
+
+class DmDelivery:
+    """
+    Sends DMs from a background task so command handlers don't wait on Discord.
+
+    Messages are queued with enqueue() and sent up to concurrency at a time.
+    enqueue() returns a future that's set to the DmStatus of the DM.
+    discord.py already waits out 429s, so only server errors and dropped connections are retried here.
+    """
+
+    def __init__(self, bot, concurrency: int = 4, max_retries: int = 3, retry_delay: float = 1.0):
+        self.bot = bot
+        self.queue: asyncio.Queue[Tuple[int, str, asyncio.Future]] = asyncio.Queue()
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.worker: Optional[asyncio.Task] = None
+        self.sending: Set[asyncio.Task] = set()
+        self.sent_count = 0
+        self.failed_count = 0
+
+    #
+    def start(self) -> None:
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.run())
+
+    #
+    async def stop(self) -> None:
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+        for task in list(self.sending):
+            task.cancel()
+
+    #
+    def enqueue(self, discord_id: int, message: str) -> asyncio.Future:
+        return self.enqueue_many([(discord_id, message)])[0]
+
+    #
+    def enqueue_many(self, dms: Iterable[DmIntent]) -> List[asyncio.Future]:
+        # started on first use so it always runs on the bot's event loop
+        self.start()
+        futures = []
+        for discord_id, message in dms:
+            future = asyncio.get_running_loop().create_future()
+            self.queue.put_nowait((discord_id, message, future))
+            futures.append(future)
+        return futures
+
+    #
+    async def join(self) -> None:
+        """
+        Wait until everything queued so far has been sent (or given up on).
+        """
+        await self.queue.join()
+
+    #
+    async def run(self) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            discord_id, message, future = await self.queue.get()
+            await semaphore.acquire()
+            task = asyncio.create_task(self.deliver(discord_id, message, future, semaphore))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+
+    #
+    async def deliver(
+        self, discord_id: int, message: str, future: asyncio.Future, semaphore: asyncio.Semaphore
+    ) -> None:
+        status = DmStatus.FAILED
+        try:
+            try:
+                # get_user only knows the users in the bot's cache
+                user = self.bot.get_user(discord_id) or await self.bot.fetch_user(discord_id)
+            except discord.NotFound:
+                status = DmStatus.UNDELIVERABLE
+                self.failed_count += 1
+                logger.warning(f"Not sending DM, user {discord_id} not found")
+                return
+
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await user.send(message)
+                    self.sent_count += 1
+                    status = DmStatus.SENT
+                    return
+                except (discord.DiscordServerError, asyncio.TimeoutError, OSError) as err:
+                    if attempt == self.max_retries:
+                        self.failed_count += 1
+                        logger.error(f"DM to {discord_id} failed after {attempt + 1} tries: {err}")
+                        return
+                    logger.warning(f"DM to {discord_id} failed, retrying: {err}")
+                    await asyncio.sleep(self.retry_delay * 2**attempt)
+                except (discord.Forbidden, discord.NotFound) as err:
+                    # DMs closed, blocked, etc -- retrying won't help
+                    status = DmStatus.UNDELIVERABLE
+                    self.failed_count += 1
+                    logger.warning(f"DM to {discord_id} is undeliverable: {err}")
+                    return
+                except discord.HTTPException as err:
+                    self.failed_count += 1
+                    logger.warning(f"DM to {discord_id} failed: {err}")
+                    return
+        except Exception as err:
+            self.failed_count += 1
+            logger.error(f"DM to {discord_id} failed: {err}")
+        finally:
+            if not future.done():
+                future.set_result(status)
+            semaphore.release()
+            self.queue.task_done()
@@ -9,6 +9,10 @@ class GoDbError(Exception):
     pass
 
 
+class DuplicateRosterError(GoDbError):
+    pass
+
+
 class DataNotDeletedError(Exception):
     pass
 
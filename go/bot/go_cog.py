@@ -1,22 +1,30 @@
 from __future__ import annotations
 
+import asyncio
+import functools
 import pprint
 import random
+import threading
+import uuid
 from collections import defaultdict, deque
-from datetime import datetime
-from typing import Dict, List, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Union
 
 import discord
 from dateutil import parser
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 from pydantic import BaseModel
 from sqlmodel import Session, delete, select
 
 from config import _config
-from go.bot.exceptions import DiscordUserError, ErrorCode, GoDbError
+from go.bot.dm_delivery import DmDelivery, DmIntent
+from go.bot.exceptions import DiscordUserError, DuplicateRosterError, ErrorCode, GoDbError
 from go.bot.go_bot import GoBot
 from go.bot.go_db import GoDB, GoTeamPlayerSignup
+from go.bot.ign_index import IgnIndex
+from go.bot.lobby_engine import LobbyAssignment, LobbyTeam, assign_lobbies, lobbies_needed
 from go.bot.logger import create_logger
 from go.bot.models import (
     GoHost,
@@ -28,8 +36,10 @@ from go.bot.models import (
     GoSignup,
     GoTeam,
 )
+from go.bot.outbox import OutboxDispatcher
 from go.bot.playfab_api import as_player_id, as_playfab_id, is_playfab_str
 from go.bot.playfab_db import PlayfabDB
+from go.bot.prefix_trie import PrefixTrie
 
 MY_GUILD = discord.Object(id=_config.guild_id)
 
@@ -81,7 +91,8 @@ class GoCog(commands.Cog):
     admin_group = app_commands.Group(name="goadmin", description="GO Admin Commands")
 
     #
-    def __init__(self, bot: commands.Bot) -> None:
+    # db_workers bounds how many commands hit the DB at once, it shouldn't be more than the engine's pool size
+    def __init__(self, bot: commands.Bot, db_workers: int = 5) -> None:
         # if not isinstance(bot, GoBot):
         #     raise TypeError(f"GoCog must be initialized with a GoBot instance, not {type(bot)}")
         self.bot = bot
@@ -89,8 +100,27 @@ class GoCog(commands.Cog):
         self.godb: GoDB = bot.godb  # type: ignore
         self.pfdb: PlayfabDB = bot.pfdb  # type: ignore
 
+        # blocking SQLAlchemy calls run here so they don't stall the discord.py event loop
+        self.db_pool = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="godb")
+
         self.dms_enabled = True
-        self.dm_queue = []
+        # DMs are written to go_outbox with the change they're about and sent in the background, see send_dms
+        self.dm_delivery = DmDelivery(bot)
+        self.outbox = OutboxDispatcher(self.engine, self.godb, self.dm_delivery, self.run_db)
+
+        # filled in by refresh_indexes, until then ign lookups go to the DB
+        self.ign_index = IgnIndex()
+        self.team_names = PrefixTrie()
+        # signups and renames update team_names from the DB workers while the event loop searches it
+        self.team_names_lock = threading.Lock()
+        # (old name, new name) edits made while do_refresh_indexes is reading the teams, None when it isn't
+        self.team_name_edits: Optional[List[Tuple[Optional[str], str]]] = None
+
+    #
+    # Run func (which opens its own Session) on the DB worker pool and wait for the result
+    async def run_db(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.db_pool, functools.partial(func, *args, **kwargs))
 
     #
     def set_rating_if_needed(self, pf_player_id, session, season: str) -> Optional[float]:
@@ -116,6 +146,7 @@ class GoCog(commands.Cog):
                 )
                 session.add(official_rating)
                 # session.commit()
+                self.godb.rating_cache.invalidate_player(_config.go_season, "official", pf_player_id)
 
         return go_rating
 
@@ -139,7 +170,16 @@ class GoCog(commands.Cog):
         # lookup the playfab_player by ign
         # limit to one more than we'd return so we can tell the user if there are more
         pf_p = None
-        pf_players = self.pfdb.read_players_by_ign(ign=ign, session=session, limit=11)
+        pf_players = []
+        for pf_player_id in self.ign_index.lookup_holders(ign)[:11]:
+            p = self.pfdb.read_player(pf_player_id=pf_player_id, session=session)
+            if p is not None:
+                pf_players.append(p)
+
+        # exact matches on a current ign from the index, or an old one nobody has now, otherwise search the DB
+        indexed = len(pf_players) > 0
+        if not indexed:
+            pf_players = self.pfdb.read_players_by_ign(ign=ign, session=session, limit=11)
 
         if len(pf_players) > 1:
             msg = f'Found {len(pf_players)} players with IGN = "{ign}".  You can run `/go set_ign` with the playfab ID instead of the IGN to select your account.'
@@ -153,7 +193,7 @@ class GoCog(commands.Cog):
                 # *(as of {stats.date.date()})*'
                 msg += f"\n* **{p.ign}** -- playfab ID= **{as_playfab_id(p.id)}**  games={stats.games:,.0f}  wr={stats.calc_wr()*100:.0f}%  kpg={stats.calc_kpg():.1f}"
             raise DiscordUserError(msg, code=ErrorCode.MISC_ERROR)
-        elif len(pf_players) == 1:
+        elif len(pf_players) == 1 and (indexed or ign.lower() in pf_players[0].ign.lower()):
             pf_p = pf_players[0]
         elif is_playfab_str(ign):
             pf_player_id = as_player_id(ign)
@@ -161,6 +201,9 @@ class GoCog(commands.Cog):
 
         if pf_p is None:
             msg = f'Could not find a Population One account with IGN = "{ign}"'
+            if pf_players:
+                # a single fuzzy match is only a suggestion
+                msg += f'.  Did you mean "{pf_players[0].ign}"?'
             raise DiscordUserError(msg, code=ErrorCode.IGN_NOT_FOUND)
 
         if pf_p.go_player is not None:
@@ -181,29 +224,33 @@ class GoCog(commands.Cog):
     async def handle_set_ign(self, func_name: str, interaction: discord.Interaction, player: DiscordUser, ign: str):
         logger.info(f"Running {func_name}({player.name}, {ign})")
         try:
-            with Session(self.engine) as session:
 
-                go_p = self.do_set_ign(player=player, ign=ign, session=session)
-                if go_p.pf_player_id is None or go_p.pf_player is None:
-                    msg = f"Could not set the IGN for {player.name}."
-                    raise DiscordUserError(msg, code=ErrorCode.MISC_ERROR)
+            def db_work() -> str:
+                with Session(self.engine) as session:
 
-                go_rating = self.set_rating_if_needed(go_p.pf_player_id, session, season=_config.go_season)
-                if go_rating is None:
-                    msg = f"Could not find a go_rating for {ign}.  Reach out to @GO_STOOOBE to help fix this."
-                    raise DiscordUserError(msg, code=ErrorCode.DB_FAIL)
+                    go_p = self.do_set_ign(player=player, ign=ign, session=session)
+                    if go_p.pf_player_id is None or go_p.pf_player is None:
+                        msg = f"Could not set the IGN for {player.name}."
+                        raise DiscordUserError(msg, code=ErrorCode.MISC_ERROR)
 
-                session.commit()
+                    go_rating = self.set_rating_if_needed(go_p.pf_player_id, session, season=_config.go_season)
+                    if go_rating is None:
+                        msg = f"Could not find a go_rating for {ign}.  Reach out to @GO_STOOOBE to help fix this."
+                        raise DiscordUserError(msg, code=ErrorCode.DB_FAIL)
 
-                go_rating = self.godb.get_official_rating(go_p.pf_player_id, session, season=_config.go_season)
-                msg = f'IGN for {player.name} set to "{go_p.pf_player.ign}" with GO Rating {go_rating:,.0f}'
+                    session.commit()
 
-                stats = go_p.pf_player.career_stats[-1]
-                msg += f"\n* Account created on {go_p.pf_player.account_created.date()}"
-                msg += f"\n* Career Stats: games={stats.games}, win rate={100.0*stats.wins/stats.games:.0f}%, kpg={stats.kills/stats.games:.1f}"
+                    # go_rating is the official rating, set_rating_if_needed just added it if it was missing
+                    msg = f'IGN for {player.name} set to "{go_p.pf_player.ign}" with GO Rating {go_rating:,.0f}'
 
-                logger.info(msg)
-                await interaction.response.send_message(msg)
+                    stats = go_p.pf_player.career_stats[-1]
+                    msg += f"\n* Account created on {go_p.pf_player.account_created.date()}"
+                    msg += f"\n* Career Stats: games={stats.games}, win rate={100.0*stats.wins/stats.games:.0f}%, kpg={stats.kills/stats.games:.1f}"
+                    return msg
+
+            msg = await self.run_db(db_work)
+            logger.info(msg)
+            await interaction.response.send_message(msg)
 
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
@@ -215,6 +262,22 @@ class GoCog(commands.Cog):
         player = convert_user(interaction.user)
         await self.handle_set_ign("set_ign", interaction, player, ign)
 
+    #
+    # Autocomplete has to answer within Discord's 3 second limit so it only uses the in-memory indexes
+    @set_ign.autocomplete("ign")
+    async def ign_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        if not current:
+            return []
+        return [app_commands.Choice(name=ign, value=ign) for ign in self.ign_index.complete(current, limit=25)]
+
+    #
+    async def team_name_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> List[app_commands.Choice[str]]:
+        with self.team_names_lock:
+            names = self.team_names.search(current, limit=25)
+        return [app_commands.Choice(name=name, value=name) for name in names]
+
     #
     def do_player_info(self, player: DiscordUser) -> str:
         with Session(self.engine) as session:
@@ -262,7 +325,7 @@ class GoCog(commands.Cog):
         player = convert_user(user)
 
         try:
-            msg = self.do_player_info(player)
+            msg = await self.run_db(self.do_player_info, player)
             logger.info(msg)
             await interaction.response.send_message(msg, ephemeral=True)
         except DiscordUserError as err:
@@ -279,9 +342,11 @@ class GoCog(commands.Cog):
         assert len(tpsignups) == 1
 
         team = tpsignups[0].team
+        old_team_name = team.team_name
         team.team_name = new_team_name
         session.add(team)
         session.commit()
+        self.update_team_names(new_team_name, old_team_name)
         return team
 
     #
@@ -305,17 +370,21 @@ class GoCog(commands.Cog):
             player = interaction.user  # type: ignore
 
         try:
-            with Session(self.engine) as session:
-                gosession = self.require_gosession(interaction, session)
-                assert interaction.channel_id is not None
 
-                p = convert_user(player)  # type: ignore
-                logger.info(f"Running rename_team({p.name}, {new_team_name}, {interaction.channel})")  # type: ignore
+            def db_work() -> str:
+                with Session(self.engine) as session:
+                    gosession = self.require_gosession(interaction, session)
+                    assert interaction.channel_id is not None
+
+                    p = convert_user(player)  # type: ignore
+                    logger.info(f"Running rename_team({p.name}, {new_team_name}, {interaction.channel})")  # type: ignore
 
-                team = self.do_rename_team(new_team_name, p, session_id=interaction.channel_id, session=session)
-                msg = f"Team name changed to {team.team_name}"
-                logger.info(msg)
-                await interaction.response.send_message(msg)
+                    team = self.do_rename_team(new_team_name, p, session_id=interaction.channel_id, session=session)
+                    return f"Team name changed to {team.team_name}"
+
+            msg = await self.run_db(db_work)
+            logger.info(msg)
+            await interaction.response.send_message(msg)
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
             await interaction.response.send_message(err.message)
@@ -328,7 +397,12 @@ class GoCog(commands.Cog):
         session_id: int,
         session: Session,
         signup_time: Optional[datetime] = None,
+        dm_source: Optional[str] = None,
     ) -> GoSignup:
+        """
+        The DMs for the signed up players are queued in go_outbox with the signup if dm_source
+        (e.g. the interaction id) is given.
+        """
 
         # make sure no players were skipped
         none_seen_at = None
@@ -358,19 +432,27 @@ class GoCog(commands.Cog):
                 # store the players that need to set their IGN
                 # so we can tell them all at once
                 players_to_set_ign.append(player)
-            else:
-                # make sure all players have ratings
-                player_rating = self.godb.get_official_rating(go_player.pf_player_id, session, season=_config.go_season)
 
-                # use the default rating from the config if it's set
-                if _config.go_rating_default is not None and _config.go_rating_default >= 0:
-                    if player_rating is None:
-                        player_rating = _config.go_rating_default
+        # one query for the whole roster's ratings
+        pf_player_ids = [p.pf_player_id for p in go_players if p is not None and p.pf_player is not None]
+        ratings = self.godb.get_official_ratings(pf_player_ids, session, season=_config.go_season)
+
+        for player, go_player in zip(players, go_players):
+            if go_player is None or go_player.pf_player is None:
+                continue
+
+            # make sure all players have ratings
+            player_rating = ratings.get(go_player.pf_player_id)  # type: ignore
 
-                # if the player has no rating then alert the user
+            # use the default rating from the config if it's set
+            if _config.go_rating_default is not None and _config.go_rating_default >= 0:
                 if player_rating is None:
-                    msg = f"Player {player.name} does not have a GO Rating. Contact @GO_STOOOBE to help fix this."
-                    raise DiscordUserError(msg)
+                    player_rating = _config.go_rating_default
+
+            # if the player has no rating then alert the user
+            if player_rating is None:
+                msg = f"Player {player.name} does not have a GO Rating. Contact @GO_STOOOBE to help fix this."
+                raise DiscordUserError(msg)
 
         if players_to_set_ign:
             msg = ""
@@ -433,32 +515,41 @@ class GoCog(commands.Cog):
         try:
             # if it's a new team
             if team is None:
-                team = self.godb.create_team(
-                    team_name=team_name,
-                    go_players=go_players,
-                    session=session,
-                    rating_limit=rating_limit,
-                    season=_config.go_season,
-                    default_rating=_config.go_rating_default,
-                )
+                try:
+                    team = self.godb.create_team(
+                        team_name=team_name,
+                        go_players=go_players,
+                        session=session,
+                        rating_limit=rating_limit,
+                        season=_config.go_season,
+                        default_rating=_config.go_rating_default,
+                        ratings=ratings,
+                    )
+                except DuplicateRosterError:
+                    # another signup just created the same team, use that one
+                    team = self.godb.read_team_with_roster_key(GoTeam.make_roster_key(discord_ids), session)
 
             if team is None:
                 msg = f"Could not create team in DB"
                 raise DiscordUserError(msg, code=ErrorCode.DB_FAIL)
 
-            signup = self.godb.add_signup(team=team, session_id=session_id, session=session, signup_time=signup_time)
-
             # compose DM's for each signed up player
+            # before add_signup so they're committed to the outbox along with the signup
             date = self.godb.get_session_time(session_id, session)
             if date:
+                signup_number = self.godb.signup_count(session=session, team_id=team.id) + 1
                 ats = [f"<@{r.player.discord_id}>" for r in team.rosters]
                 msg = f'✅ You\'ve been signed up for GO League on team "{team.team_name}".'
                 msg += f"\n- Session Time: **{time_str(date)}**"
                 msg += f"\n- Roster: {', '.join(ats)}"
-                msg += f"\n- Team Signup #{len(team.signups)}"
+                msg += f"\n- Team Signup #{signup_number}"
                 msg += f"\n- Make changes to your signup here: <#{session_id}>"
-                for r in team.rosters:
-                    self.dm_queue.append((r.player.discord_id, msg))
+                if dm_source is not None:
+                    team_dms = [(r.player.discord_id, msg) for r in team.rosters]
+                    self.godb.add_outbox(team_dms, source=dm_source, session=session)
+
+            signup = self.godb.add_signup(team=team, session_id=session_id, session=session, signup_time=signup_time)
+            self.update_team_names(team.team_name)
 
         except GoDbError as err:
             # godb.add_signup checks that the players aren't on a different team that day
@@ -469,6 +560,7 @@ class GoCog(commands.Cog):
 
     #
     @go_group.command(description="Sign up a team for this session")
+    @app_commands.autocomplete(team_name=team_name_autocomplete)
     async def signup(
         self,
         interaction: discord.Interaction,
@@ -482,41 +574,42 @@ class GoCog(commands.Cog):
 
         try:
 
-            with Session(self.engine) as session:
-                self.dm_queue.clear()
-
-                gosession = self.require_gosession(interaction, session)
-                assert interaction.channel_id is not None
-
-                gosession = self.godb.get_session(interaction.channel_id, session)
-                assert gosession
-                if gosession.signup_state != "open":
-                    msg = "Signups are not open for this session."
-                    raise DiscordUserError(msg)
-
-                players: List[Optional[DiscordUser]] = [convert_user(player1)]
-                players.append(None if not player2 else convert_user(player2))
-                players.append(None if not player3 else convert_user(player3))
-                players.append(None if not player4 else convert_user(player4))
-
-                if team_name:
-                    team_name = team_name.strip()
-
-                signup = self.do_signup(
-                    players=players, team_name=team_name, session_id=interaction.channel_id, session=session
-                )
-                session.commit()
-                session.refresh(signup.team)
-                team = signup.team
-
-                igns = [r.player.pf_player.ign for r in team.rosters]
-                msg = f'Signed up "{team.team_name}" for {time_str(gosession.session_time)}'
-                msg += f'\n- Players: {", ".join(igns)}.'
-                msg += f"\n- This is signup #{len(team.signups)} for the team."
-                logger.info(msg)
-                await interaction.response.send_message(msg)
+            def db_work() -> str:
+                with Session(self.engine) as session:
+                    gosession = self.require_gosession(interaction, session)
+                    assert interaction.channel_id is not None
+
+                    if gosession.signup_state != "open":
+                        msg = "Signups are not open for this session."
+                        raise DiscordUserError(msg)
+
+                    players: List[Optional[DiscordUser]] = [convert_user(player1)]
+                    players.append(None if not player2 else convert_user(player2))
+                    players.append(None if not player3 else convert_user(player3))
+                    players.append(None if not player4 else convert_user(player4))
+
+                    signup = self.do_signup(
+                        players=players,
+                        team_name=team_name.strip() if team_name else team_name,
+                        session_id=interaction.channel_id,
+                        session=session,
+                        dm_source=str(interaction.id),
+                    )
+                    session.commit()
+                    session.refresh(signup.team)
+                    team = signup.team
+
+                    igns = [r.player.pf_player.ign for r in team.rosters]
+                    msg = f'Signed up "{team.team_name}" for {time_str(gosession.session_time)}'
+                    msg += f'\n- Players: {", ".join(igns)}.'
+                    msg += f"\n- This is signup #{len(team.signups)} for the team."
+                    return msg
+
+            msg = await self.run_db(db_work)
+            logger.info(msg)
+            await interaction.response.send_message(msg)
 
-                await self.send_dms()
+            await self.send_dms()
 
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
@@ -530,10 +623,11 @@ class GoCog(commands.Cog):
         new_team_name: str | None,
         session_id: int,
         session: Session,
+        dm_source: Optional[str] = None,
     ) -> str:
         # do_cancel will return the signup.team that the player is
         # signed up for on date.  If not signed up it will throw an error.
-        signup = self.do_cancel(player=player, session_id=session_id, session=session)
+        signup = self.do_cancel(player=player, session_id=session_id, session=session, dm_source=dm_source)
         original_time = signup.signup_time
         old_team_name = signup.team.team_name
 
@@ -546,7 +640,12 @@ class GoCog(commands.Cog):
             new_team_name = f"team {random.randint(1000, 9999)}"
 
         signup = self.do_signup(
-            players=players, team_name=new_team_name, session_id=session_id, session=session, signup_time=original_time
+            players=players,
+            team_name=new_team_name,
+            session_id=session_id,
+            session=session,
+            signup_time=original_time,
+            dm_source=dm_source,
         )
 
         team = signup.team
@@ -577,42 +676,52 @@ class GoCog(commands.Cog):
         try:
             self.log_command(interaction)
 
-            with Session(self.engine) as session:
-                session.begin()
-                self.dm_queue.clear()
-
-                gosession = self.require_gosession(interaction, session)
-                assert interaction.channel_id is not None
-
-                if gosession.signup_state == "closed":
-                    msg = "Signups are closed for this session."
-                    raise DiscordUserError(msg)
-
-                # player may or may not be on the new team
-                # but player (the user running the command) must
-                # be on the team being cancelled
-                player = convert_user(interaction.user)
-                players: List[Optional[DiscordUser]] = [convert_user(player1)]
-                players.append(convert_user(player2) if player2 else None)
-                players.append(convert_user(player3) if player3 else None)
-                players.append(convert_user(player4) if player4 else None)
-
-                msg = self.do_change_signup(player, players, new_team_name, interaction.channel_id, session)
-                session.commit()
-
-                logger.info(msg)
-                await interaction.response.send_message(msg)
-                await self.send_dms()
+            # an error rolls back the whole change when the session closes
+            def db_work() -> str:
+                with Session(self.engine) as session:
+                    session.begin()
+
+                    gosession = self.require_gosession(interaction, session)
+                    assert interaction.channel_id is not None
+
+                    if gosession.signup_state == "closed":
+                        msg = "Signups are closed for this session."
+                        raise DiscordUserError(msg)
+
+                    # player may or may not be on the new team
+                    # but player (the user running the command) must
+                    # be on the team being cancelled
+                    player = convert_user(interaction.user)
+                    players: List[Optional[DiscordUser]] = [convert_user(player1)]
+                    players.append(convert_user(player2) if player2 else None)
+                    players.append(convert_user(player3) if player3 else None)
+                    players.append(convert_user(player4) if player4 else None)
+
+                    msg = self.do_change_signup(
+                        player, players, new_team_name, interaction.channel_id, session, dm_source=str(interaction.id)
+                    )
+                    session.commit()
+                    return msg
+
+            msg = await self.run_db(db_work)
+            logger.info(msg)
+            await interaction.response.send_message(msg)
+            await self.send_dms()
 
         except DiscordUserError as err:
-            session.rollback()
             logger.warning(f"Caught error code {err.code}: {err.message}")
             await interaction.response.send_message(err.message)
 
     #
     # Does NOT commit or refresh
     #
-    def do_cancel(self, player: DiscordUser, session_id: int, session: Session) -> GoSignup:
+    def do_cancel(
+        self,
+        player: DiscordUser,
+        session_id: int,
+        session: Session,
+        dm_source: Optional[str] = None,
+    ) -> GoSignup:
         signup = self.godb.get_signup_for_session(player.id, session_id, session)
         if signup is None:
             msg = f"Player {player.name} is not signed up for this session."
@@ -627,6 +736,8 @@ class GoCog(commands.Cog):
         msg += f"\n- {signup_count_before-1} signups still active for the team."
 
         logger.info(f"cancel signup {signup}")
+        # before the delete, flushing it early would leave signup in team.signups for the cascade below
+        self.godb.update_session_counts(session_id, -1, -signup.team.team_size, session)
         session.delete(signup)
 
         # if this was the last signup for the team
@@ -634,8 +745,8 @@ class GoCog(commands.Cog):
         if signup_count_before == 1:
             session.delete(signup.team)
 
-        for did in discord_ids:
-            self.dm_queue.append((did, msg))
+        if dm_source is not None:
+            self.godb.add_outbox([(did, msg) for did in discord_ids], source=dm_source, session=session)
 
         return signup
 
@@ -647,32 +758,37 @@ class GoCog(commands.Cog):
         logger.info(f"{func_name} ids   ({interaction.channel_id}, {player.id})")
 
         try:
-            with Session(self.engine) as session:
-                self.dm_queue.clear()
 
-                gosession = self.require_gosession(interaction, session)
-                assert interaction.channel_id is not None
+            def db_work() -> str:
+                with Session(self.engine) as session:
+                    gosession = self.require_gosession(interaction, session)
+                    assert interaction.channel_id is not None
 
-                if gosession.signup_state == "closed" and func_name != "admin_cancel":
-                    msg = "Signups are closed for this session."
-                    raise DiscordUserError(msg)
+                    if gosession.signup_state == "closed" and func_name != "admin_cancel":
+                        msg = "Signups are closed for this session."
+                        raise DiscordUserError(msg)
 
-                signup = self.do_cancel(player=player, session_id=interaction.channel_id, session=session)
+                    signup = self.do_cancel(
+                        player=player, session_id=interaction.channel_id, session=session, dm_source=str(interaction.id)
+                    )
 
-                team_id = signup.team.id
-                team_name = signup.team.team_name
-                session.commit()
+                    team_id = signup.team.id
+                    team_name = signup.team.team_name
+                    session.commit()
 
-                team = self.godb.read_team(team_id=team_id, session=session)
-                signups_remaining = 0
-                if team:
-                    signups_remaining = len(team.signups)
+                    team = self.godb.read_team(team_id=team_id, session=session)
+                    signups_remaining = 0
+                    if team:
+                        signups_remaining = len(team.signups)
 
-                msg = f'Cancelled "{team_name}" for session on {time_str(gosession.session_time)}.'
-                msg += f"\nThere are {signups_remaining} signups still active for the team."
-                logger.info(msg)
-                await interaction.response.send_message(msg)
-                await self.send_dms()
+                    msg = f'Cancelled "{team_name}" for session on {time_str(gosession.session_time)}.'
+                    msg += f"\nThere are {signups_remaining} signups still active for the team."
+                    return msg
+
+            msg = await self.run_db(db_work)
+            logger.info(msg)
+            await interaction.response.send_message(msg)
+            await self.send_dms()
 
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
@@ -701,42 +817,35 @@ class GoCog(commands.Cog):
         try:
             self.log_command(interaction)
 
-            with Session(self.engine) as session:
-                msg = ""
-                gosession = self.require_gosession(interaction, session)
-                assert interaction.channel_id is not None
-
-                await interaction.response.defer()
-
-                statement = select(GoHost).where(GoHost.session_id == gosession.id)
-                statement = statement.where(GoHost.status == "confirmed")
-                hosts = session.exec(statement).all()
-
-                teams = self.godb.get_teams_for_session(session_id=interaction.channel_id, session=session)
-                msg = ""
-                player_count = 0
-                for i, team in enumerate(teams):
-                    session.refresh(team)
-                    players = [r.player for r in team.rosters]
-                    players_str = ""
-                    for p in players:
-                        player_count += 1
-                        session.refresh(p.pf_player)
-                        if players_str:
-                            players_str += ", "
-                        players_str += escmd(p.pf_player.ign)
-                    rating_str = f"{team.team_rating:,.0f}" if team.team_rating else "None"
-                    msg += f"{chr(ord('A')+i)}: **{escmd(team.team_name)}** (*{rating_str}*) -- {players_str}\n"
-
-                header = f"**teams:** {len(teams)}"
-                header += f"\n**players:** {player_count}"
-                header += f"\n**hosts:** {', '.join([f'<@{h.host_did}>' for h in hosts])}"
-                header += f"\n\n"
-                msg = header + msg
-
-                logger.info(msg)
-                # await interaction.response.send_message(msg)
-                await interaction.followup.send(msg)
+            # check for the session before deferring so that error still goes out as the response
+            gosession_id = await self.run_db(self.get_gosession_id, interaction)
+            assert interaction.channel_id is not None
+
+            await interaction.response.defer()
+
+            def db_work() -> str:
+                with Session(self.engine) as session:
+                    hosts = self.godb.get_hosts(session_id=gosession_id, session=session, status="confirmed")
+
+                    teams = self.godb.read_team_listings(session_id=gosession_id, session=session)
+                    msg = ""
+                    player_count = 0
+                    for i, team in enumerate(teams):
+                        player_count += len(team.igns)
+                        players_str = ", ".join(escmd(ign) for ign in team.igns)
+                        rating_str = f"{team.team_rating:,.0f}" if team.team_rating else "None"
+                        msg += f"{chr(ord('A')+i)}: **{escmd(team.team_name)}** (*{rating_str}*) -- {players_str}\n"
+
+                    header = f"**teams:** {len(teams)}"
+                    header += f"\n**players:** {player_count}"
+                    header += f"\n**hosts:** {', '.join([f'<@{h.host_did}>' for h in hosts])}"
+                    header += f"\n\n"
+                    return header + msg
+
+            msg = await self.run_db(db_work)
+            logger.info(msg)
+            # await interaction.response.send_message(msg)
+            await interaction.followup.send(msg)
 
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
@@ -744,34 +853,36 @@ class GoCog(commands.Cog):
 
     #
     @go_group.command(name="list-schedule", description="List the schedule.")
-    async def list_schedule(self, interaction: discord.Interaction):
+    async def list_schedule(self, interaction: discord.Interaction, upcoming: bool = False):
         try:
             self.log_command(interaction)
 
-            with Session(self.engine) as session:
-
-                statement = select(GoSession).order_by(GoSession.session_time)  # type: ignore
-                sessions: List[GoSession] = session.exec(statement).all()  # type: ignore
-                msg = ""
-                for s in sessions:
-                    # skip the dev channel
-                    if s.id == 1127111098290675864:
-                        # unless we're in the dev channel
-                        if interaction.channel_id != 1127111098290675864:
-                            continue
-                    player_count = 0
-                    for signup in s.signups:
-                        player_count += signup.team.team_size
-                    state_str = ""
-                    if s.signup_state != "closed":
-                        state_str = f" (signups *{s.signup_state}*)"
-                    msg += f"<#{s.id}> -- {len(s.signups)} teams  {player_count} players{state_str}\n"
-
-                if not msg:
-                    msg = "No sessions found."
-
-                logger.info(msg)
-                await interaction.response.send_message(msg)
+            def db_work() -> str:
+                with Session(self.engine) as session:
+
+                    since = None
+                    if upcoming:
+                        since = datetime.combine(datetime.now().date(), datetime.min.time())
+                    summaries = self.godb.read_session_summaries(session=session, since=since)
+                    msg = ""
+                    for s in summaries:
+                        # skip the dev channel
+                        if s.session_id == 1127111098290675864:
+                            # unless we're in the dev channel
+                            if interaction.channel_id != 1127111098290675864:
+                                continue
+                        state_str = ""
+                        if s.signup_state != "closed":
+                            state_str = f" (signups *{s.signup_state}*)"
+                        msg += f"<#{s.session_id}> -- {s.team_count} teams  {s.player_count} players{state_str}\n"
+
+                    if not msg:
+                        msg = "No sessions found."
+                    return msg
+
+            msg = await self.run_db(db_work)
+            logger.info(msg)
+            await interaction.response.send_message(msg)
 
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
@@ -822,152 +933,49 @@ class GoCog(commands.Cog):
         if player_count == 0:
             msg = "No players signed up for this session."
             raise DiscordUserError(msg)
-        elif player_count < 30:
-            lobbies_needed = 1
-        elif player_count <= 48:
-            lobbies_needed = 2
-        else:
-            lobbies_needed = 3
-        return lobbies_needed
-
-    #
-    def snake_draft_inc(self, i: int, counting_up: bool, max_i: int) -> tuple[int, bool]:
-        if counting_up:
-            if i == max_i - 1:
-                counting_up = False
-            else:
-                i += 1
-        else:
-            if i == 0:
-                counting_up = True
-            else:
-                i -= 1
-        return i, counting_up
+        return lobbies_needed(player_count)
 
     #
     # Accepts teams in signup order (lower index is earlier signup)
-    def do_sort_lobbies(self, hosts: List[GoHost], teams: List[GoTeam]) -> Dict[int, List[GoTeam]]:
-
+    def plan_lobbies(self, hosts: List[GoHost], teams: List[GoTeam]) -> LobbyAssignment:
         player_count = sum([t.team_size for t in teams])
         lobby_count = self.get_lobby_count(player_count)
         host_dids = {h.host_did for h in hosts}
 
-        print(f"{player_count = }")
-        print(f"{host_dids = }")
-
+        lobby_teams = []
         hosts_on_teams = set()
-        team_to_host: Dict[int, int] = {}
         for team in teams:
-            for r in team.rosters:
-                if team.id and r.player.discord_id in host_dids:
-                    team_to_host[team.id] = r.player.discord_id
-                    hosts_on_teams.add(r.player.discord_id)
-
-        hosts_not_on_teams = host_dids - hosts_on_teams
-        possible_host_count = len(hosts_not_on_teams) + len(team_to_host)
-
-        print(f"{hosts_on_teams = }")
-        print(f"{hosts_not_on_teams = }")
-        print(f"{possible_host_count = }")
-
-        # check team_to_host b/c two hosts on the same team only count
-        # as one host
-        if possible_host_count < lobby_count:
-            lobby_count = possible_host_count
-            # msg = f"Error: Not enough hosts ({len(team_to_host)}) for the number of lobbies needed ({lobby_count})."
-            # raise DiscordUserError(msg)
-
-        max_players = lobby_count * 24
-        print(f"{lobby_count = }")
-        print(f"{max_players = }")
-
-        # filter in/out which teams signed up early enough to play
-        teams_in = []
-        teams_out = []
-        player_count_in = 0
-        for team in teams:
-            if player_count_in + team.team_size > max_players:
-                teams_out.append(team)
-            else:
-                teams_in.append(team)
-                player_count_in += team.team_size
-
-        i = 0
-        counting_up = True  # snake draft direction
-        lobby_to_nplayers = defaultdict(int)
-        lobby_to_teams = defaultdict(list)
-        lobby_to_host: Dict[int, int] = {}
-
-        # highest rating at end of queue
-        teams_in_queue = sorted(teams_in, key=lambda t: t.team_rating, reverse=True)
-
-        j = 0
-        n_failed_to_fit = 0
-        while len(teams_in_queue):
-
-            if j == len(teams_in_queue):
-                # if we cant fit any more teams into lobby i
-                # then advance to the next lobby and start at j=0 again
-                j = 0
-                n_failed_to_fit += 1
-                i, counting_up = self.snake_draft_inc(i, counting_up, max_i=lobby_count)
-
-                if n_failed_to_fit >= lobby_count * 2:
-                    # if we've tried out all the lobbies and still cant fit
-                    # then break out of the loop
-                    break
-                continue
-
-            team: GoTeam = teams_in_queue[j]
             assert team.id is not None
+            # two hosts on the same team only count as one host
+            host_did = next((r.player.discord_id for r in team.rosters if r.player.discord_id in host_dids), None)
+            if host_did is not None:
+                hosts_on_teams.add(host_did)
+            lobby_teams.append(
+                LobbyTeam(
+                    team_id=team.id,
+                    team_size=team.team_size,
+                    team_rating=team.team_rating or 0.0,
+                    host_did=host_did,
+                )
+            )
 
-            if lobby_to_nplayers[i] + team.team_size > 24:
-                # if the team wont fit, skip it for now
-                # look at the next team for the same lobby[i]
-                j += 1
-                continue
+        hosts_not_on_teams = sorted(host_dids - hosts_on_teams)
+        assignment = assign_lobbies(lobby_teams, hosts_not_on_teams, lobby_count)
+        logger.info(
+            f"Sorted {player_count} players into lobbies {assignment.players}, "
+            f"rating spread {assignment.spread:,.1f}, waitlist {len(assignment.waitlist)}"
+        )
+        return assignment
 
-            # if team has a host on the roster
-            if team.id in team_to_host:
-                # if we already have a host for this lobby
-                if i in lobby_to_host:
-                    # then look at the next team for this lobby
-                    j += 1
-                    continue
-                else:
-                    lobby_to_host[i] = team_to_host[team.id]
-
-            # if the team fits in the lobby
-            # remove it from the queue and reset j to the beginning
-            # of the queue (the highest rated team remainig to sort)
-            teams_in_queue.pop(j)
-            j = 0
-            lobby_to_nplayers[i] += team.team_size
-            lobby_to_teams[i].append(team)
-            i, counting_up = self.snake_draft_inc(i, counting_up, max_i=lobby_count)
-
-        print("lobby_to_nplayers")
-        pprint.pp(lobby_to_nplayers)
-        print("lobby_to_hosts")
-        pprint.pp(lobby_to_host)
-        print("lobby_to_teams")
-        pprint.pp(lobby_to_teams)
-
-        # assert len(lobby_to_hosts) == lobby_count
-        # for i in range(lobby_count):
-        #     assert i in lobby_to_hosts
-        #     assert i in lobby_to_teams
-
-        # if the lobby doesn't have a host assigned
-        # then assign one from the list of hosts not on a team
-        for lobby_i in lobby_to_teams:
-            if lobby_i not in lobby_to_host:
-                lobby_to_host[lobby_i] = hosts_not_on_teams.pop()
-
-        # change to the map key from lobby index to host id
-        host_to_teams = {host_did: lobby_to_teams[lobby_i] for lobby_i, host_did in lobby_to_host.items()}
-
-        return host_to_teams
+    #
+    # Accepts teams in signup order (lower index is earlier signup)
+    def do_sort_lobbies(self, hosts: List[GoHost], teams: List[GoTeam]) -> Dict[int, List[GoTeam]]:
+        assignment = self.plan_lobbies(hosts, teams)
+        id_to_team = {team.id: team for team in teams}
+        return {
+            host_did: [id_to_team[team_id] for team_id in team_ids]
+            for host_did, team_ids in zip(assignment.hosts, assignment.lobbies)
+        }
 
     #
     @admin_group.command(name="sort-lobbies", description="Sort the teams in the session into lobbies.")
@@ -976,65 +984,70 @@ class GoCog(commands.Cog):
             self.log_command(interaction)
             self.check_admin_permissions(interaction)
 
-            with Session(self.engine) as session:
-                await interaction.response.defer(ephemeral=True)
-
-                gosession = self.require_gosession(interaction, session)
-                assert interaction.channel_id
-
-                lobbies, hosts, teams, signups = self.load_session_data(interaction, session)
-
-                host_to_teams = self.do_sort_lobbies(hosts, teams)
-
-                for host_did, teams in sorted(host_to_teams.items()):
-                    print(f"host {host_did}")
-                    for t in teams:
-                        print(f"  {t}")
-
-                self.upload_sorted_lobbies(gosession, lobbies, signups, host_to_teams, session)
-
-                # reload the session data from the DB since it becomes invalidated after commmit
-                lobbies, hosts, teams, signups = self.load_session_data(interaction, session)
-
-                print("")
-                print(" INFO ")
-                print("")
-                for h in hosts:
-                    print(f"Host: {h}")
-                print("")
-                for su in signups:
-                    print(f"Signup: {su}")
-                print("")
-                lobby_player_count = defaultdict(int)
-                for l in lobbies:
-                    print(f"Lobby: {l}")
-                    print(f"  {l.host}")
-                    print(f"  {l.session}")
-                    print(f"  n signups: {len(l.signups)}")
-                    for su in l.signups:
-                        lobby_player_count[l.id] += su.team.team_size
-
-                team_ids_assigned = set()
-                msg = ""
-                for i, lobby in enumerate(lobbies):
-                    msg += f"## Lobby {i+1} hosted by <@{lobby.host_did}>\n"
-                    msg += f"{len(lobby.signups)} teams, {lobby_player_count[lobby.id]}  players\n"
-                    for j, signup in enumerate(sorted(lobby.signups, key=lambda _: -1 * _.team.team_rating)):
-                        team_ids_assigned.add(signup.team.id)
-                        igns = [r.player.pf_player.ign for r in signup.team.rosters]
-                        msg += f"{chr(ord('A')+j)}: **{escmd(signup.team.team_name)}** *({signup.team.team_rating:,.0f})* -- {', '.join(igns)}\n"
-
-                teams_not_assigned = [t for t in teams if t.id not in team_ids_assigned]
-                if teams_not_assigned:
-                    msg += f"## Waitlist:\n"
-                    for j, team in enumerate(teams_not_assigned):
-                        if team.id not in team_ids_assigned:
-                            igns = [r.player.pf_player.ign for r in team.rosters]
-                            msg += f"{chr(ord('A')+j)}: **{escmd(team.team_name)}** *({team.team_rating:,.0f})* -- {', '.join(igns)}\n"
-                            j += 1
-
-                logger.info(msg)
-                await interaction.followup.send(msg, ephemeral=True)
+            await interaction.response.defer(ephemeral=True)
+
+            # loading, sorting and saving the lobbies all happen on a DB worker thread
+            def db_work() -> str:
+                with Session(self.engine) as session:
+                    gosession = self.require_gosession(interaction, session)
+                    assert interaction.channel_id
+
+                    lobbies, hosts, teams, signups = self.load_session_data(interaction, session)
+
+                    host_to_teams = self.do_sort_lobbies(hosts, teams)
+
+                    for host_did, teams in sorted(host_to_teams.items()):
+                        print(f"host {host_did}")
+                        for t in teams:
+                            print(f"  {t}")
+
+                    self.upload_sorted_lobbies(gosession, lobbies, signups, host_to_teams, session)
+
+                    # reload the session data from the DB since it becomes invalidated after commmit
+                    lobbies, hosts, teams, signups = self.load_session_data(interaction, session)
+
+                    print("")
+                    print(" INFO ")
+                    print("")
+                    for h in hosts:
+                        print(f"Host: {h}")
+                    print("")
+                    for su in signups:
+                        print(f"Signup: {su}")
+                    print("")
+                    lobby_player_count = defaultdict(int)
+                    for l in lobbies:
+                        print(f"Lobby: {l}")
+                        print(f"  {l.host}")
+                        print(f"  {l.session}")
+                        print(f"  n signups: {len(l.signups)}")
+                        for su in l.signups:
+                            lobby_player_count[l.id] += su.team.team_size
+
+                    team_ids_assigned = set()
+                    msg = ""
+                    for i, lobby in enumerate(lobbies):
+                        msg += f"## Lobby {i+1} hosted by <@{lobby.host_did}>\n"
+                        msg += f"{len(lobby.signups)} teams, {lobby_player_count[lobby.id]}  players\n"
+                        for j, signup in enumerate(sorted(lobby.signups, key=lambda _: -1 * _.team.team_rating)):
+                            team_ids_assigned.add(signup.team.id)
+                            igns = [r.player.pf_player.ign for r in signup.team.rosters]
+                            msg += f"{chr(ord('A')+j)}: **{escmd(signup.team.team_name)}** *({signup.team.team_rating:,.0f})* -- {', '.join(igns)}\n"
+
+                    teams_not_assigned = [t for t in teams if t.id not in team_ids_assigned]
+                    if teams_not_assigned:
+                        msg += f"## Waitlist:\n"
+                        for j, team in enumerate(teams_not_assigned):
+                            if team.id not in team_ids_assigned:
+                                igns = [r.player.pf_player.ign for r in team.rosters]
+                                msg += f"{chr(ord('A')+j)}: **{escmd(team.team_name)}** *({team.team_rating:,.0f})* -- {', '.join(igns)}\n"
+                                j += 1
+
+                    return msg
+
+            msg = await self.run_db(db_work)
+            logger.info(msg)
+            await interaction.followup.send(msg, ephemeral=True)
 
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
@@ -1075,17 +1088,14 @@ class GoCog(commands.Cog):
 
     #
     def load_session_data(self, interaction, session):
-        statement = select(GoLobby).where(GoLobby.session_id == interaction.channel_id)
-        lobbies = session.exec(statement).all()
+        lobbies = self.godb.get_lobbies(session_id=interaction.channel_id, session=session)
 
         for lobby in lobbies:
             if lobby.lobby_code is not None:
                 msg = f"Error: Cannot sort lobbies after lobby code has been set."
                 raise DiscordUserError(msg)
 
-        statement = select(GoHost).where(GoHost.session_id == interaction.channel_id)
-        statement = statement.where(GoHost.status == "confirmed")
-        hosts = session.exec(statement).all()
+        hosts = self.godb.get_hosts(session_id=interaction.channel_id, session=session, status="confirmed")
 
         statement = select(GoTeam, GoSignup).where(GoSignup.session_id == interaction.channel_id)
         statement = statement.where(GoSignup.team_id == GoTeam.id)
@@ -1132,6 +1142,11 @@ class GoCog(commands.Cog):
             msg = f"You dont have permission to use this command."
             raise DiscordUserError(msg)
 
+    #
+    def get_gosession_id(self, interaction) -> int:
+        with Session(self.engine) as session:
+            return self.require_gosession(interaction, session).id
+
     #
     def require_gosession(self, interaction, session):
         gosession = self.godb.get_session(interaction.channel_id, session)
@@ -1173,6 +1188,13 @@ class GoCog(commands.Cog):
             logger.warning(f"Caught error code {err.code}: {err.message}")
             await interaction.response.send_message(err.message)
 
+    #
+    @admin_set_ign.autocomplete("ign")
+    async def admin_ign_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> List[app_commands.Choice[str]]:
+        return await self.ign_autocomplete(interaction, current)
+
     #
     @admin_group.command(name="cancel", description="Admin tool to cancel a signup")
     async def admin_cancel(self, interaction: discord.Interaction, player: discord.Member):
@@ -1198,12 +1220,15 @@ class GoCog(commands.Cog):
                 msg = "Error with discord -- cannot get channel info."
                 raise DiscordUserError(msg)
 
-            with Session(self.engine) as session:
-                session_id = interaction.channel_id
-                self.godb.set_session_time(session_id=session_id, session_time=date, session=session)
-                msg = f'Session date for "{interaction.channel}" set to {time_str(date)}'  # type: ignore
-                logger.info(msg)
-                await interaction.response.send_message(msg)
+            def db_work() -> None:
+                with Session(self.engine) as session:
+                    session_id = interaction.channel_id
+                    self.godb.set_session_time(session_id=session_id, session_time=date, session=session)
+
+            await self.run_db(db_work)
+            msg = f'Session date for "{interaction.channel}" set to {time_str(date)}'  # type: ignore
+            logger.info(msg)
+            await interaction.response.send_message(msg)
 
         except parser.ParserError as err:
             msg = f"Error: Could not parse date string '{date_time}'"
@@ -1221,12 +1246,16 @@ class GoCog(commands.Cog):
             self.log_command(interaction)
             self.check_admin_permissions(interaction)
 
-            with Session(self.engine) as session:
-                gosession = self.require_gosession(interaction, session)
-                msg = f'Session time for "{interaction.channel}" is {time_str(gosession.session_time)}.'
-                msg += f"\nSignups are {gosession.signup_state}."
-                logger.info(msg)
-                await interaction.response.send_message(msg)
+            def db_work() -> str:
+                with Session(self.engine) as session:
+                    gosession = self.require_gosession(interaction, session)
+                    msg = f'Session time for "{interaction.channel}" is {time_str(gosession.session_time)}.'
+                    msg += f"\nSignups are {gosession.signup_state}."
+                    return msg
+
+            msg = await self.run_db(db_work)
+            logger.info(msg)
+            await interaction.response.send_message(msg)
 
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
@@ -1238,15 +1267,17 @@ class GoCog(commands.Cog):
             self.log_command(interaction)
             self.check_admin_permissions(interaction)
 
-            with Session(self.engine) as session:
-                gosession = self.require_gosession(interaction, session)
-                gosession.signup_state = state
-                session.add(gosession)
-                session.commit()
+            def db_work() -> None:
+                with Session(self.engine) as session:
+                    gosession = self.require_gosession(interaction, session)
+                    gosession.signup_state = state
+                    session.add(gosession)
+                    session.commit()
 
-                msg = f"Session signups set to {state} for {interaction.channel}"
-                logger.info(msg)
-                await interaction.response.send_message(msg)
+            await self.run_db(db_work)
+            msg = f"Session signups set to {state} for {interaction.channel}"
+            logger.info(msg)
+            await interaction.response.send_message(msg)
 
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
@@ -1274,18 +1305,20 @@ class GoCog(commands.Cog):
             self.log_command(interaction)
             self.check_admin_permissions(interaction)
 
-            with Session(self.engine) as session:
-                gosession = self.require_gosession(interaction, session)
+            def db_work() -> None:
+                with Session(self.engine) as session:
+                    gosession = self.require_gosession(interaction, session)
 
-                goplayer = self.godb.read_player(player.id, session)
-                if not goplayer:
-                    raise DiscordUserError(f"{player.name} needs to run `/go set_ign`.")
+                    goplayer = self.godb.read_player(player.id, session)
+                    if not goplayer:
+                        raise DiscordUserError(f"{player.name} needs to run `/go set_ign`.")
 
-                self.godb.set_host(goplayer.discord_id, gosession.id, "confirmed", session)
+                    self.godb.set_host(goplayer.discord_id, gosession.id, "confirmed", session)
 
-                msg = f"<@{goplayer.discord_id}> set as host for {interaction.channel}."
-                logger.info(msg)
-                await interaction.response.send_message(msg)
+            await self.run_db(db_work)
+            msg = f"<@{player.id}> set as host for {interaction.channel}."
+            logger.info(msg)
+            await interaction.response.send_message(msg)
 
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
@@ -1298,39 +1331,150 @@ class GoCog(commands.Cog):
             self.log_command(interaction)
             self.check_admin_permissions(interaction)
 
-            with Session(self.engine) as session:
-                gosession = self.require_gosession(interaction, session)
-                self.godb.remove_host(player.id, gosession.id, session)
+            def db_work() -> None:
+                with Session(self.engine) as session:
+                    gosession = self.require_gosession(interaction, session)
+                    self.godb.remove_host(player.id, gosession.id, session)
 
-                msg = f"<@{player.id}> removed as host for {interaction.channel}."
-                logger.info(msg)
-                await interaction.response.send_message(msg)
+            await self.run_db(db_work)
+            msg = f"<@{player.id}> removed as host for {interaction.channel}."
+            logger.info(msg)
+            await interaction.response.send_message(msg)
 
         except DiscordUserError as err:
             logger.warning(f"Caught error code {err.code}: {err.message}")
             await interaction.response.send_message(err.message)
 
     #
+    # Starts sending what was just committed to go_outbox and returns right away
     async def send_dms(self):
         if self.dms_enabled:
-            for discord_id, message in self.dm_queue:
-                user = self.bot.get_user(discord_id)
-                if user is None:
-                    continue
-                await user.send(message)
+            self.outbox.kick()
+
+    #
+    def do_add_outbox(self, dms: List[DmIntent], source: str) -> None:
+        with Session(self.engine) as session:
+            self.godb.add_outbox(dms, source=source, session=session)
+            session.commit()
 
     #
-    async def alert_users(self, discord_ids: List[int], message: str):
+    # source makes the alert idempotent, sending the same message with the same source twice only queues it once
+    async def alert_users(self, discord_ids: List[int], message: str, source: Optional[str] = None):
+        if source is None:
+            source = uuid.uuid4().hex
+        await self.run_db(self.do_add_outbox, [(discord_id, message) for discord_id in discord_ids], source)
+        await self.send_dms()
+
+    #
+    # anything left by a restart or a failed send
+    @tasks.loop(seconds=30)
+    async def dispatch_outbox(self):
         if self.dms_enabled:
-            for discord_id in discord_ids:
-                user = self.bot.get_user(discord_id)
-                if user is None:
-                    continue
-                await user.send(message)
+            await self.outbox.drain_and_log()
+
+    #
+    @dispatch_outbox.before_loop
+    async def before_dispatch_outbox(self):
+        # users can't be looked up until the bot has connected
+        await self.bot.wait_until_ready()
+
+    #
+    def do_refresh_indexes(self) -> None:
+        with Session(self.engine) as session:
+            self.ign_index.refresh(session)
+
+            # there aren't many teams so rebuild and swap in a new trie
+            with self.team_names_lock:
+                self.team_name_edits = []
+            team_names = PrefixTrie()
+            for team_name in session.exec(select(GoTeam.team_name)):
+                team_names.insert(team_name, team_name)
+
+            with self.team_names_lock:
+                # the select may have missed signups and renames that committed while it ran
+                for old_team_name, new_team_name in self.team_name_edits:
+                    if old_team_name is not None:
+                        team_names.remove(old_team_name, old_team_name)
+                    team_names.insert(new_team_name, new_team_name)
+                self.team_names = team_names
+                self.team_name_edits = None
+
+    #
+    # called after the team is committed
+    def update_team_names(self, new_team_name: str, old_team_name: Optional[str] = None) -> None:
+        with self.team_names_lock:
+            if old_team_name is not None:
+                self.team_names.remove(old_team_name, old_team_name)
+            self.team_names.insert(new_team_name, new_team_name)
+            if self.team_name_edits is not None:
+                self.team_name_edits.append((old_team_name, new_team_name))
+
+    #
+    def do_warm_ratings(self) -> int:
+        with Session(self.engine) as session:
+            return self.godb.rating_cache.warm(session, season=_config.go_season)
+
+    #
+    @admin_group.command(name="reload-ratings", description="Reload this season's GO Ratings from the DB")
+    async def reload_ratings(self, interaction: discord.Interaction):
+        try:
+            self.log_command(interaction)
+            self.check_admin_permissions(interaction)
+
+            await interaction.response.defer(ephemeral=True)
+            count = await self.run_db(self.do_warm_ratings)
+            msg = f"Reloaded {count:,} GO Ratings for {_config.go_season}."
+            logger.info(msg)
+            await interaction.followup.send(msg, ephemeral=True)
+        except DiscordUserError as err:
+            logger.warning(f"Caught error code {err.code}: {err.message}")
+            await interaction.response.send_message(err.message)
+
+    #
+    def do_reconcile_session_counts(self) -> int:
+        # signups only change around the sessions still coming up, older ones are left alone
+        since = datetime.now() - timedelta(days=1)
+        with Session(self.engine) as session:
+            return self.godb.reconcile_session_counts(session, since=since)
+
+    #
+    @tasks.loop(hours=1)
+    async def reconcile_session_counts(self):
+        try:
+            await self.run_db(self.do_reconcile_session_counts)
+        except Exception as err:
+            logger.error(f"reconcile_session_counts failed: {err}")
+
+    #
+    @tasks.loop(minutes=5)
+    async def refresh_indexes(self):
+        try:
+            await self.run_db(self.do_refresh_indexes)
+        except Exception as err:
+            logger.error(f"refresh_indexes failed: {err}")
 
     #
     async def cog_load(self):
         logger.info(f"cog_load()")
+        try:
+            await self.run_db(self.do_warm_ratings)
+        except Exception as err:
+            # ratings are read from the DB until a reload-ratings succeeds
+            logger.error(f"Warming the rating cache failed: {err}")
+        self.refresh_indexes.start()
+        self.reconcile_session_counts.start()
+        self.dm_delivery.start()
+        self.dispatch_outbox.start()
+
+    #
+    async def cog_unload(self):
+        logger.info(f"cog_unload()")
+        self.refresh_indexes.cancel()
+        self.reconcile_session_counts.cancel()
+        self.dispatch_outbox.cancel()
+        self.outbox.stop()
+        await self.dm_delivery.stop()
+        self.db_pool.shutdown(wait=False)
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -1,23 +1,30 @@
 from __future__ import annotations
 
+import hashlib
 from datetime import date as datetype
 from datetime import datetime
-from typing import List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
 
 from pydantic import BaseModel
-from sqlmodel import Session, delete, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, delete, func, or_, select, update
 
-from go.bot.exceptions import GoDbError
+from go.bot.exceptions import DuplicateRosterError, GoDbError
 from go.bot.logger import create_logger
 from go.bot.models import (
     GoHost,
+    GoLobby,
+    GoOutbox,
+    GoParticipant,
     GoPlayer,
     GoRatings,
     GoRoster,
     GoSession,
     GoSignup,
     GoTeam,
+    PfPlayer,
 )
+from go.bot.rating_cache import RatingCache
 
 logger = create_logger(__name__)
 
@@ -28,11 +35,29 @@ class GoTeamPlayerSignup(BaseModel):
     signup: GoSignup
 
 
+class GoTeamListing(BaseModel):
+    team_id: int
+    team_name: str
+    team_rating: Optional[float]
+    signup_time: datetime
+    # the players' igns, or their discord names if they have no PfPlayer
+    igns: List[str]
+
+
+class GoSessionSummary(BaseModel):
+    session_id: int
+    session_time: datetime
+    signup_state: str
+    team_count: int
+    player_count: int
+
+
 class GoDB:
 
     #
     def __init__(self):
-        pass
+        # official ratings are served from here once a season has been warmed
+        self.rating_cache = RatingCache()
 
     #
     def player_exists(self, discord_id: int, session: Session) -> bool:
@@ -86,21 +111,24 @@ class GoDB:
         rating_limit: Optional[float],
         season: str,
         default_rating: Optional[float] = None,
+        ratings: Optional[Dict[int, float]] = None,
     ) -> GoTeam:
+        """
+        ratings are the players' official ratings by pf_player_id if the caller already has them.
+        """
         logger.info(f"Creating GoTeam {team_name = } in DB")
         ids = {p.discord_id for p in go_players}
         team_size = len(go_players)
         if len(ids) != team_size:
             raise GoDbError(f"Cannot create team: contains duplicate players")
+        roster_key = GoTeam.make_roster_key(ids)
 
-        # make sure team doesn't already exist
-        existing_team = self.read_team_with_roster(discord_ids=ids, session=session)
-        if existing_team is not None:
-            raise GoDbError(f"Team with roster { {p.discord_name for p in go_players} } already exists.")
+        if ratings is None:
+            ratings = self.get_official_ratings([p.pf_player_id for p in go_players], session, season)
 
         team_rating = 0.0
         for go_p in go_players:
-            player_rating = self.get_official_rating(go_p.pf_player_id, session, season)
+            player_rating = ratings.get(go_p.pf_player_id)  # type: ignore
             if player_rating is None:
                 player_rating = default_rating
             if player_rating is None:
@@ -117,16 +145,23 @@ class GoDB:
             else:
                 raise GoDbError(f"Team rating {team_rating:,.0f} exceeds the cap of {rating_limit:,.0f}")
 
-        team = GoTeam(team_name=team_name, team_size=team_size, team_rating=team_rating)
-        session.add(team)
-        session.commit()
-        session.refresh(team)
-
-        assert team.id is not None
-
-        for go_p in go_players:
-            r = GoRoster(team_id=team.id, discord_id=go_p.discord_id)
-            session.add(r)
+        # the unique roster_key makes the DB reject a second team with the same players,
+        # even if another signup is creating it at the same time
+        # in a savepoint so a collision only undoes this team, not the rest of the caller's transaction
+        team = GoTeam(team_name=team_name, team_size=team_size, team_rating=team_rating, roster_key=roster_key)
+        try:
+            with session.begin_nested():
+                session.add(team)
+                session.flush()
+                assert team.id is not None
+
+                for go_p in go_players:
+                    r = GoRoster(team_id=team.id, discord_id=go_p.discord_id)
+                    session.add(r)
+        except IntegrityError as err:
+            if self.read_team_with_roster_key(roster_key=roster_key, session=session) is not None:
+                raise DuplicateRosterError(f"Team with roster { {p.discord_name for p in go_players} } already exists.")
+            raise GoDbError(f"Cannot create team {team_name}: {err.orig}")
         session.commit()
         session.refresh(team)
 
@@ -143,8 +178,10 @@ class GoDB:
         return session.exec(statement).one()
 
     #
-    def signup_count(self, session):
+    def signup_count(self, session, team_id: Optional[int] = None):
         statement = select(func.count(GoSignup.team_id))  # type: ignore
+        if team_id is not None:
+            statement = statement.where(GoSignup.team_id == team_id)
         return session.exec(statement).one()
 
     #
@@ -156,24 +193,87 @@ class GoDB:
         if team.id is None:
             raise GoDbError("Cannot add signup: team has no id")
 
-        current_signups = self.read_player_signups(session_id=session_id, session=session)
         discord_ids = {r.discord_id for r in team.rosters}
-
-        for tp in current_signups:
-            if tp.player.discord_id in discord_ids:
-                # player = self.read_player(discord_id=tp.player.discord_id, session=session)
-                raise GoDbError(
-                    f'Player {tp.player.discord_name} is already signed up in this session for team "{tp.team.team_name}".'
-                )
+        self.check_signup_conflict(session_id=session_id, discord_ids=discord_ids, session=session)
 
         if signup_time is None:
             signup_time = datetime.now()
 
         signup = GoSignup(team_id=team.id, session_id=session_id, signup_time=signup_time)
-        session.add(signup)
+        try:
+            # in a savepoint so a conflict doesn't roll back the rest of the caller's transaction
+            with session.begin_nested():
+                session.add(signup)
+                for discord_id in discord_ids:
+                    session.add(GoParticipant(session_id=session_id, discord_id=discord_id, team_id=team.id))
+                self.update_session_counts(session_id, 1, team.team_size, session)
+        except IntegrityError as err:
+            # a concurrent signup got one of the players in after the check above
+            self.check_signup_conflict(session_id=session_id, discord_ids=discord_ids, session=session)
+            raise GoDbError(f"Cannot sign up team {team.team_name}: {err.orig}")
         session.commit()
         return signup
 
+    #
+    def check_signup_conflict(self, session_id: int, discord_ids: Set[int], session: Session) -> None:
+        """
+        Raises GoDbError if any of the players are already signed up in the session.
+        """
+        if not discord_ids:
+            return
+        statement = (
+            select(GoPlayer.discord_name, GoTeam.team_name)
+            .select_from(GoRoster)
+            .join(GoSignup, GoSignup.team_id == GoRoster.team_id)  # type: ignore
+            .join(GoTeam, GoTeam.id == GoRoster.team_id)  # type: ignore
+            .join(GoPlayer, GoPlayer.discord_id == GoRoster.discord_id)  # type: ignore
+            .where(GoSignup.session_id == session_id)
+            .where(GoRoster.discord_id.in_(discord_ids))  # type: ignore
+            .limit(1)
+        )
+        conflict = session.exec(statement).first()
+        if conflict is not None:
+            discord_name, team_name = conflict
+            raise GoDbError(f'Player {discord_name} is already signed up in this session for team "{team_name}".')
+
+    #
+    def backfill_participants(self, session: Session) -> int:
+        """
+        Add the GoParticipant rows of signups made before the table existed.  Returns the number added.
+        """
+        statement = (
+            select(GoSignup.session_id, GoRoster.discord_id, GoSignup.team_id)
+            .join(GoRoster, GoRoster.team_id == GoSignup.team_id)  # type: ignore
+            .outerjoin(
+                GoParticipant,
+                (GoParticipant.session_id == GoSignup.session_id)  # type: ignore
+                & (GoParticipant.discord_id == GoRoster.discord_id),
+            )
+            .where(GoParticipant.team_id == None)  # noqa: E711
+        )
+        seen = set()
+        count = 0
+        for session_id, discord_id, team_id in session.exec(statement).all():
+            if (session_id, discord_id) in seen:
+                logger.error(f"Player {discord_id} is on more than one team in session {session_id}, skipping team {team_id}")
+                continue
+            seen.add((session_id, discord_id))
+            session.add(GoParticipant(session_id=session_id, discord_id=discord_id, team_id=team_id))
+            count += 1
+        session.commit()
+        logger.info(f"Added {count} GoParticipants")
+        return count
+
+    #
+    # Does NOT commit, so the counts change in the same transaction as the signup
+    def update_session_counts(self, session_id: int, team_delta: int, player_delta: int, session: Session) -> None:
+        statement = update(GoSession).where(GoSession.id == session_id)  # type: ignore
+        statement = statement.values(
+            team_count=GoSession.team_count + team_delta,
+            player_count=GoSession.player_count + player_delta,
+        )
+        session.exec(statement)  # type: ignore
+
     #
     def read_player_signups(
         self,
@@ -229,39 +329,54 @@ class GoDB:
     def read_team_with_roster(self, discord_ids: Set[int], session: Session) -> Optional[GoTeam]:
         logger.info(f"Reading GoTeam with {discord_ids = } from DB")
 
-        # get all teams with the correct number of players
-        team_ids = set()
+        if not discord_ids:
+            return None
+
+        # teams of the right size that have every one of the players, in one round trip
+        team_ids = select(GoRoster.team_id).where(GoRoster.discord_id.in_(discord_ids))  # type: ignore
+        team_ids = team_ids.group_by(GoRoster.team_id).having(func.count(GoRoster.discord_id) == len(discord_ids))
         statement = select(GoTeam).where(GoTeam.team_size == len(discord_ids))
-        result = session.exec(statement)
-        for r in result:
-            team_ids.add(r.id)
-
-        # for each teammate
-        for discord_id in discord_ids:
-            # get the teams that have this player
-            statement = select(GoRoster).where(GoRoster.discord_id == discord_id)
-            player_teams = {roster.team_id for roster in session.exec(statement)}
-            # and intersect with the teams we already have
-            team_ids.intersection_update(player_teams)
-
-        if len(team_ids) > 1:
+        statement = statement.where(GoTeam.id.in_(team_ids)).limit(2)  # type: ignore
+        teams = session.exec(statement).all()
+
+        if len(teams) > 1:
             logger.error(f"Error: More than one team found with with {discord_ids = }")
             raise GoDbError("Error: More than one team found with that roster")
 
-        elif len(team_ids) == 0:
+        elif len(teams) == 0:
             logger.info(f"No team found with that roster")
             return None
 
-        elif len(team_ids) == 1:
-            team_id = team_ids.pop()
-            statement = select(GoTeam).where(GoTeam.id == team_id)
-            team = session.exec(statement).one()
-
+        else:
+            team = teams[0]
             logger.info(f"Returning team with {team.id = }")
             return team
 
-        # else:
-        #     raise Exception("Unreachable")
+    #
+    def read_team_with_roster_key(self, roster_key: str, session: Session) -> Optional[GoTeam]:
+        statement = select(GoTeam).where(GoTeam.roster_key == roster_key)
+        return session.exec(statement).first()
+
+    #
+    def backfill_roster_keys(self, session: Session) -> int:
+        """
+        Set roster_key on teams created before it existed.  Returns the number of teams updated.
+        """
+        statement = select(GoTeam).where(GoTeam.roster_key == None)  # noqa: E711
+        keys_used = set(session.exec(select(GoTeam.roster_key).where(GoTeam.roster_key != None)))  # noqa: E711
+        count = 0
+        for team in session.exec(statement).all():
+            roster_key = GoTeam.make_roster_key(team.get_discord_ids())
+            if roster_key in keys_used:
+                logger.error(f"Team {team.id} has the same roster as another team, leaving its roster_key empty")
+                continue
+            keys_used.add(roster_key)
+            team.roster_key = roster_key
+            session.add(team)
+            count += 1
+        session.commit()
+        logger.info(f"Set roster_key on {count} teams")
+        return count
 
     #
     def read_team_with_name(self, team_name: str, session: Session) -> Optional[GoTeam]:
@@ -282,6 +397,95 @@ class GoDB:
             teams.append(signup.team)
         return teams
 
+    #
+    def read_team_listings(self, session_id: int, session: Session) -> List[GoTeamListing]:
+        """
+        The teams signed up for a session with their players' igns, in signup order.
+        One query for the whole session.
+        """
+        logger.info(f"Reading GoTeamListings with {session_id = } from DB")
+        statement = (
+            select(
+                GoSignup.team_id,
+                GoSignup.signup_time,
+                GoTeam.team_name,
+                GoTeam.team_rating,
+                GoPlayer.discord_name,
+                PfPlayer.ign,
+            )
+            .join(GoTeam, GoTeam.id == GoSignup.team_id)  # type: ignore
+            .join(GoRoster, GoRoster.team_id == GoTeam.id)  # type: ignore
+            .join(GoPlayer, GoPlayer.discord_id == GoRoster.discord_id)  # type: ignore
+            .outerjoin(PfPlayer, PfPlayer.id == GoPlayer.pf_player_id)  # type: ignore
+            .where(GoSignup.session_id == session_id)
+            .order_by(GoSignup.signup_time, GoSignup.team_id, GoRoster.discord_id)  # type: ignore
+        )
+
+        listings: List[GoTeamListing] = []
+        for team_id, signup_time, team_name, team_rating, discord_name, ign in session.exec(statement):
+            if not listings or listings[-1].team_id != team_id:
+                listings.append(
+                    GoTeamListing(
+                        team_id=team_id, team_name=team_name, team_rating=team_rating, signup_time=signup_time, igns=[]
+                    )
+                )
+            listings[-1].igns.append(ign if ign is not None else discord_name)
+        return listings
+
+    #
+    def read_session_summaries(self, session: Session, since: Optional[datetime] = None) -> List[GoSessionSummary]:
+        """
+        Team and player counts for every GoSession (or those at or after since) ordered by session_time.
+        Reads the stored counts, one row per session.
+        """
+        logger.info(f"Reading GoSessionSummaries with {since = } from DB")
+        statement = select(GoSession).order_by(GoSession.session_time)  # type: ignore
+        if since is not None:
+            statement = statement.where(GoSession.session_time >= since)
+
+        return [
+            GoSessionSummary(
+                session_id=s.id,
+                session_time=s.session_time,
+                signup_state=s.signup_state,
+                team_count=s.team_count,
+                player_count=s.player_count,
+            )
+            for s in session.exec(statement)
+        ]
+
+    #
+    def reconcile_session_counts(self, session: Session, since: Optional[datetime] = None) -> int:
+        """
+        Reset the stored counts of the sessions that drifted from their signups.  Returns how many were fixed.
+        """
+        # one UPDATE with the counts as correlated subqueries, so a signup committed between
+        # counting and writing can't be overwritten by a stale count
+        team_count = (
+            select(func.count(GoSignup.team_id))  # type: ignore
+            .where(GoSignup.session_id == GoSession.id)
+            .scalar_subquery()
+        )
+        player_count = (
+            select(func.coalesce(func.sum(GoTeam.team_size), 0))
+            .join(GoSignup, GoSignup.team_id == GoTeam.id)  # type: ignore
+            .where(GoSignup.session_id == GoSession.id)
+            .scalar_subquery()
+        )
+        statement = (
+            update(GoSession)
+            .where(or_(GoSession.team_count != team_count, GoSession.player_count != player_count))
+            .values(team_count=team_count, player_count=player_count)
+        )
+        if since is not None:
+            statement = statement.where(GoSession.session_time >= since)  # type: ignore
+
+        fixed = session.exec(statement).rowcount  # type: ignore
+        session.commit()
+        if fixed:
+            logger.warning(f"Reset the counts of {fixed} GoSessions that drifted from their signups")
+        return fixed
+
     #
     def get_session(self, session_id: int | None, session: Session) -> Optional[GoSession]:
         if not session_id:
@@ -319,14 +523,45 @@ class GoDB:
 
     #
     def get_official_rating(self, pf_player_id, session: Session, season: str) -> Optional[float]:
+        hit, go_rating = self.rating_cache.get(season, "official", pf_player_id)
+        if hit:
+            return go_rating
+
         statement = select(GoRatings).where(GoRatings.rating_type == "official")
         statement = statement.where(GoRatings.season == season)
         statement = statement.where(GoRatings.pf_player_id == pf_player_id)
         rating = session.exec(statement).first()
         if rating is None:
             return None
+        self.rating_cache.put(season, "official", pf_player_id, rating.go_rating)
         return rating.go_rating
 
+    #
+    def get_official_ratings(self, pf_player_ids: List[int], session: Session, season: str) -> Dict[int, float]:
+        """
+        Official ratings for several players in one query.  Players without a rating are left out.
+        """
+        ratings = {}
+        missed = []
+        for pf_player_id in pf_player_ids:
+            if pf_player_id is None:
+                continue
+            hit, go_rating = self.rating_cache.get(season, "official", pf_player_id)
+            if not hit:
+                missed.append(pf_player_id)
+            elif go_rating is not None:
+                ratings[pf_player_id] = go_rating
+        if not missed:
+            return ratings
+
+        statement = select(GoRatings.pf_player_id, GoRatings.go_rating).where(GoRatings.rating_type == "official")
+        statement = statement.where(GoRatings.season == season)
+        statement = statement.where(GoRatings.pf_player_id.in_(missed))  # type: ignore
+        for pf_player_id, go_rating in session.exec(statement):
+            self.rating_cache.put(season, "official", pf_player_id, go_rating)
+            ratings[pf_player_id] = go_rating
+        return ratings
+
     #
     def set_host(self, discord_id: int, session_id: int, status: str, session: Session):
         statement = select(GoHost).where(GoHost.host_did == discord_id).where(GoHost.session_id == session_id)
@@ -351,7 +586,72 @@ class GoDB:
             session.commit()
 
     #
-    def get_hosts(self, session_id: int, session: Session) -> List[GoHost]:
+    def get_hosts(self, session_id: int, session: Session, status: Optional[str] = None) -> List[GoHost]:
         statement = select(GoHost).where(GoHost.session_id == session_id)
+        if status is not None:
+            statement = statement.where(GoHost.status == status)
         hosts = [_ for _ in session.exec(statement).all()]
         return hosts
+
+    #
+    # Does NOT commit, the DMs are sent once the caller's transaction commits
+    def add_outbox(self, dms: List[Tuple[int, str]], source: str, session: Session) -> List[GoOutbox]:
+        """
+        Queue (discord_id, message) DMs in go_outbox.  source (e.g. the interaction id) and the message
+        make up the dedupe key, so the same notification is only queued once.  Returns the rows added.
+        """
+        rows: Dict[str, GoOutbox] = {}
+        for discord_id, message in dms:
+            digest = hashlib.sha1(message.encode()).hexdigest()[:16]
+            dedupe_key = f"{source}:{discord_id}:{digest}"
+            rows[dedupe_key] = GoOutbox(dedupe_key=dedupe_key, discord_id=discord_id, message=message)
+        if not rows:
+            return []
+
+        statement = select(GoOutbox.dedupe_key).where(GoOutbox.dedupe_key.in_(rows))  # type: ignore
+        for dedupe_key in session.exec(statement):
+            logger.info(f"GoOutbox {dedupe_key} already queued")
+            del rows[dedupe_key]
+        session.add_all(rows.values())
+        return list(rows.values())
+
+    #
+    def read_outbox(
+        self, session: Session, after_id: int = 0, limit: int = 50, max_attempts: int = 5
+    ) -> List[GoOutbox]:
+        """
+        Unsent DMs with id > after_id that haven't used up their attempts, oldest first.
+        """
+        statement = select(GoOutbox).where(GoOutbox.sent_at == None)  # noqa: E711
+        statement = statement.where(GoOutbox.id > after_id)  # type: ignore
+        statement = statement.where(GoOutbox.attempts < max_attempts)
+        statement = statement.order_by(GoOutbox.id).limit(limit)  # type: ignore
+        return [_ for _ in session.exec(statement).all()]
+
+    #
+    def mark_outbox(
+        self,
+        sent_ids: List[int],
+        failed_ids: List[int],
+        session: Session,
+        dead_ids: Optional[List[int]] = None,
+        max_attempts: int = 5,
+    ) -> None:
+        """
+        dead_ids can't be delivered, they're given max_attempts so read_outbox skips them from now on.
+        """
+        if sent_ids:
+            statement = update(GoOutbox).where(GoOutbox.id.in_(sent_ids))  # type: ignore
+            session.exec(statement.values(sent_at=datetime.now(), attempts=GoOutbox.attempts + 1))  # type: ignore
+        if failed_ids:
+            statement = update(GoOutbox).where(GoOutbox.id.in_(failed_ids))  # type: ignore
+            session.exec(statement.values(attempts=GoOutbox.attempts + 1))  # type: ignore
+        if dead_ids:
+            statement = update(GoOutbox).where(GoOutbox.id.in_(dead_ids))  # type: ignore
+            session.exec(statement.values(attempts=max_attempts))  # type: ignore
+        session.commit()
+
+    #
+    def get_lobbies(self, session_id: int, session: Session) -> List[GoLobby]:
+        statement = select(GoLobby).where(GoLobby.session_id == session_id)
+        return [_ for _ in session.exec(statement).all()]
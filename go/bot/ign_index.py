@@ -0,0 +1,127 @@
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from go.bot.logger import create_logger
+from go.bot.models import PfIgnHistory, PfPlayer
+from go.bot.prefix_trie import PrefixTrie
+
+logger = create_logger(__name__)
+
+
+def normalize_ign(ign: str) -> str:
+    # same normalization as PfPlayer.ign_norm
+    return ign.lower()
+
+
+class IgnIndex:
+    """
+    In-memory map of normalized ign -> pf_player_ids for the bot process.
+
+    Covers every player's current ign and all of their old igns from PfIgnHistory,
+    so a player who renamed can still be found by the name they used to have.
+    The first refresh loads everything, later ones only the PfIgnHistory rows added since.
+    """
+
+    def __init__(self, overlap: timedelta = timedelta(minutes=5)):
+        # ids are kept in tuples, most names only belong to one player
+        self.ids_by_ign: Dict[str, Tuple[int, ...]] = {}
+        self.current_ign: Dict[int, str] = {}
+        # igns as displayed for autocomplete
+        self.trie = PrefixTrie()
+        self.watermark: Optional[datetime] = None
+        self.loaded = False
+        # history rows are dated before they're committed so re-read a little before the watermark
+        self.overlap = overlap
+        # refresh runs on a DB worker while lookups come from other workers and the event loop,
+        # lock guards the maps and is only held while they're updated, refresh_lock keeps refreshes in order
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    #
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.ids_by_ign)
+
+    #
+    @staticmethod
+    def _add(ids_by_ign: Dict[str, Tuple[int, ...]], trie: PrefixTrie, pf_player_id: int, ign: str) -> None:
+        norm = normalize_ign(ign)
+        ids = ids_by_ign.get(norm, ())
+        if pf_player_id not in ids:
+            ids_by_ign[norm] = ids + (pf_player_id,)
+        trie.insert(norm, ign)
+
+    #
+    def refresh(self, session: Session) -> int:
+        """
+        Load the igns changed since the last refresh.  Returns the number of rows read.
+        """
+        with self.refresh_lock:
+            statement = select(PfIgnHistory.pf_player_id, PfIgnHistory.ign, PfIgnHistory.date)
+            if self.watermark is not None:
+                statement = statement.where(PfIgnHistory.date > self.watermark - self.overlap)
+            statement = statement.order_by(PfIgnHistory.date)  # type: ignore
+
+            if not self.loaded:
+                # the first load is every player, build it off to the side and swap it in
+                ids_by_ign: Dict[str, Tuple[int, ...]] = {}
+                current_ign: Dict[int, str] = {}
+                trie = PrefixTrie()
+                players = session.exec(select(PfPlayer.id, PfPlayer.ign)).all()
+                for pf_player_id, ign in players:
+                    self._add(ids_by_ign, trie, pf_player_id, ign)
+                    current_ign[pf_player_id] = normalize_ign(ign)
+                history = session.exec(statement).all()
+                for pf_player_id, ign, _ in history:
+                    self._add(ids_by_ign, trie, pf_player_id, ign)
+                with self.lock:
+                    self.ids_by_ign, self.current_ign, self.trie = ids_by_ign, current_ign, trie
+                count = len(players) + len(history)
+            else:
+                history = session.exec(statement).all()
+                with self.lock:
+                    for pf_player_id, ign, _ in history:
+                        self._add(self.ids_by_ign, self.trie, pf_player_id, ign)
+                        # rows come oldest first so the last one for a player is their current ign
+                        self.current_ign[pf_player_id] = normalize_ign(ign)
+                count = len(history)
+
+            for _, _, date in history:
+                if self.watermark is None or date > self.watermark:
+                    self.watermark = date
+            self.loaded = True
+            logger.info(f"IgnIndex refreshed {count} rows, {len(self)} igns, watermark {self.watermark}")
+            return count
+
+    #
+    def lookup(self, ign: str) -> List[int]:
+        """
+        pf_player_ids that have or had exactly this ign (ignoring case).
+        Players currently using the ign come first.
+        """
+        norm = normalize_ign(ign)
+        with self.lock:
+            ids = self.ids_by_ign.get(norm, ())
+            return sorted(ids, key=lambda pf_player_id: (self.current_ign.get(pf_player_id) != norm, pf_player_id))
+
+    #
+    def lookup_holders(self, ign: str) -> List[int]:
+        """
+        pf_player_ids currently using this ign, or if nobody is, the ones that used to.
+        """
+        norm = normalize_ign(ign)
+        ids = self.lookup(ign)
+        with self.lock:
+            current = [pf_player_id for pf_player_id in ids if self.current_ign.get(pf_player_id) == norm]
+        return current or ids
+
+    #
+    def complete(self, prefix: str, limit: int = 25) -> List[str]:
+        """
+        Igns (current or old) starting with prefix, shortest first.
+        """
+        with self.lock:
+            return self.trie.search(normalize_ign(prefix), limit=limit)
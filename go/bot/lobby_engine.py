@@ -0,0 +1,275 @@
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from go.bot.logger import create_logger
+
+logger = create_logger(__name__)
+
+LOBBY_MAX_PLAYERS = 24
+
+
+class LobbyTeam(BaseModel):
+    team_id: int
+    team_size: int
+    team_rating: float
+    # set if one of the team's players is a confirmed host
+    host_did: Optional[int] = None
+
+
+class LobbyAssignment(BaseModel):
+    # one entry per lobby
+    hosts: List[int]
+    lobbies: List[List[int]]
+    ratings: List[float]
+    players: List[int]
+    # team_ids that didn't make the cut, in signup order
+    waitlist: List[int]
+    # max - min of the lobbies' average team rating, 0 is perfectly balanced
+    spread: float
+
+
+class _Lobby:
+    __slots__ = ("teams", "rating_sum", "players", "host_did")
+
+    def __init__(self):
+        self.teams: List[LobbyTeam] = []
+        self.rating_sum = 0.0
+        self.players = 0
+        self.host_did: Optional[int] = None
+
+    def add(self, team: LobbyTeam) -> None:
+        self.teams.append(team)
+        self.rating_sum += team.team_rating
+        self.players += team.team_size
+
+    def mean(self) -> float:
+        return self.rating_sum / len(self.teams) if self.teams else 0.0
+
+
+def lobbies_needed(player_count: int) -> int:
+    if player_count < 30:
+        return 1
+    elif player_count <= 48:
+        return 2
+    return 3
+
+
+def rating_spread(ratings: List[float]) -> float:
+    return max(ratings) - min(ratings) if ratings else 0.0
+
+
+def assign_lobbies(
+    teams: List[LobbyTeam],
+    hosts_not_on_teams: List[int],
+    lobby_count: int,
+    max_players: int = LOBBY_MAX_PLAYERS,
+    max_passes: int = 20,
+    tolerance: float = 1.0,
+) -> LobbyAssignment:
+    """
+    Split teams (in signup order) into lobby_count lobbies of at most max_players players each.
+
+    Teams that signed up after the lobbies are full go on the waitlist.  A team with a host on it hosts
+    its own lobby, at most one per lobby; if there are more of those than lobbies the extras play as
+    regular teams.  Lobbies without one get a host from hosts_not_on_teams, or a host whose team is
+    on the waitlist.
+    The rest is a balancing problem: a greedy seed that keeps player counts even, then swaps and moves
+    between lobbies that lower the spread of the lobbies' average team rating, until the spread is
+    within tolerance rating points or max_passes is reached.
+    """
+    team_hosts = {t.host_did for t in teams if t.host_did is not None}
+    lobby_count = min(lobby_count, len(hosts_not_on_teams) + len(team_hosts))
+    teams_in, waitlist = _cut(teams, lobby_count * max_players)
+
+    # a host whose team didn't make the cut can still host
+    hosts_in = {t.host_did for t in teams_in if t.host_did is not None}
+    waitlisted_hosts = [t.host_did for t in teams if t.host_did is not None and t.host_did not in hosts_in]
+    host_pool = list(dict.fromkeys(sorted(hosts_not_on_teams) + waitlisted_hosts))
+
+    # the earliest signed up team of each host anchors a lobby, other teams with hosts play like anyone else
+    hosting: List[LobbyTeam] = []
+    for team in teams_in:
+        if team.host_did is not None and len(hosting) < lobby_count and team.host_did not in {
+            t.host_did for t in hosting
+        }:
+            hosting.append(team)
+    fixed = {t.team_id for t in hosting}
+    others = [t for t in teams_in if t.team_id not in fixed]
+
+    # seed: strongest first into the emptiest lobby, which keeps player counts even
+    lobbies, stranded = _seed(hosting, others, lobby_count, max_players, key=lambda t: -t.team_rating)
+    # big teams can be left over when the lobbies are nearly full, make room by moving smaller teams around
+    stranded = [team for team in stranded if not _make_room(lobbies, team, fixed, max_players)]
+    if stranded:
+        # biggest first packs tighter, the local search does the balancing
+        by_size = lambda t: (-t.team_size, -t.team_rating)
+        lobbies, stranded = _seed(hosting, others, lobby_count, max_players, key=by_size)
+        stranded = [team for team in stranded if not _make_room(lobbies, team, fixed, max_players)]
+    for team in stranded:
+        logger.warning(f"Team {team.team_id} didn't fit in any lobby, waitlisting it")
+        waitlist.append(team.team_id)
+
+    _local_search(lobbies, fixed, max_players, max_passes, tolerance)
+
+    for lobby in lobbies:
+        if lobby.host_did is None and host_pool:
+            lobby.host_did = host_pool.pop(0)
+
+    lobbies = [lobby for lobby in lobbies if lobby.teams and lobby.host_did is not None]
+    ratings = [lobby.mean() for lobby in lobbies]
+    order = {team.team_id: i for i, team in enumerate(teams)}
+    return LobbyAssignment(
+        hosts=[lobby.host_did for lobby in lobbies],  # type: ignore
+        lobbies=[[t.team_id for t in lobby.teams] for lobby in lobbies],
+        ratings=ratings,
+        players=[lobby.players for lobby in lobbies],
+        waitlist=sorted(waitlist, key=lambda team_id: order[team_id]),
+        spread=rating_spread(ratings),
+    )
+
+
+def _cut(teams: List[LobbyTeam], capacity: int) -> Tuple[List[LobbyTeam], List[int]]:
+    # filter in/out which teams signed up early enough to play
+    teams_in: List[LobbyTeam] = []
+    waitlist: List[int] = []
+    player_count_in = 0
+    for team in teams:
+        if player_count_in + team.team_size > capacity:
+            waitlist.append(team.team_id)
+        else:
+            teams_in.append(team)
+            player_count_in += team.team_size
+    return teams_in, waitlist
+
+
+def _seed(
+    hosting: List[LobbyTeam], others: List[LobbyTeam], lobby_count: int, max_players: int, key
+) -> Tuple[List[_Lobby], List[LobbyTeam]]:
+    lobbies = [_Lobby() for _ in range(lobby_count)]
+    for lobby, team in zip(lobbies, sorted(hosting, key=lambda t: -t.team_rating)):
+        lobby.add(team)
+        lobby.host_did = team.host_did
+
+    stranded = []
+    for team in sorted(others, key=key):
+        open_lobbies = [lobby for lobby in lobbies if lobby.players + team.team_size <= max_players]
+        if not open_lobbies:
+            stranded.append(team)
+            continue
+        min(open_lobbies, key=lambda lobby: (lobby.players, lobby.rating_sum)).add(team)
+    return lobbies, stranded
+
+
+def _make_room(lobbies: List[_Lobby], team: LobbyTeam, fixed, max_players: int) -> bool:
+    # move a team out of a lobby, or swap it for a smaller one, so that team fits in its place
+    for target in lobbies:
+        need = target.players + team.team_size - max_players
+        for out in target.teams:
+            if out.team_id in fixed or out.team_size < need:
+                continue
+            for dest in lobbies:
+                if dest is target:
+                    continue
+                free = max_players - dest.players
+                if out.team_size <= free:
+                    _remove(target, out)
+                    dest.add(out)
+                    target.add(team)
+                    return True
+                for back in dest.teams:
+                    if back.team_id not in fixed and need <= out.team_size - back.team_size <= free:
+                        _remove(target, out)
+                        _remove(dest, back)
+                        dest.add(out)
+                        target.add(back)
+                        target.add(team)
+                        return True
+    return False
+
+
+def _remove(lobby: _Lobby, team: LobbyTeam) -> None:
+    lobby.teams.remove(team)
+    lobby.rating_sum -= team.team_rating
+    lobby.players -= team.team_size
+
+
+def _pairs(lobbies: List[_Lobby]) -> List[Tuple[_Lobby, _Lobby]]:
+    """
+    Lobbies to try trading teams between: the strongest with the weakest, second strongest with the
+    second weakest, and so on, plus the two extremes with everyone.  Trying every pair is quadratic
+    in the number of lobbies and hardly ever finds more.
+    """
+    order = sorted((lobby for lobby in lobbies if lobby.teams), key=lambda lobby: -lobby.mean())
+    pairs = [(order[i], order[-1 - i]) for i in range(len(order) // 2)]
+    for extreme in (order[0], order[-1]):
+        pairs += [(extreme, lobby) for lobby in order[1:-1]]
+    return pairs
+
+
+def _local_search(lobbies: List[_Lobby], fixed, max_players: int, max_passes: int, tolerance: float) -> None:
+    """
+    Swap or move teams between pairs of lobbies while that lowers the sum of squared differences
+    between each lobby's average team rating and the overall average.  Player counts are kept
+    under max_players and no further apart than the seed left them.
+    """
+    n_teams = sum(len(lobby.teams) for lobby in lobbies)
+    if n_teams == 0 or len(lobbies) < 2:
+        return
+    target = sum(lobby.rating_sum for lobby in lobbies) / n_teams
+    players_spread = max(lobby.players for lobby in lobbies) - min(lobby.players for lobby in lobbies)
+
+    def cost(rating_sum: float, n: int) -> float:
+        return (rating_sum / n - target) ** 2 if n else 0.0
+
+    def players_ok(a: _Lobby, a_players: int, b: _Lobby, b_players: int) -> bool:
+        if a_players > max_players or b_players > max_players:
+            return False
+        counts = [l.players for l in lobbies if l is not a and l is not b] + [a_players, b_players]
+        return max(counts) - min(counts) <= players_spread
+
+    for _ in range(max_passes):
+        if rating_spread([lobby.mean() for lobby in lobbies if lobby.teams]) <= tolerance:
+            break
+        improved = False
+        for a, b in _pairs(lobbies):
+            before = cost(a.rating_sum, len(a.teams)) + cost(b.rating_sum, len(b.teams))
+
+            # swaps keep the number of teams in each lobby
+            for i, ta in enumerate(a.teams):
+                if ta.team_id in fixed:
+                    continue
+                for j, tb in enumerate(b.teams):
+                    if tb.team_id in fixed:
+                        continue
+                    diff = tb.team_rating - ta.team_rating
+                    size_diff = tb.team_size - ta.team_size
+                    after = cost(a.rating_sum + diff, len(a.teams)) + cost(b.rating_sum - diff, len(b.teams))
+                    if after < before - 1e-9 and players_ok(a, a.players + size_diff, b, b.players - size_diff):
+                        a.teams[i], b.teams[j] = tb, ta
+                        a.rating_sum += diff
+                        b.rating_sum -= diff
+                        a.players += size_diff
+                        b.players -= size_diff
+                        before = after
+                        ta = tb
+                        improved = True
+
+            # moves change it, in both directions
+            for src, dst in ((a, b), (b, a)):
+                before = cost(src.rating_sum, len(src.teams)) + cost(dst.rating_sum, len(dst.teams))
+                for t in list(src.teams):
+                    if t.team_id in fixed or len(src.teams) == 1:
+                        continue
+                    after = cost(src.rating_sum - t.team_rating, len(src.teams) - 1) + cost(
+                        dst.rating_sum + t.team_rating, len(dst.teams) + 1
+                    )
+                    if after < before - 1e-9 and players_ok(
+                        src, src.players - t.team_size, dst, dst.players + t.team_size
+                    ):
+                        _remove(src, t)
+                        dst.add(t)
+                        before = after
+                        improved = True
+        if not improved:
+            break
@@ -1,8 +1,8 @@
 from datetime import date, datetime
 from typing import List, Optional
 
-from sqlalchemy import BigInteger, Column, ForeignKey
-from sqlmodel import Field, Relationship, SQLModel
+from sqlalchemy import BigInteger, Column, Computed, ForeignKey, ForeignKeyConstraint, Index, String, Text
+from sqlmodel import AutoString, Field, Relationship, SQLModel
 
 
 class GoPlayer(SQLModel, table=True):
@@ -21,6 +21,8 @@ class GoPlayer(SQLModel, table=True):
 
 class GoRatings(SQLModel, table=True):
     __tablename__ = "go_ratings"  # type: ignore
+    # the primary key covers lookups by player, this one loading a whole season
+    __table_args__ = (Index("ix_go_ratings_season_rating_type", "season", "rating_type"),)
 
     pf_player_id: int = Field(sa_column=Column(BigInteger(), ForeignKey("pf_player.id"), primary_key=True))
     season: str = Field(primary_key=True)
@@ -35,6 +37,8 @@ class GoTeam(SQLModel, table=True):
     team_name: str = Field(unique=True, index=True)
     team_size: int
     team_rating: Optional[float] = Field(default=None)
+    # sorted discord_ids of the roster, see make_roster_key
+    roster_key: Optional[str] = Field(default=None, unique=True)
 
     rosters: List["GoRoster"] = Relationship(back_populates="team", sa_relationship_kwargs={"cascade": "delete"})
     signups: List["GoSignup"] = Relationship(back_populates="team", sa_relationship_kwargs={"cascade": "delete"})
@@ -42,12 +46,18 @@ class GoTeam(SQLModel, table=True):
     def get_discord_ids(self):
         return {r.discord_id for r in self.rosters}
 
+    @staticmethod
+    def make_roster_key(discord_ids) -> str:
+        return ",".join(str(_) for _ in sorted(discord_ids))
+
 
 class GoRoster(SQLModel, table=True):
     __tablename__ = "go_roster"  # type: ignore
 
     team_id: int = Field(primary_key=True, foreign_key="go_team.id")
-    discord_id: int = Field(sa_column=Column(BigInteger(), ForeignKey("go_player.discord_id"), primary_key=True))
+    discord_id: int = Field(
+        sa_column=Column(BigInteger(), ForeignKey("go_player.discord_id"), primary_key=True, index=True)
+    )
 
     player: GoPlayer = Relationship(back_populates="rosters")
     team: GoTeam = Relationship(back_populates="rosters")
@@ -55,6 +65,11 @@ class GoRoster(SQLModel, table=True):
 
 class GoSignup(SQLModel, table=True):
     __tablename__ = "go_signup"  # type: ignore
+    # the primary key starts with team_id, these serve lookups by session
+    __table_args__ = (
+        Index("ix_go_signup_session_id_team_id", "session_id", "team_id"),
+        Index("ix_go_signup_session_id_signup_time", "session_id", "signup_time"),
+    )
 
     team_id: int = Field(primary_key=True, foreign_key="go_team.id")
     session_id: int = Field(sa_column=Column(BigInteger(), ForeignKey("go_session.id"), primary_key=True))
@@ -64,6 +79,24 @@ class GoSignup(SQLModel, table=True):
     team: GoTeam = Relationship(back_populates="signups")
     lobby: "GoLobby" = Relationship(back_populates="signups")
     session: "GoSession" = Relationship(back_populates="signups")
+    participants: List["GoParticipant"] = Relationship(
+        back_populates="signup", sa_relationship_kwargs={"cascade": "delete"}
+    )
+
+
+# One row per player signed up in a session
+# The primary key is what stops a player from being on two teams in the same session
+class GoParticipant(SQLModel, table=True):
+    __tablename__ = "go_participant"  # type: ignore
+    __table_args__ = (
+        ForeignKeyConstraint(["team_id", "session_id"], ["go_signup.team_id", "go_signup.session_id"]),
+    )
+
+    session_id: int = Field(sa_column=Column(BigInteger(), primary_key=True))
+    discord_id: int = Field(sa_column=Column(BigInteger(), primary_key=True))
+    team_id: int = Field(index=True)
+
+    signup: GoSignup = Relationship(back_populates="participants")
 
 
 # Manages when games are played
@@ -74,6 +107,9 @@ class GoSession(SQLModel, table=True):
     session_time: datetime = Field(unique=True)
     signup_state: str  # "open" or "change_only" or "closed"
     season: Optional[str] = Field(default=None)
+    # kept up to date by add_signup and do_cancel, fixed by reconcile_session_counts if they drift
+    team_count: int = Field(default=0)
+    player_count: int = Field(default=0)
 
     signups: List["GoSignup"] = Relationship(back_populates="session", sa_relationship_kwargs={"cascade": "delete"})
     lobbies: List["GoLobby"] = Relationship(back_populates="session", sa_relationship_kwargs={"cascade": "delete"})
@@ -85,7 +121,7 @@ class GoLobby(SQLModel, table=True):
     __tablename__ = "go_lobby"  # type: ignore
 
     id: Optional[int] = Field(default=None, primary_key=True)
-    session_id: int = Field(sa_column=Column(BigInteger(), ForeignKey("go_session.id")))
+    session_id: int = Field(sa_column=Column(BigInteger(), ForeignKey("go_session.id"), index=True))
     host_did: Optional[int] = Field(sa_column=Column(BigInteger(), ForeignKey("go_player.discord_id")), default=None)
     lobby_code: Optional[str] = Field(default=None)
 
@@ -96,6 +132,7 @@ class GoLobby(SQLModel, table=True):
 
 class GoHost(SQLModel, table=True):
     __tablename__ = "go_host"  # type: ignore
+    __table_args__ = (Index("ix_go_host_session_id_status", "session_id", "status"),)
 
     host_did: int = Field(sa_column=Column(BigInteger(), primary_key=True))
     session_id: int = Field(sa_column=Column(BigInteger(), ForeignKey("go_session.id"), primary_key=True))
@@ -103,11 +140,29 @@ class GoHost(SQLModel, table=True):
     status: str
 
 
+# DMs waiting to be sent, written in the same transaction as the change they're about
+class GoOutbox(SQLModel, table=True):
+    __tablename__ = "go_outbox"  # type: ignore
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # the same notification is only queued once, see GoDB.add_outbox
+    dedupe_key: str = Field(unique=True)
+    discord_id: int = Field(sa_column=Column(BigInteger(), nullable=False))
+    message: str = Field(sa_column=Column(Text(), nullable=False))
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+    attempts: int = Field(default=0)
+    sent_at: Optional[datetime] = Field(default=None, index=True)
+
+
 class PfPlayer(SQLModel, table=True):
     __tablename__ = "pf_player"  # type: ignore
 
     id: int = Field(sa_column=Column(BigInteger(), primary_key=True))
     ign: str = Field(index=True)
+    # lower-cased ign maintained by the DB so case-insensitive exact and prefix lookups can use an index
+    ign_norm: Optional[str] = Field(
+        default=None, sa_column=Column(AutoString(), Computed("lower(ign)", persisted=True), index=True)
+    )
     account_created: datetime
     last_login: datetime
     avatar_url: Optional[str] = Field(nullable=True, default=None)
@@ -119,6 +174,7 @@ class PfPlayer(SQLModel, table=True):
     ign_history: List["PfIgnHistory"] = Relationship(
         back_populates="player", sa_relationship_kwargs={"cascade": "delete"}
     )
+    ign_trigrams: List["PfIgnTrigram"] = Relationship(sa_relationship_kwargs={"cascade": "delete"})
     go_player: Optional["GoPlayer"] = Relationship(back_populates="pf_player")
 
     def __str__(self):
@@ -127,6 +183,8 @@ class PfPlayer(SQLModel, table=True):
 
 class PfCareerStats(SQLModel, table=True):
     __tablename__ = "pf_career_stats"  # type: ignore
+    # the primary key starts with date, stats are almost always read by player
+    __table_args__ = (Index("ix_pf_career_stats_pf_player_id_date", "pf_player_id", "date"),)
 
     date: datetime = Field(primary_key=True)
     pf_player_id: int = Field(sa_column=Column(BigInteger(), ForeignKey("pf_player.id"), primary_key=True))
@@ -194,3 +252,31 @@ class PfIgnHistory(SQLModel, table=True):
 
     def __repr__(self):
         return f"IgnHistory[{self.date.date()}, ign {self.ign}, id {self.pf_player_id}]"
+
+
+# The 3 character substrings of each player's lower-cased ign, used for fuzzy ign search
+class PfIgnTrigram(SQLModel, table=True):
+    __tablename__ = "pf_ign_trigram"  # type: ignore
+
+    # binary collation on MySQL, the default *_ai_ci one makes 'oké' and 'oke' the same key
+    trigram: str = Field(
+        sa_column=Column(
+            String(3).with_variant(String(3, collation="utf8mb4_bin"), "mysql", "mariadb"), primary_key=True
+        )
+    )
+    pf_player_id: int = Field(
+        sa_column=Column(BigInteger(), ForeignKey("pf_player.id"), primary_key=True, index=True)
+    )
+
+
+# Progress of a load_playfab_db.py crawl so an interrupted run can be resumed
+class PfCrawlCheckpoint(SQLModel, table=True):
+    __tablename__ = "pf_crawl_checkpoint"  # type: ignore
+
+    run_id: str = Field(primary_key=True)
+    stat_name: str = Field(primary_key=True)
+    start_rank: int
+    end_rank: int
+    last_rank: int  # last leaderboard rank that was completely loaded, start_rank - 1 if none
+    completed: bool = Field(default=False)
+    updated_at: datetime = Field(default_factory=lambda: datetime.now())
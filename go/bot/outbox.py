@@ -0,0 +1,110 @@
+import asyncio
+from typing import Awaitable, Callable, List, Set, Tuple
+
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from go.bot.dm_delivery import DmDelivery, DmStatus
+from go.bot.go_db import GoDB
+from go.bot.logger import create_logger
+
+logger = create_logger(__name__)
+
+
+class OutboxDispatcher:
+    """
+    Sends the DMs in go_outbox through DmDelivery in batches.
+
+    Rows are only marked sent after Discord took the message, so a restart resends whatever
+    was in flight (at-least-once).  Failed rows are retried on later drains until max_attempts,
+    undeliverable ones (unknown user, DMs closed) are given up on right away.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        godb: GoDB,
+        delivery: DmDelivery,
+        run_db: Callable[..., Awaitable],
+        batchsize: int = 50,
+        max_attempts: int = 5,
+    ):
+        self.engine = engine
+        self.godb = godb
+        self.delivery = delivery
+        # runs the blocking DB work off the event loop, GoCog.run_db
+        self.run_db = run_db
+        self.batchsize = batchsize
+        self.max_attempts = max_attempts
+        self.lock = asyncio.Lock()
+        self.draining: Set[asyncio.Task] = set()
+
+    #
+    def read_batch(self, after_id: int) -> List[Tuple[int, int, str]]:
+        with Session(self.engine) as session:
+            rows = self.godb.read_outbox(
+                session, after_id=after_id, limit=self.batchsize, max_attempts=self.max_attempts
+            )
+            return [(row.id, row.discord_id, row.message) for row in rows]  # type: ignore
+
+    #
+    def mark(self, sent_ids: List[int], failed_ids: List[int], dead_ids: List[int]) -> None:
+        with Session(self.engine) as session:
+            self.godb.mark_outbox(
+                sent_ids=sent_ids,
+                failed_ids=failed_ids,
+                session=session,
+                dead_ids=dead_ids,
+                max_attempts=self.max_attempts,
+            )
+
+    #
+    async def drain(self) -> int:
+        """
+        Send everything pending, one batch at a time.  Returns the number of DMs sent.
+        """
+        async with self.lock:
+            sent_count = 0
+            # each row is tried at most once per drain
+            after_id = 0
+            while True:
+                batch = await self.run_db(self.read_batch, after_id)
+                if not batch:
+                    return sent_count
+                after_id = batch[-1][0]
+
+                futures = self.delivery.enqueue_many([(discord_id, message) for _, discord_id, message in batch])
+                results = await asyncio.gather(*futures)
+
+                sent_ids = [row[0] for row, status in zip(batch, results) if status is DmStatus.SENT]
+                failed_ids = [row[0] for row, status in zip(batch, results) if status is DmStatus.FAILED]
+                dead_ids = [row[0] for row, status in zip(batch, results) if status is DmStatus.UNDELIVERABLE]
+                await self.run_db(self.mark, sent_ids, failed_ids, dead_ids)
+                sent_count += len(sent_ids)
+                logger.info(
+                    f"Outbox batch sent {len(sent_ids)}, failed {len(failed_ids)}, undeliverable {len(dead_ids)}"
+                )
+
+    #
+    async def drain_and_log(self) -> None:
+        try:
+            await self.drain()
+        except Exception as err:
+            logger.error(f"Outbox drain failed: {err}")
+
+    #
+    def kick(self) -> None:
+        """
+        Start a drain in the background, for handlers that just committed DMs.
+        """
+        if not self.delivery.bot.is_ready():
+            # users can't be looked up yet, the cog's dispatch_outbox loop sends these once the bot is ready
+            return
+        task = asyncio.create_task(self.drain_and_log())
+        self.draining.add(task)
+        task.add_done_callback(self.draining.discard)
+
+    #
+    def stop(self) -> None:
+        for task in list(self.draining):
+            task.cancel()
@@ -1,11 +1,16 @@
+import asyncio
 import json
+import random
 import re
+import threading
+import time
 from datetime import datetime
 from typing import List, Optional
 
 import requests
 from attr import define
 from dateutil import parser
+from requests.adapters import HTTPAdapter
 
 from config import _config 
 from go.bot.logger import create_logger
@@ -39,11 +44,108 @@ def is_playfab_str(s):
         return False
 
 
+class RateLimiter:
+    """
+    Token bucket shared by every thread making Playfab requests.
+
+    The rate is halved whenever Playfab throttles us (and all requests wait out retryAfterSeconds)
+    and creeps back up by increase_step after each successful request.
+    """
+
+    def __init__(
+        self, rate: float = 20.0, min_rate: float = 1.0, max_rate: float = 100.0, increase_step: float = 0.05
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    #
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # refill, allowing a burst of up to one second's worth of requests
+                self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                else:
+                    wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    #
+    def on_success(self) -> None:
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    #
+    def on_throttled(self, retry_after: float) -> None:
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2.0)
+            self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            logger.warning(f"Throttled by Playfab: waiting {retry_after:.1f}s, rate lowered to {self.rate:.1f}/s")
+
+
 class PlayfabApi:
 
     #
-    def __init__(self):
+    # api_url can point at a different host (e.g. a local fake server for tests)
+    # pool_size is the number of keep-alive connections kept open to Playfab,
+    # it should be at least the number of threads making requests at once
+    # requests that fail with 429, 5xx or a connection error are retried up to max_retries times
+    def __init__(
+        self,
+        api_url: Optional[str] = None,
+        pool_size: int = 10,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        timeout: float = 30.0,
+    ):
         self.session_ticket = None
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        if api_url is None:
+            api_url = f"https://{_config.playfab_title_id}.playfabapi.com/Client"
+        self.api_url = api_url
+
+        # one pooled session so requests reuse TCP+TLS connections instead of opening one per call
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self.http.headers.update(
+            {
+                "Content-Type": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+                "Connection": "keep-alive",
+            }
+        )
+
+    #
+    def close(self) -> None:
+        self.http.close()
+
+    #
+    def __enter__(self):
+        return self
+
+    #
+    def __exit__(self, *exc):
+        self.close()
 
     #
     def login_to_playfab(self) -> None:
@@ -63,27 +165,69 @@ class PlayfabApi:
         logger.info(f"login_to_playfab: session ticket set")
 
     #
+    # random delay for retry number attempt (exponential backoff with full jitter)
+    def backoff_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    #
+    # Returns None if the request fails or is still throttled after max_retries retries
     def run_request(self, command: str, payload: dict) -> Optional[requests.Response]:
 
-        headers = {"Content-Type": "application/json"}
+        headers = {}
         if self.session_ticket:
             headers["X-Authorization"] = self.session_ticket
 
-        api_url = f"https://{_config.playfab_title_id}.playfabapi.com/Client/{command}"
-        response = requests.post(api_url, data=json.dumps(payload), headers=headers)
+        api_url = f"{self.api_url}/{command}"
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+
+            try:
+                response = self.http.post(api_url, data=json.dumps(payload), headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                logger.warning(f"run_request for {command = } attempt {attempt} failed with {err}")
+                time.sleep(self.backoff_delay(attempt))
+                continue
+
+            if response.status_code == 200:
+                self.rate_limiter.on_success()
+                logger.debug(f"run_request for {command = } succeeded with response {json.dumps(response.json(),indent=3)}")
+                return response
+
+            if response.status_code == 429:
+                retry_after = None
+                try:
+                    retry_after = response.json().get("retryAfterSeconds")
+                except ValueError:
+                    pass
+                if retry_after is None:
+                    retry_after = response.headers.get("Retry-After")
+                retry_after = float(retry_after) if retry_after is not None else self.backoff_delay(attempt)
+                self.rate_limiter.on_throttled(retry_after + random.uniform(0, self.backoff_base))
+                continue
+
+            if response.status_code >= 500:
+                logger.warning(f"run_request for {command = } attempt {attempt} failed with {response.status_code}")
+                time.sleep(self.backoff_delay(attempt))
+                continue
 
-        if response.status_code == 200:
-            response_data = response.json()
-            logger.debug(f"run_request for {command = } succeeded with response {json.dumps(response.json(),indent=3)}")
-            return response
-        else:
             logger.error(
                 f"Error: run_request for {command = } failed with response {response.status_code} - {response.text}"
             )
             return None
 
+        logger.error(f"Error: run_request for {command = } gave up after {self.max_retries} retries")
+        return None
+
     #
-    def get_player_career_stats(self, player_id: int) -> PfCareerStats:
+    # Async version of run_request for use from an event loop.
+    # Runs on a worker thread and shares the same connection pool as run_request.
+    async def run_request_async(self, command: str, payload: dict) -> Optional[requests.Response]:
+        return await asyncio.to_thread(self.run_request, command, payload)
+
+    #
+    # Returns None if the stats could not be fetched so we never store a row of zeros
+    def get_player_career_stats(self, player_id: int) -> Optional[PfCareerStats]:
 
         payload = {
             "PlayFabId": as_playfab_id(player_id),
@@ -102,12 +246,17 @@ class PlayfabApi:
         }
 
         response = self.run_request("GetPlayerCombinedInfo", payload)
+        if response is None:
+            return None
+
         stat_name_to_val = {}
+        response_data = response.json()
+        for stat_json in response_data["data"]["InfoResultPayload"].get("PlayerStatistics", []):
+            stat_name_to_val[stat_json["StatisticName"]] = stat_json["Value"]
 
-        if response:
-            response_data = response.json()
-            for stat_json in response_data["data"]["InfoResultPayload"]["PlayerStatistics"]:
-                stat_name_to_val[stat_json["StatisticName"]] = stat_json["Value"]
+        if not stat_name_to_val:
+            logger.error(f"get_player_career_stats -- no stats returned for {player_id = }")
+            return None
 
         stats = PfCareerStats(
             date=datetime.now(),
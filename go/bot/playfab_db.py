@@ -1,15 +1,22 @@
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Dict, List, Optional, Set
 
+from sqlalchemy import insert
+from sqlalchemy.dialects import mysql, sqlite
 from sqlmodel import Session, delete, func, select
 
-from go.bot.exceptions import DataNotDeletedError, PlayerNotFoundError
+from go.bot.exceptions import DataNotDeletedError, GoDbError, PlayerNotFoundError
 from go.bot.logger import create_logger
-from go.bot.models import PfCareerStats, PfIgnHistory, PfPlayer
+from go.bot.models import PfCareerStats, PfCrawlCheckpoint, PfIgnHistory, PfIgnTrigram, PfPlayer
 
 logger = create_logger(__name__)
 
 
+def ign_trigrams(ign: str) -> Set[str]:
+    norm = ign.lower()
+    return {norm[i : i + 3] for i in range(len(norm) - 2)}
+
+
 class PlayfabDB:
 
     #
@@ -29,6 +36,7 @@ class PlayfabDB:
             ign_row = PfIgnHistory(pf_player_id=player.id, date=datetime.now(), ign=player.ign)
             session.add(ign_row)
 
+        self.set_ign_trigrams(players=[player], session=session)
         session.commit()
         print(player)
 
@@ -47,12 +55,83 @@ class PlayfabDB:
 
     #
     def read_players_by_ign(self, ign: str, session: Session, limit=None) -> List[PfPlayer]:
+        """
+        Case-insensitive ign search, best matches first.
+        Returns the exact matches if there are any, otherwise the prefix matches,
+        otherwise the players sharing at least half of the search's trigrams (most shared first).
+        Searches shorter than 3 characters have no trigrams so they fall back to a substring scan.
+        """
         logger.info(f"Reading PfPlayer with {ign = } from DB")
-        statement = select(PfPlayer).where(PfPlayer.ign.contains(ign.lower()))  # type: ignore
-        if limit:
-            statement = statement.limit(limit)
-        result = [_ for _ in session.exec(statement)]
-        return result
+        norm = ign.lower()
+
+        def run(statement) -> List[PfPlayer]:
+            if limit:
+                statement = statement.limit(limit)
+            return [_ for _ in session.exec(statement)]
+
+        statement = select(PfPlayer).where(PfPlayer.ign_norm == norm).order_by(PfPlayer.id)
+        players = run(statement)
+        if players:
+            return players
+
+        # a range rather than LIKE so it's an index search on every backend
+        statement = select(PfPlayer).where(PfPlayer.ign_norm >= norm, PfPlayer.ign_norm < norm + "\U0010ffff")
+        players = run(statement.order_by(func.length(PfPlayer.ign_norm), PfPlayer.id))
+        if players:
+            return players
+
+        trigrams = ign_trigrams(norm)
+        if not trigrams:
+            # no index helps a substring search, this is the one ign search that scans pf_player
+            statement = select(PfPlayer).where(PfPlayer.ign_norm.contains(norm, autoescape=True))  # type: ignore
+            return run(statement.order_by(func.length(PfPlayer.ign_norm), PfPlayer.id))
+
+        shared = func.count(PfIgnTrigram.trigram).label("shared")
+        matches = select(PfIgnTrigram.pf_player_id, shared)
+        matches = matches.where(PfIgnTrigram.trigram.in_(trigrams))  # type: ignore
+        matches = matches.group_by(PfIgnTrigram.pf_player_id).having(shared >= (len(trigrams) + 1) // 2)
+        matches = matches.subquery()
+
+        statement = select(PfPlayer).join(matches, matches.c.pf_player_id == PfPlayer.id)
+        statement = statement.order_by(matches.c.shared.desc(), func.length(PfPlayer.ign_norm), PfPlayer.id)
+        return run(statement)
+
+    #
+    def set_ign_trigrams(self, players: List[PfPlayer], session: Session) -> None:
+        """
+        Replace the trigrams of each player with the ones from their current ign.  Doesn't commit.
+        """
+        if not players:
+            return
+        statement = delete(PfIgnTrigram)
+        statement = statement.where(PfIgnTrigram.pf_player_id.in_([p.id for p in players]))  # type: ignore
+        session.exec(statement)  # type: ignore
+        rows = [dict(trigram=t, pf_player_id=p.id) for p in players for t in ign_trigrams(p.ign)]
+        if rows:
+            session.execute(insert(PfIgnTrigram), rows)
+
+    #
+    def rebuild_ign_trigrams(self, session: Session, batchsize: int = 10000) -> None:
+        """
+        Recreate the trigrams for every player, e.g. for players loaded before pf_ign_trigram existed.
+        """
+        logger.info("Rebuilding all PfIgnTrigrams")
+        session.exec(delete(PfIgnTrigram))  # type: ignore
+        last_id = None
+        while True:
+            statement = select(PfPlayer.id, PfPlayer.ign).order_by(PfPlayer.id).limit(batchsize)
+            if last_id is not None:
+                statement = statement.where(PfPlayer.id > last_id)
+            rows = session.exec(statement).all()
+            if not rows:
+                break
+            trigram_rows = [
+                dict(trigram=t, pf_player_id=pf_player_id) for pf_player_id, ign in rows for t in ign_trigrams(ign)
+            ]
+            if trigram_rows:
+                session.execute(insert(PfIgnTrigram), trigram_rows)
+            session.commit()
+            last_id = rows[-1][0]
 
     #
     def player_count(self, session):
@@ -88,11 +167,67 @@ class PlayfabDB:
         session.add(player)
 
         if ign:
+            self.set_ign_trigrams(players=[player], session=session)
             self.check_update_ign_history(player=player, session=session)
 
         session.commit()
         logger.info(f"Updated PfPlayer with ID {pf_player_id} in DB")
 
+    #
+    def upsert_players(self, players: List[PfPlayer], session: Session) -> None:
+        """
+        Insert or update a page of players (e.g. from a leaderboard) in one transaction.
+        Existing players get their ign and last_login updated.
+        A new IgnHistory entry is added for every player whose ign changed or who has no history yet.
+        """
+        if not players:
+            return
+
+        # de-dup on id, the last row for a player wins
+        by_id = {p.id: p for p in players}
+        ids = list(by_id.keys())
+        logger.info(f"Upserting {len(ids)} PfPlayers in DB")
+
+        # most recent ign in the history for each player
+        statement = select(PfIgnHistory).where(PfIgnHistory.pf_player_id.in_(ids))  # type: ignore
+        most_recent = {}
+        for row in session.exec(statement):
+            prev = most_recent.get(row.pf_player_id)
+            if prev is None or row.date > prev.date:
+                most_recent[row.pf_player_id] = row
+
+        rows = [
+            dict(id=p.id, ign=p.ign, account_created=p.account_created, last_login=p.last_login, avatar_url=p.avatar_url)
+            for p in by_id.values()
+        ]
+
+        dialect = session.get_bind().dialect.name
+        if dialect in ("mysql", "mariadb"):
+            statement = mysql.insert(PfPlayer).values(rows)
+            statement = statement.on_duplicate_key_update(
+                ign=statement.inserted.ign, last_login=statement.inserted.last_login
+            )
+        elif dialect == "sqlite":
+            statement = sqlite.insert(PfPlayer).values(rows)
+            statement = statement.on_conflict_do_update(
+                index_elements=["id"],
+                set_=dict(ign=statement.excluded.ign, last_login=statement.excluded.last_login),
+            )
+        else:
+            raise GoDbError(f"upsert_players only supports MySQL and SQLite, not {dialect}")
+        session.exec(statement)  # type: ignore
+
+        now = datetime.now()
+        changed = []
+        for p in by_id.values():
+            prev = most_recent.get(p.id)
+            if prev is None or prev.ign != p.ign:
+                session.add(PfIgnHistory(pf_player_id=p.id, date=now, ign=p.ign))
+                changed.append(p)
+
+        self.set_ign_trigrams(players=changed, session=session)
+        session.commit()
+
     #
     def delete_player(self, session: Session, pf_player_id: int) -> None:
         logger.info(f"Deleting PfPlayer with ID {pf_player_id} from DB")
@@ -108,6 +243,7 @@ class PlayfabDB:
     def delete_all_players(self, session: Session) -> None:
         logger.info("Deleting all PfPlayers from DB")
 
+        session.exec(delete(PfIgnTrigram))  # type: ignore
         statement = delete(PfPlayer)
         session.exec(statement)  # type: ignore
         session.commit()
@@ -119,6 +255,31 @@ class PlayfabDB:
         session.add(stats)
         session.commit()
 
+    #
+    def add_career_stats_bulk(self, stats: List[PfCareerStats], session: Session) -> None:
+        """
+        Insert a page of CareerStats with a single executemany and one commit.
+        """
+        if not stats:
+            return
+        logger.info(f"Adding {len(stats)} CareerStats in DB")
+        columns = [c.name for c in PfCareerStats.__table__.columns]  # type: ignore
+        rows = [{c: getattr(st, c) for c in columns} for st in stats]
+        session.execute(insert(PfCareerStats), rows)
+        session.commit()
+
+    #
+    def latest_career_stats_dates(self, pf_player_ids: List[int], session: Session) -> Dict[int, datetime]:
+        """
+        Returns the date of the most recent CareerStats for each player that has any.
+        """
+        if not pf_player_ids:
+            return {}
+        statement = select(PfCareerStats.pf_player_id, func.max(PfCareerStats.date))
+        statement = statement.where(PfCareerStats.pf_player_id.in_(pf_player_ids))  # type: ignore
+        statement = statement.group_by(PfCareerStats.pf_player_id)
+        return {pf_player_id: date for pf_player_id, date in session.exec(statement)}
+
     #
     def delete_all_career_stats(self, session: Session) -> None:
         logger.info("Deleting all CareerStats from DB")
@@ -147,6 +308,25 @@ class PlayfabDB:
         statement = select(func.count(PfIgnHistory.ign))  # type: ignore
         return session.exec(statement).one()
 
+    #
+    def save_crawl_checkpoint(self, checkpoint: PfCrawlCheckpoint, session: Session) -> None:
+        checkpoint.updated_at = datetime.now()
+        session.merge(checkpoint)
+        session.commit()
+
+    #
+    def read_crawl_checkpoint(
+        self, stat_name: str, session: Session, run_id: Optional[str] = None
+    ) -> Optional[PfCrawlCheckpoint]:
+        """
+        Returns the checkpoint for run_id, or the most recently updated one for stat_name if run_id is None.
+        """
+        statement = select(PfCrawlCheckpoint).where(PfCrawlCheckpoint.stat_name == stat_name)
+        if run_id is not None:
+            statement = statement.where(PfCrawlCheckpoint.run_id == run_id)
+        statement = statement.order_by(PfCrawlCheckpoint.updated_at.desc())  # type: ignore
+        return session.exec(statement).first()
+
     #
     def calc_rating_from_stats(
         self, pf_player_id, session: Session, snapshot_date: Optional[datetime] = None
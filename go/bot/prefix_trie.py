@@ -0,0 +1,66 @@
+from collections import deque
+from typing import Dict, List, Tuple
+
+
+class PrefixTrie:
+    """
+    Maps case-insensitive keys to values (e.g. lower-cased ign -> ign as displayed)
+    and finds the values of the keys that start with a prefix, shortest keys first.
+    """
+
+    class Node:
+        __slots__ = ("children", "values")
+
+        def __init__(self):
+            self.children: Dict[str, "PrefixTrie.Node"] = {}
+            self.values: Tuple[str, ...] = ()
+
+    #
+    def __init__(self):
+        self.root = PrefixTrie.Node()
+        self.size = 0
+
+    #
+    def __len__(self) -> int:
+        return self.size
+
+    #
+    def insert(self, key: str, value: str) -> None:
+        node = self.root
+        for c in key.lower():
+            child = node.children.get(c)
+            if child is None:
+                child = node.children[c] = PrefixTrie.Node()
+            node = child
+        if value not in node.values:
+            node.values = node.values + (value,)
+            self.size += 1
+
+    #
+    def remove(self, key: str, value: str) -> None:
+        # empty nodes are left in place, they're dropped the next time the trie is rebuilt
+        node = self.root
+        for c in key.lower():
+            node = node.children.get(c)  # type: ignore
+            if node is None:
+                return
+        if value in node.values:
+            node.values = tuple(v for v in node.values if v != value)
+            self.size -= 1
+
+    #
+    def search(self, prefix: str, limit: int = 25) -> List[str]:
+        node = self.root
+        for c in prefix.lower():
+            node = node.children.get(c)  # type: ignore
+            if node is None:
+                return []
+
+        # breadth first so the closest completions come first
+        result = []
+        queue = deque([node])
+        while queue and len(result) < limit:
+            node = queue.popleft()
+            result.extend(node.values[: limit - len(result)])
+            queue.extend(node.children[c] for c in sorted(node.children))
+        return result
@@ -0,0 +1,98 @@
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from sqlmodel import Session, select
+
+from go.bot.logger import create_logger
+from go.bot.models import GoRatings
+
+logger = create_logger(__name__)
+
+RatingKey = Tuple[str, str, int]
+
+
+class RatingCache:
+    """
+    In-memory GoRatings keyed by (season, rating_type, pf_player_id).
+
+    Ratings are bulk loaded once a season so a warmed (season, rating_type) is read whole
+    and then served from memory.  A player missing from a warmed season has no rating.
+    Players whose rating was written since the warm are marked stale and read from the DB
+    until a committed rating for them has been seen.
+    """
+
+    def __init__(self):
+        self.ratings: Dict[RatingKey, float] = {}
+        self.warmed: Set[Tuple[str, str]] = set()
+        self.stale: Set[RatingKey] = set()
+        self.lock = threading.Lock()
+
+    #
+    def __len__(self) -> int:
+        return len(self.ratings)
+
+    #
+    def is_warm(self, season: str, rating_type: str = "official") -> bool:
+        return (season, rating_type) in self.warmed
+
+    #
+    def warm(self, session: Session, season: str, rating_type: str = "official") -> int:
+        """
+        (Re)load every rating for season and rating_type.  Returns the number of ratings loaded.
+        """
+        statement = select(GoRatings.pf_player_id, GoRatings.go_rating).where(GoRatings.season == season)
+        statement = statement.where(GoRatings.rating_type == rating_type)
+        ratings = {(season, rating_type, pf_player_id): go_rating for pf_player_id, go_rating in session.exec(statement)}
+
+        with self.lock:
+            self._drop(season, rating_type)
+            self.ratings.update(ratings)
+            self.warmed.add((season, rating_type))
+
+        logger.info(f"RatingCache warmed {len(ratings)} {rating_type} ratings for {season}")
+        return len(ratings)
+
+    #
+    def get(self, season: str, rating_type: str, pf_player_id: int) -> Tuple[bool, Optional[float]]:
+        """
+        Returns (hit, go_rating).  On a miss the caller has to read the DB.
+        """
+        key = (season, rating_type, pf_player_id)
+        if (season, rating_type) not in self.warmed or key in self.stale:
+            return False, None
+        return True, self.ratings.get(key)
+
+    #
+    def put(self, season: str, rating_type: str, pf_player_id: int, go_rating: Optional[float]) -> None:
+        # only committed ratings read back from the DB clear a stale player,
+        # a None could just mean the write hasn't been committed yet
+        if go_rating is None or (season, rating_type) not in self.warmed:
+            return
+        key = (season, rating_type, pf_player_id)
+        with self.lock:
+            self.ratings[key] = go_rating
+            self.stale.discard(key)
+
+    #
+    def invalidate_player(self, season: str, rating_type: str, pf_player_id: int) -> None:
+        key = (season, rating_type, pf_player_id)
+        with self.lock:
+            self.ratings.pop(key, None)
+            self.stale.add(key)
+
+    #
+    def invalidate(self, season: Optional[str] = None) -> None:
+        """
+        Forget season (or every season) so its ratings are read from the DB until it is warmed again.
+        """
+        with self.lock:
+            for warm_season, rating_type in list(self.warmed):
+                if season is None or warm_season == season:
+                    self._drop(warm_season, rating_type)
+
+    #
+    def _drop(self, season: str, rating_type: str) -> None:
+        self.warmed.discard((season, rating_type))
+        for key in [k for k in self.ratings if k[0] == season and k[1] == rating_type]:
+            del self.ratings[key]
+        self.stale = {k for k in self.stale if k[0] != season or k[1] != rating_type}
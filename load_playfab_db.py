@@ -1,77 +1,174 @@
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
+import requests
+from sqlalchemy import Engine
 from sqlmodel import Session, SQLModel, create_engine
 
-from config import _config 
+from config import _config
 from go.bot.logger import create_logger
-from go.bot.models import PfPlayer
-from go.bot.playfab_api import PlayfabApi
+from go.bot.models import PfCrawlCheckpoint, PfPlayer
+from go.bot.playfab_api import PlayfabApi, RateLimiter
 from go.bot.playfab_db import PlayfabDB
 
 logger = create_logger(__name__)
 
+# what a Playfab call raises when a request gives up or the response isn't what we expect
+PLAYFAB_ERRORS = (requests.RequestException, ValueError, KeyError, TypeError)
 
-def main():
 
-    parser = argparse.ArgumentParser(description="sample argument parser")
-    parser.add_argument("--start", default=0, type=int, required=False)
-    parser.add_argument("--end", default=10, type=int, required=False)
-    parser.add_argument("--batchsize", default=100, type=int, required=False)
-    parser.add_argument(
-        "--statname",
-        default="CareerWins",
-        type=str,
-        required=False,
-        help="CareerWins, CareerKills, CareerDamage, WeeklyWinsTotal, WeeklyKillsTotal"
-    )
-    parser.add_argument(
-        "--min", default=0, type=int, required=False, help="Stop running after statname value gets below min"
-    )
-    parser.add_argument(
-        "--recent",
-        default=1,
-        type=float,
-        required=False,
-        help="Skip getting new stats if there are recent ones within x days",
+def load_checkpoint(
+    pfdb: PlayfabDB,
+    session: Session,
+    stat_name: str,
+    start: int,
+    end: int,
+    run_id: Optional[str],
+    new_run_id: str,
+    resume: bool,
+) -> Optional[PfCrawlCheckpoint]:
+    """
+    Returns the checkpoint to continue from (or a new one under new_run_id),
+    or None if there is nothing left to crawl.
+    """
+    if resume:
+        checkpoint = pfdb.read_crawl_checkpoint(stat_name=stat_name, run_id=run_id, session=session)
+        if checkpoint is None:
+            logger.info(f"No checkpoint found for {stat_name = } {run_id = }, starting at rank {start}")
+        elif checkpoint.completed:
+            logger.info(f"Crawl {checkpoint.run_id} for {stat_name} already completed")
+            return None
+        else:
+            logger.info(f"Resuming crawl {checkpoint.run_id} for {stat_name} at rank {checkpoint.last_rank + 1}")
+            return checkpoint
+
+    checkpoint = PfCrawlCheckpoint(
+        run_id=new_run_id,
+        stat_name=stat_name,
+        start_rank=start,
+        end_rank=end,
+        last_rank=start - 1,
     )
-    args = parser.parse_args()
+    pfdb.save_crawl_checkpoint(checkpoint, session=session)
+    return checkpoint
 
-    engine = create_engine(_config.godb_url, echo=_config.godb_echo)
 
-    SQLModel.metadata.create_all(engine)
+def crawl(
+    engine: Engine,
+    pfapi: PlayfabApi,
+    stat_names: Optional[List[str]] = None,
+    start: int = 0,
+    end: int = 10,
+    batchsize: int = 100,
+    min_value: int = 0,
+    recent_days: float = 1,
+    workers: int = 1,
+    run_id: Optional[str] = None,
+    resume: bool = False,
+) -> None:
+    """
+    Walk the stat_names leaderboards from rank start to end and store the players and their career stats.
+
+    Pages of the different leaderboards are interleaved into one queue.  A player that shows up
+    on more than one leaderboard is only stored and has stats fetched once per run.
 
-    pfapi = PlayfabApi()
-    pfapi.login_to_playfab()
+    Leaderboard pages and per-player stats requests run on a pool of `workers` threads.
+    All DB writes stay on the calling thread.
 
+    Progress of each leaderboard is checkpointed after every page under run_id.  With resume the crawl
+    continues after the last completed page of run_id (or of the latest run for a stat if run_id is None).
+    """
+    stat_names = stat_names or ["CareerWins"]
     pfdb = PlayfabDB()
+    new_run_id = run_id or datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    with Session(engine) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+
+        checkpoints: Dict[str, PfCrawlCheckpoint] = {}
+        stat_pages: Dict[str, List[Tuple[int, int]]] = {}
+        for stat_name in dict.fromkeys(stat_names):
+            checkpoint = load_checkpoint(pfdb, session, stat_name, start, end, run_id, new_run_id, resume)
+            if checkpoint is None:
+                continue
+            checkpoints[stat_name] = checkpoint
+
+            # the (start_rank, batchsize) of every leaderboard page to load for this stat
+            stat_pages[stat_name] = []
+            for page_start in range(checkpoint.last_rank + 1, checkpoint.end_rank, batchsize):
+                stat_pages[stat_name].append((page_start, min(batchsize, checkpoint.end_rank - page_start)))
+
+        # interleave the pages of each stat: page 1 of every stat, then page 2 of every stat, ...
+        pages = []
+        for i in range(max([len(_) for _ in stat_pages.values()], default=0)):
+            for stat_name, stat_name_pages in stat_pages.items():
+                if i < len(stat_name_pages):
+                    pages.append((stat_name, *stat_name_pages[i]))
 
-    with Session(engine) as session:
+        # keep up to `workers` leaderboard pages in flight ahead of the one being processed
+        page_futures = deque()
+        next_page = 0
 
-        start = args.start
-        batchsize = args.batchsize
-        end = args.end
-        while start < end:
+        def submit_next_page():
+            nonlocal next_page
+            stat_name, page_start, page_size = pages[next_page]
+            future = None
+            if stat_name in checkpoints:
+                future = pool.submit(pfapi.get_leaderboard, page_start, page_size, stat_name)
+            page_futures.append(future)
+            next_page += 1
 
-            if start + batchsize > end:
-                batchsize = end - start
+        while next_page < len(pages) and len(page_futures) < workers:
+            submit_next_page()
+
+        # players already handled this run
+        seen_ids = set()
+
+        for stat_name, page_start, page_size in pages:
+            future = page_futures.popleft()
+            if next_page < len(pages):
+                submit_next_page()
+
+            # this stat already stopped early
+            if future is None or stat_name not in checkpoints:
+                continue
+            try:
+                leaderboard = future.result()
+            except PLAYFAB_ERRORS as err:
+                # the checkpoint is at the last saved page, a resume picks up from there
+                logger.error(f"{stat_name} leaderboard page at rank {page_start} failed: {err!r}, stopping")
+                del checkpoints[stat_name]
+                continue
+            checkpoint = checkpoints[stat_name]
 
             logger.info("======================================================")
             logger.info("======================================================")
-            logger.info(f"Loading: {start = }, {end = }, {batchsize = }")
+            logger.info(f"Loading: {stat_name}, start = {page_start}, end = {checkpoint.end_rank}, batchsize = {page_size}")
             logger.info("------------------------------------------------------")
 
-            leaderboard = pfapi.get_leaderboard(start_rank=start, batchsize=batchsize, stat_name=args.statname)
-            start += batchsize
+            if not leaderboard:
+                # either the end of the leaderboard or the request failed, a resume will retry this page
+                logger.warning(f"No {stat_name} leaderboard rows returned at rank {page_start}, stopping")
+                del checkpoints[stat_name]
+                continue
 
+            min_reached = False
+            players = []
             for lb_row in leaderboard:
                 logger.info("")
 
-                if args.min and lb_row.stat_value < args.min:
-                    logger.info(f"Minimum stat value reached {lb_row.stat_value} < {args.min}")
-                    start = end
+                if min_value and lb_row.stat_value < min_value:
+                    logger.info(f"Minimum stat value reached {lb_row.stat_value} < {min_value}")
+                    min_reached = True
                     break
 
+                if lb_row.player_id in seen_ids:
+                    logger.info(f"Rank {lb_row.stat_rank}, Value {lb_row.stat_value} -- already loaded this run")
+                    continue
+                seen_ids.add(lb_row.player_id)
+
                 player = PfPlayer(
                     id=lb_row.player_id,
                     ign=lb_row.ign,
@@ -80,36 +177,120 @@ def main():
                 )
 
                 logger.info(f"Rank {lb_row.stat_rank}, Value {lb_row.stat_value} -- {player}")
+                players.append(player)
 
-                if pfdb.player_exists(pf_player_id=player.id, session=session):
-                    logger.info("Player already in DB")
-                    pfdb.update_player(
-                        session=session, pf_player_id=player.id, ign=player.ign, last_login=player.last_login
-                    )
-                else:
-                    session.add(player)
-
-                player = pfdb.read_player(pf_player_id=player.id, session=session)
-                if player is None:
-                    logger.error(f"Player not found in DB")
-                    continue
+            # one transaction for the whole page
+            pfdb.upsert_players(players=players, session=session)
 
-                career_stats = [_ for _ in player.career_stats]
-                career_stats.sort(key=lambda x: x.date)
+            latest_dates = pfdb.latest_career_stats_dates([p.id for p in players], session=session)
 
-                now = datetime.now()
-                if career_stats and (now - career_stats[-1].date) < timedelta(days=args.recent):
+            players_to_fetch = []
+            now = datetime.now()
+            for player in players:
+                latest = latest_dates.get(player.id)
+                if latest and (now - latest) < timedelta(days=recent_days):
                     # we already have pretty recent stats
-                    logger.info(f"Already have recent stats for: {player.ign} at {career_stats[-1].date}")
-                    pass
+                    logger.info(f"Already have recent stats for: {player.ign} at {latest}")
                 else:
                     logger.info(f"Getting stats for: {player.ign}")
-                    try:
-                        stats = pfapi.get_player_career_stats(player_id=player.id)
-                        session.add(stats)
-                        session.commit()
-                    except AttributeError as e:
-                        logger.error(f"get_player_career_stats failed {e}")
+                    players_to_fetch.append(player.id)
+
+            stats_futures = [pool.submit(pfapi.get_player_career_stats, player_id=pid) for pid in players_to_fetch]
+            page_stats = []
+            for stats_future in as_completed(stats_futures):
+                try:
+                    stats = stats_future.result()
+                except PLAYFAB_ERRORS as err:
+                    logger.error(f"{stat_name} page at rank {page_start}: get_player_career_stats failed {err!r}")
+                    continue
+                if stats is not None:
+                    page_stats.append(stats)
+
+            # one transaction for the whole page
+            pfdb.add_career_stats_bulk(stats=page_stats, session=session)
+
+            # only the ranks that came back are done, a short page is the end of the leaderboard for now
+            checkpoint.last_rank = max(lb_row.stat_rank for lb_row in leaderboard)
+            checkpoint.completed = min_reached or checkpoint.last_rank >= checkpoint.end_rank - 1
+            pfdb.save_crawl_checkpoint(checkpoint, session=session)
+
+            if min_reached or len(leaderboard) < page_size:
+                del checkpoints[stat_name]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="sample argument parser")
+    parser.add_argument("--start", default=0, type=int, required=False)
+    parser.add_argument("--end", default=10, type=int, required=False)
+    parser.add_argument("--batchsize", default=100, type=int, required=False)
+    parser.add_argument(
+        "--statname",
+        default=["CareerWins"],
+        nargs="+",
+        type=str,
+        required=False,
+        help="One or more of CareerWins, CareerKills, CareerDamage, WeeklyWinsTotal, WeeklyKillsTotal"
+    )
+    parser.add_argument(
+        "--min", default=0, type=int, required=False, help="Stop running after statname value gets below min"
+    )
+    parser.add_argument(
+        "--recent",
+        default=1,
+        type=float,
+        required=False,
+        help="Skip getting new stats if there are recent ones within x days",
+    )
+    parser.add_argument(
+        "--workers",
+        default=1,
+        type=int,
+        required=False,
+        help="Number of concurrent Playfab requests (leaderboard pages and player stats)",
+    )
+    parser.add_argument(
+        "--rate",
+        default=20,
+        type=float,
+        required=False,
+        help="Starting Playfab requests per second, adjusts up or down depending on throttling",
+    )
+    parser.add_argument(
+        "--run_id",
+        default=None,
+        type=str,
+        required=False,
+        help="Name for this crawl's checkpoint, defaults to the start time",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the checkpoints of --run_id or the latest crawl of each --statname",
+    )
+    args = parser.parse_args()
+
+    engine = create_engine(_config.godb_url, echo=_config.godb_echo)
+
+    SQLModel.metadata.create_all(engine)
+
+    rate_limiter = RateLimiter(rate=args.rate, max_rate=max(args.rate, 100.0))
+    with PlayfabApi(pool_size=args.workers, rate_limiter=rate_limiter) as pfapi:
+        pfapi.login_to_playfab()
+
+        crawl(
+            engine=engine,
+            pfapi=pfapi,
+            stat_names=args.statname,
+            start=args.start,
+            end=args.end,
+            batchsize=args.batchsize,
+            min_value=args.min,
+            recent_days=args.recent,
+            workers=args.workers,
+            run_id=args.run_id,
+            resume=args.resume,
+        )
 
 
 if __name__ == "__main__":
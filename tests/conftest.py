@@ -1,5 +1,11 @@
+import asyncio
+import json
 import re
+import socket
+import threading
+from collections import Counter
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from types import SimpleNamespace
 from typing import Generator, List
 
@@ -10,6 +16,7 @@ import pytest
 import pytest_asyncio
 from discord.ext import commands
 from sqlalchemy import Engine
+from sqlalchemy.pool import StaticPool
 from sqlmodel import Session, SQLModel, create_engine
 
 from config import _config
@@ -17,6 +24,7 @@ from go.bot.go_bot import GoBot
 from go.bot.go_cog import DiscordUser, GoCog
 from go.bot.go_db import GoDB
 from go.bot.models import GoPlayer, GoTeam, PfCareerStats, PfPlayer
+from go.bot.playfab_api import as_player_id, as_playfab_id
 from go.bot.playfab_db import PlayfabDB
 
 
@@ -279,7 +287,10 @@ def du_owner(go_p_owner, scope="function"):
 @pytest.fixture
 def engine(scope="session") -> Generator[Engine, None, None]:
     sqlite_url = f"sqlite://"  # in mem
-    engine = create_engine(sqlite_url, echo=_config.godb_echo)
+    # one shared connection so GoCog's DB worker threads see the same in memory DB
+    engine = create_engine(
+        sqlite_url, echo=_config.godb_echo, connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
     SQLModel.metadata.create_all(engine)
     yield engine
 
@@ -327,6 +338,10 @@ class TestBotStub(commands.Bot):
         self.godb = None
         self.pfdb = None
 
+    def is_ready(self):
+        # never connects to Discord
+        return False
+
 
 @pytest.fixture
 def gocog(godb, pfdb, engine, scope="function"):
@@ -339,6 +354,7 @@ def gocog(godb, pfdb, engine, scope="function"):
 
     cog = GoCog(bot)
     yield cog
+    cog.db_pool.shutdown()
 
 
 @pytest.fixture
@@ -418,6 +434,7 @@ class ResponseStub:
 
 class InteractionStub:
     def __init__(self, du, channel_id):
+        self.id = id(self)
         self.user = UserStub(du)
 
         self.command = SimpleNamespace()
@@ -453,6 +470,176 @@ def interaction_owner(du_owner, channels, scope="function"):
     return InteractionStub(du_owner, channels[0])
 
 
+class FakePlayfab:
+    """
+    Local stand-in for the Playfab Client API.
+    Serves a leaderboard of player_count players where rank i has player_id 1000+i.
+    """
+
+    def __init__(self, player_count=300):
+        self.player_count = player_count
+        self.request_counts = Counter()
+        self.connection_count = 0
+        # the next throttle_count requests get a 429 and the next error_count get a 500
+        # error_command limits the 500s to one command
+        self.throttle_count = 0
+        self.error_count = 0
+        self.error_command = None
+        self.retry_after = 0.05
+        # shifts which players are on a leaderboard, by StatisticName
+        self.stat_offsets = {}
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 so clients can keep connections alive
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # headers and body are separate writes, don't let Nagle delay the body
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with fake.lock:
+                    fake.connection_count += 1
+
+            def do_POST(self):
+                command = self.path.rsplit("/", 1)[-1]
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with fake.lock:
+                    fake.request_counts[command] += 1
+                    throttled = fake.throttle_count > 0
+                    failed = not throttled and fake.error_count > 0
+                    failed = failed and fake.error_command in (None, command)
+                    if throttled:
+                        fake.throttle_count -= 1
+                    elif failed:
+                        fake.error_count -= 1
+                if throttled:
+                    status = 429
+                    body = {"code": 429, "error": "APIClientRequestRateLimitExceeded", "errorCode": 1199}
+                    body["retryAfterSeconds"] = fake.retry_after
+                elif failed:
+                    status, body = 500, {"code": 500, "error": "InternalServerError"}
+                else:
+                    status, body = fake.respond(command, payload)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/Client"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def respond(self, command, payload):
+        if command == "LoginWithEmailAddress":
+            return 200, {"code": 200, "data": {"SessionTicket": "fake-ticket"}}
+
+        if command == "GetLeaderboard":
+            start = payload["StartPosition"]
+            stop = min(start + payload["MaxResultsCount"], self.player_count)
+            offset = self.stat_offsets.get(payload.get("StatisticName"), 0)
+            rows = []
+            for rank in range(start, stop):
+                rows.append(
+                    {
+                        "PlayFabId": as_playfab_id(1000 + offset + rank),
+                        "DisplayName": f"ign{1000 + offset + rank}",
+                        "StatValue": self.player_count - rank,
+                        "Position": rank,
+                        "Profile": {"Created": "2022-01-01T00:00:00Z", "LastLogin": "2023-01-01T00:00:00Z"},
+                    }
+                )
+            return 200, {"code": 200, "data": {"Leaderboard": rows}}
+
+        if command == "GetPlayerCombinedInfo":
+            player_id = as_player_id(payload["PlayFabId"])
+            stats = {
+                "CareerGamesPlayed": 100,
+                "CareerWins": 10,
+                "CareerKills": 200,
+                "CareerDamage": player_id,
+                "MMR1": 1500,
+                "PlayerSkill": 20,
+            }
+            stat_rows = [{"StatisticName": k, "Value": v} for k, v in stats.items()]
+            return 200, {"code": 200, "data": {"InfoResultPayload": {"PlayerStatistics": stat_rows}}}
+
+        return 404, {"code": 404, "error": "NotFound"}
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_playfab(scope="function"):
+    fake = FakePlayfab()
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+class FakeUser:
+    """
+    discord.User stand-in for DM delivery, the first `failures` sends raise `error`.
+    """
+
+    def __init__(self, user_id, failures=0, error=None, delay=0.0):
+        self.id = user_id
+        self.failures = failures
+        self.error = error
+        self.delay = delay
+        self.messages = []
+
+    async def send(self, message):
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        self.messages.append(message)
+
+
+class FakeBot:
+    def __init__(self):
+        self.users = {}
+        # the users get_user knows about, the others have to be fetched
+        self.cached = set()
+        self.ready = True
+
+    def add_user(self, user_id, failures=0, error=None, delay=0.0, cached=True) -> FakeUser:
+        user = self.users[user_id] = FakeUser(user_id, failures=failures, error=error, delay=delay)
+        if cached:
+            self.cached.add(user_id)
+        return user
+
+    def get_user(self, user_id):
+        return self.users.get(user_id) if user_id in self.cached else None
+
+    async def fetch_user(self, user_id):
+        if user_id not in self.users:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown User")
+        return self.users[user_id]
+
+    def is_ready(self):
+        return self.ready
+
+
+@pytest.fixture
+def fake_bot(scope="function"):
+    return FakeBot()
+
+
 # @pytest_asyncio.fixture
 # async def bot(engine, godb, pfdb):
 #     # Setup
@@ -0,0 +1,68 @@
+import asyncio
+
+import discord
+import pytest
+
+from go.bot.dm_delivery import DmDelivery, DmStatus
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = "fake"
+
+
+@pytest.mark.asyncio
+async def test_dm_delivery_concurrent(fake_bot):
+    users = [fake_bot.add_user(i, delay=0.05) for i in range(8)]
+    delivery = DmDelivery(fake_bot, concurrency=4)
+
+    start = asyncio.get_running_loop().time()
+    for user in users:
+        delivery.enqueue(user.id, f"hello {user.id}")
+    # unknown users are skipped
+    delivery.enqueue(999, "nobody")
+    await asyncio.wait_for(delivery.join(), timeout=2)
+    elapsed = asyncio.get_running_loop().time() - start
+
+    assert all(u.messages == [f"hello {u.id}"] for u in users)
+    assert delivery.sent_count == 8
+    # 8 sends of 0.05s, 4 at a time
+    assert elapsed < 0.3
+    await delivery.stop()
+
+
+@pytest.mark.asyncio
+async def test_dm_delivery_retries(fake_bot):
+    flaky = fake_bot.add_user(1, failures=2, error=discord.DiscordServerError(FakeResponse(503), "unavailable"))
+    down = fake_bot.add_user(2, failures=10, error=OSError("connection reset"))
+    blocked = fake_bot.add_user(3, failures=10, error=discord.Forbidden(FakeResponse(403), "no DMs"))
+    delivery = DmDelivery(fake_bot, max_retries=3, retry_delay=0.001)
+
+    for user_id in [1, 2, 3]:
+        delivery.enqueue(user_id, "hi")
+    await asyncio.wait_for(delivery.join(), timeout=2)
+
+    assert flaky.messages == ["hi"]
+    assert down.failures == 10 - 4
+    # forbidden isn't retried
+    assert blocked.failures == 10 - 1
+    assert delivery.sent_count == 1
+    assert delivery.failed_count == 2
+    await delivery.stop()
+
+
+@pytest.mark.asyncio
+async def test_dm_delivery_status(fake_bot):
+    fake_bot.add_user(1, cached=False)
+    fake_bot.add_user(2, failures=1, error=discord.HTTPException(FakeResponse(400), "bad request"))
+    fake_bot.add_user(3, failures=1, error=discord.Forbidden(FakeResponse(403), "no DMs"))
+    delivery = DmDelivery(fake_bot)
+
+    futures = delivery.enqueue_many([(1, "hi"), (2, "hi"), (3, "hi"), (999, "hi")])
+    statuses = await asyncio.wait_for(asyncio.gather(*futures), timeout=2)
+
+    # users missing from the cache are fetched, unknown users and closed DMs aren't worth retrying
+    assert statuses == [DmStatus.SENT, DmStatus.FAILED, DmStatus.UNDELIVERABLE, DmStatus.UNDELIVERABLE]
+    assert fake_bot.users[1].messages == ["hi"]
+    await delivery.stop()
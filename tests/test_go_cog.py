@@ -1,11 +1,14 @@
+from collections import defaultdict
 from datetime import date, datetime
 
 import pytest
 from sqlalchemy.exc import InvalidRequestError
 
 from config import _config 
+from go.bot import go_cog
 from go.bot.exceptions import DiscordUserError
 from go.bot.go_cog import DiscordUser
+from go.bot.lobby_engine import rating_spread
 from go.bot.logger import create_logger
 from go.bot.models import GoRatings, PfCareerStats, PfPlayer
 from go.bot.playfab_api import as_player_id
@@ -129,6 +132,80 @@ def test_set_ign_doesnt_exist(gocog, godb, pfdb, session, pf_p1, du1):
         gocog.do_set_ign(player=du1, ign="IGN DOESNT EXIST", session=session)
 
 
+def test_set_ign_fuzzy_match_is_not_set(gocog, godb, pfdb, session, pf_p1, du1):
+    pfdb.create_player(player=pf_p1, session=session)
+
+    # "IGN1X" is close to "IGN1" but only gets suggested
+    with pytest.raises(DiscordUserError, match='Did you mean "IGN1"'):
+        gocog.do_set_ign(player=du1, ign="IGN1X", session=session)
+
+
+def test_set_ign_old_ign_from_index(gocog, godb, pfdb, session, pf_p1, du1):
+    pfdb.create_player(player=pf_p1, session=session)
+    pfdb.update_player(session=session, pf_player_id=pf_p1.id, ign="NEW IGN")
+    gocog.ign_index.refresh(session)
+
+    # the player can still be found by the ign they had before
+    go_p = gocog.do_set_ign(player=du1, ign="ign1", session=session)
+    assert go_p.pf_player_id == pf_p1.id
+
+
+def test_set_ign_current_holder_over_old(gocog, godb, pfdb, session, pf_p1, pf_p1v2, du1):
+    pfdb.create_player(player=pf_p1, session=session)
+    pfdb.update_player(session=session, pf_player_id=pf_p1.id, ign="NEW IGN")
+    # someone else takes the ign pf_p1 used to have
+    pfdb.create_player(player=pf_p1v2, session=session)
+    gocog.ign_index.refresh(session)
+
+    go_p = gocog.do_set_ign(player=du1, ign="IGN1", session=session)
+    assert go_p.pf_player_id == pf_p1v2.id
+
+
+@pytest.mark.asyncio
+async def test_autocomplete(gocog_preload, session, du1, du2, interaction1, channels, dates):
+    gocog = gocog_preload
+    gocog.godb.set_session_time(session_id=channels[0], session_time=dates[0], session=session)
+
+    # nothing until the indexes are loaded
+    assert [] == await gocog.ign_autocomplete(interaction1, "ig")
+    gocog.do_refresh_indexes()
+
+    choices = await gocog.ign_autocomplete(interaction1, "ig")
+    assert [_.value for _ in choices] == ["IGN1", "IGN2", "IGN3"]
+    assert [] == await gocog.ign_autocomplete(interaction1, "")
+
+    # new and renamed teams are added right away
+    gocog.do_signup(players=[du1, du2], team_name="Team Awesome", session_id=channels[0], session=session)
+    choices = await gocog.team_name_autocomplete(interaction1, "team a")
+    assert [_.value for _ in choices] == ["Team Awesome"]
+
+    gocog.do_rename_team("Better Name", du1, session_id=channels[0], session=session)
+    assert [] == await gocog.team_name_autocomplete(interaction1, "team")
+    choices = await gocog.team_name_autocomplete(interaction1, "B")
+    assert [_.value for _ in choices] == ["Better Name"]
+
+
+@pytest.mark.asyncio
+async def test_team_names_edited_during_refresh(gocog_preload, session, du1, du2, interaction1, channels, monkeypatch):
+    gocog = gocog_preload
+    gocog.do_signup(players=[du1, du2], team_name="Team Awesome", session_id=channels[0], session=session)
+
+    class SlowTrie(go_cog.PrefixTrie):
+        # a signup and a rename land while do_refresh_indexes is reading the teams
+        def insert(self, key, value):
+            if gocog.team_name_edits == []:
+                gocog.update_team_names("Late Team")
+                gocog.update_team_names("Better Name", "Team Awesome")
+            super().insert(key, value)
+
+    monkeypatch.setattr(go_cog, "PrefixTrie", SlowTrie)
+    gocog.do_refresh_indexes()
+
+    assert gocog.team_name_edits is None
+    choices = await gocog.team_name_autocomplete(interaction1, "")
+    assert sorted(_.value for _ in choices) == ["Better Name", "Late Team"]
+
+
 def test_set_ign_duplicate_ign(gocog, godb, pfdb, session, pf_p1, du1, pf_p1v2):
     pfdb.create_player(player=pf_p1, session=session)
     pfdb.create_player(player=pf_p1v2, session=session)
@@ -194,6 +271,17 @@ def test_signup_solo(gocog, godb, pfdb, session, du1, pf_p1, stats_p1_1):
     assert signup2.team.team_name == "tname1"
 
 
+def test_signup_concurrent_team_creation(gocog_preload, godb, session, du1, du2, go_p1, go_p2, monkeypatch):
+    team = godb.create_team("tname1", [go_p1, go_p2], session, None, _config.go_season)
+
+    # pretend another signup created the team after this one looked for it
+    monkeypatch.setattr(godb, "read_team_with_roster", lambda discord_ids, session: None)
+    signup = gocog_preload.do_signup(players=[du1, du2], team_name="tname2", session_id=channel1, session=session)
+
+    assert signup.team_id == team.id
+    assert 1 == godb.team_count(session=session)
+
+
 def test_signup_duo(gocog, godb, pfdb, session, du1, pf_p1, du2, pf_p2, stats_p1_1, stats_p2_1):
     pfdb.create_player(player=pf_p1, session=session)
     pfdb.create_player(player=pf_p2, session=session)
@@ -413,6 +501,24 @@ def test_change_signup(gocog_preload, session, du1, du2, du3):
     assert godb.read_team_with_name(team_name="tname3", session=session) is None
 
 
+def test_change_signup_roster_collision(gocog_preload, session, du1, du2, monkeypatch):
+    godb = gocog_preload.godb
+    gocog_preload.do_signup(players=[du1, du2], team_name="tname", session_id=channel1, session=session)
+    gocog_preload.do_signup(players=[du1, du2], team_name="tname", session_id=channel2, session=session)
+
+    # as if another signup created the same roster after do_signup looked for it
+    monkeypatch.setattr(godb, "read_team_with_roster", lambda discord_ids, session: None)
+    gocog_preload.do_change_signup(
+        player=du1, players=[du1, du2], new_team_name=None, session_id=channel1, session=session
+    )
+
+    # the cancel isn't rolled back with the failed team insert, the existing team is signed up again
+    assert 1 == godb.team_count(session=session)
+    assert 2 == godb.signup_count(session=session)
+    team = godb.read_team_with_name(team_name="tname", session=session)
+    assert sorted(s.session_id for s in team.signups) == [channel1, channel2]
+
+
 def test_rename_team(gocog_preload, godb, session, du1, du2, du3):
     name1 = "tname1"
     gocog_preload.do_signup(players=[du1, du2], team_name=name1, session_id=channel1, session=session)
@@ -758,17 +864,62 @@ def test_sort_lobbies3(gocog, session, team_list):
     print(f"{teams =}")
 
     host_to_teams = gocog.do_sort_lobbies(hosts, teams)
+    host_dids = {h.host_did for h in hosts}
 
     team_ids = set()
-    for host_id, teams in host_to_teams.items():
-        for team in teams:
-            assert team.id not in teams
+    for host_id, lobby_teams in host_to_teams.items():
+        assert sum(team.team_size for team in lobby_teams) <= 24
+        for team in lobby_teams:
+            assert team.id not in team_ids
             team_ids.add(team.id)
-            assert exptected_lobby_host_id[team.id] == host_id     
-    
+            # teams with a host on them are in that host's lobby
+            team_hosts = {r.player.discord_id for r in team.rosters} & host_dids
+            if team_hosts:
+                assert team_hosts == {host_id}
+
     for team_id, host_id in exptected_lobby_host_id.items():
         if host_id is None:
             assert team_id not in team_ids
         else:
             assert team_id in team_ids
-        
\ No newline at end of file
+
+    # at least as balanced as the snake draft this used to be
+    id_to_rating = {team.id: team.team_rating for team in teams}
+    snake_lobbies = defaultdict(list)
+    for team_id, host_id in exptected_lobby_host_id.items():
+        if host_id is not None:
+            snake_lobbies[host_id].append(id_to_rating[team_id])
+    snake_spread = rating_spread([sum(r) / len(r) for r in snake_lobbies.values()])
+    assignment = gocog.plan_lobbies(hosts, teams)
+    assert assignment.spread <= snake_spread
+    assert assignment.hosts == list(host_to_teams.keys())
+        
+
+def test_session_counts(gocog_preload, godb, session, du1, du2, du3):
+    godb.set_session_time(session_id=channel1, session_time=date1, session=session)
+
+    gocog_preload.do_signup(players=[du1, du2], team_name="tname1", session_id=channel1, session=session)
+    gocog_preload.do_signup(players=[du3], team_name="tname3", session_id=channel1, session=session)
+    gosession = godb.get_session(channel1, session)
+    assert (gosession.team_count, gosession.player_count) == (2, 3)
+
+    gocog_preload.do_cancel(player=du2, session_id=channel1, session=session)
+    session.commit()
+    session.refresh(gosession)
+    assert (gosession.team_count, gosession.player_count) == (1, 1)
+
+    # drift is fixed from the signups
+    gosession.team_count = 5
+    session.add(gosession)
+    session.commit()
+    assert 1 == godb.reconcile_session_counts(session)
+    session.refresh(gosession)
+    assert (gosession.team_count, gosession.player_count) == (1, 1)
+    assert 0 == godb.reconcile_session_counts(session)
+
+    # sessions before since are left alone
+    gosession.player_count = 5
+    session.add(gosession)
+    session.commit()
+    assert 0 == godb.reconcile_session_counts(session, since=date2)
+    assert 1 == godb.reconcile_session_counts(session, since=date1)
@@ -1,3 +1,6 @@
+import asyncio
+import threading
+import time
 from datetime import datetime
 
 import pytest
@@ -207,6 +210,10 @@ async def test_list_schedule(interaction1, gocog_preload_teams, du1):
     await gocog.list_schedule.callback(gocog, interaction1)
     interaction1.assert_msg_regx("^<.*> -- . teams  . players")
 
+    # the preloaded session is in the past
+    await gocog.list_schedule.callback(gocog, interaction1, upcoming=True)
+    interaction1.assert_msg_count("No sessions found.")
+
 
 @pytest.mark.asyncio
 async def test_coin_flip(interaction1, gocog):
@@ -219,3 +226,31 @@ async def test_coin_flip(interaction1, gocog):
     for _ in range(20):
         await gocog.flip_coin.callback(gocog, i, 3)
         interaction1.assert_msg_regx("Random number between 1 and 3: (1|2|3)")
+
+
+@pytest.mark.asyncio
+async def test_db_work_runs_off_the_event_loop(gocog):
+    def slow_query():
+        time.sleep(0.2)
+        return threading.current_thread().name
+
+    task = asyncio.create_task(gocog.run_db(slow_query))
+    ticks = 0
+    while not task.done():
+        await asyncio.sleep(0.01)
+        ticks += 1
+
+    # the event loop kept running while the query was on a worker thread
+    assert ticks >= 5
+    assert task.result().startswith("godb")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_commands(interaction1, interaction_owner, gocog_preload_teams):
+    gocog = gocog_preload_teams
+    await asyncio.gather(
+        gocog.list_teams.callback(gocog, interaction1),
+        gocog.get_session_time.callback(gocog, interaction_owner),
+    )
+    interaction1.assert_msg_count(f"teams:")
+    interaction_owner.assert_msg_count(f"Session time for")
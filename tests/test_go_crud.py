@@ -3,12 +3,13 @@ from time import sleep
 from typing import List
 
 import pytest
-from sqlmodel import delete
+from sqlalchemy import event
+from sqlmodel import delete, select
 
 from config import _config 
-from go.bot.exceptions import GoDbError, PlayerNotFoundError
+from go.bot.exceptions import DuplicateRosterError, GoDbError, PlayerNotFoundError
 from go.bot.go_db import GoTeamPlayerSignup
-from go.bot.models import GoPlayer, GoRatings, GoTeam
+from go.bot.models import GoParticipant, GoPlayer, GoRatings, GoTeam
 
 date1 = datetime(2023, 1, 1)
 date2 = datetime(2023, 1, 2)
@@ -140,6 +141,29 @@ def test_read_team_with_roster(gocog_preload, godb, session, go_p1, go_p2):
     assert teamd == None
 
 
+def test_read_team_with_roster_one_query(gocog_preload, godb, engine, session, go_p1, go_p2, go_p3):
+    team1 = godb.create_team("tn1", [go_p1, go_p2], session, None, seas)
+    team3 = godb.create_team("tn3", [go_p1, go_p2, go_p3], session, None, seas)
+    ids = {go_p1.discord_id, go_p2.discord_id}
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        # a bigger team with the same players doesn't match
+        team = godb.read_team_with_roster(discord_ids=ids, session=session)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)
+    assert team.id == team1.id
+    assert len(statements) == 1
+
+    team = godb.read_team_with_roster(discord_ids=ids | {go_p3.discord_id}, session=session)
+    assert team.id == team3.id
+
+
 def test_read_team_with_name(gocog_preload, godb, session, go_p1, go_p2):
     team1 = godb.create_team("tn1", [go_p1, go_p2], session, None, seas)
     team2 = godb.create_team("tn2", [go_p1], session, None, seas)
@@ -179,6 +203,38 @@ def test_create_team_duplicate_roster(gocog_preload, godb, session, go_p1, go_p2
         teamx = godb.create_team("anything else", [go_p1], session, None, seas)
 
 
+def test_create_team_roster_key(gocog_preload, godb, session, go_p1, go_p2):
+    team1 = godb.create_team("tn1", [go_p2, go_p1], session, None, seas)
+    assert team1.roster_key == f"{go_p1.discord_id},{go_p2.discord_id}"
+    assert godb.read_team_with_roster_key(team1.roster_key, session).id == team1.id
+
+    # the DB rejects the same roster under another name and nothing is left behind
+    with pytest.raises(DuplicateRosterError):
+        godb.create_team("other name", [go_p1, go_p2], session, None, seas)
+    assert 1 == godb.team_count(session=session)
+    assert 2 == godb.roster_count(session=session)
+
+    # a name clash is still a GoDbError but not a duplicate roster
+    with pytest.raises(GoDbError) as err:
+        godb.create_team("tn1", [go_p1], session, None, seas)
+    assert not isinstance(err.value, DuplicateRosterError)
+    assert 1 == godb.team_count(session=session)
+
+
+def test_backfill_roster_keys(gocog_preload, godb, session, go_p1, go_p2):
+    team1 = godb.create_team("tn1", [go_p1, go_p2], session, None, seas)
+    team2 = godb.create_team("tn2", [go_p1], session, None, seas)
+    for team in [team1, team2]:
+        team.roster_key = None
+        session.add(team)
+    session.commit()
+
+    assert 2 == godb.backfill_roster_keys(session)
+    assert team1.roster_key == GoTeam.make_roster_key([go_p1.discord_id, go_p2.discord_id])
+    assert team2.roster_key == GoTeam.make_roster_key([go_p1.discord_id])
+    assert 0 == godb.backfill_roster_keys(session)
+
+
 def test_create_team_duplicate_player(gocog_preload, godb, session, go_p1, go_p2):
     with pytest.raises(GoDbError):
         team1 = godb.create_team("tn1", [go_p1, go_p1], session, None, seas)
@@ -314,6 +370,54 @@ def test_signups_player_same_day_twice(gocog_preload, godb, session, go_p1, go_p
         godb.add_signup(team=team2, session_id=channel1, session=session)
 
 
+# the simulated race signs up the same player twice in one Session which SQLAlchemy warns about
+@pytest.mark.filterwarnings("ignore:New instance")
+def test_signups_participants(gocog_preload, godb, session, go_p1, go_p2, go_p3, monkeypatch):
+    team12 = godb.create_team("tn12", [go_p1, go_p2], session, None, seas)
+    team23 = godb.create_team("tn23", [go_p2, go_p3], session, None, seas)
+
+    signup = godb.add_signup(team=team12, session_id=channel1, session=session)
+    participants = session.exec(select(GoParticipant).order_by(GoParticipant.discord_id)).all()
+    assert [(p.session_id, p.discord_id, p.team_id) for p in participants] == [
+        (channel1, go_p1.discord_id, team12.id),
+        (channel1, go_p2.discord_id, team12.id),
+    ]
+
+    with pytest.raises(GoDbError, match="already signed up"):
+        godb.add_signup(team=team23, session_id=channel1, session=session)
+
+    # a concurrent signup that gets past the check is stopped by go_participant's primary key
+    monkeypatch.setattr(godb, "check_signup_conflict", lambda session_id, discord_ids, session: None)
+    team12.team_name = "tn12 renamed"
+    session.add(team12)
+    with pytest.raises(GoDbError, match="Cannot sign up team tn23"):
+        godb.add_signup(team=team23, session_id=channel1, session=session)
+    monkeypatch.undo()
+    assert 1 == godb.signup_count(session=session)
+    # only the signup is rolled back, not the caller's other changes
+    session.commit()
+    assert godb.read_team_with_name(team_name="tn12 renamed", session=session) is not None
+
+    # the participants go with the signup
+    session.delete(signup)
+    session.commit()
+    assert [] == session.exec(select(GoParticipant)).all()
+    godb.add_signup(team=team23, session_id=channel1, session=session)
+
+
+def test_backfill_participants(gocog_preload, godb, session, go_p1, go_p2):
+    team12 = godb.create_team("tn12", [go_p1, go_p2], session, None, seas)
+    godb.add_signup(team=team12, session_id=channel1, session=session)
+    godb.add_signup(team=team12, session_id=channel2, session=session)
+
+    session.exec(delete(GoParticipant).where(GoParticipant.session_id == channel2))
+    session.commit()
+
+    assert 2 == godb.backfill_participants(session)
+    assert 4 == len(session.exec(select(GoParticipant)).all())
+    assert 0 == godb.backfill_participants(session)
+
+
 def test_set_session_time(godb, session):
 
     godb.set_session_time(session_id=channel1, session_time=date1, session=session)
@@ -352,6 +456,33 @@ def test_get_official_rating(godb, pfdb, session, pf_p1, go_p1):
     assert go_rating == 1234.5
 
 
+def test_get_official_ratings(gocog_preload, godb, session, pf_p1, pf_p2, pf_p3):
+    session.exec(delete(GoRatings).where(GoRatings.pf_player_id == pf_p3.id))
+    session.commit()
+
+    ratings = godb.get_official_ratings([pf_p1.id, pf_p2.id, pf_p3.id], session=session, season=seas)
+    assert set(ratings) == {pf_p1.id, pf_p2.id}
+    assert ratings[pf_p1.id] == godb.get_official_rating(pf_p1.id, session=session, season=seas)
+    assert ratings[pf_p2.id] == godb.get_official_rating(pf_p2.id, session=session, season=seas)
+
+    assert godb.get_official_ratings([], session=session, season=seas) == {}
+
+
+def test_signup_reads_ratings_once(gocog_preload, godb, engine, session, du1, du2, du3, channels):
+    statements = []
+
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        if "go_ratings" in statement:
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        gocog_preload.do_signup(players=[du1, du2, du3], team_name="tn1", session_id=channels[0], session=session)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)
+    assert len(statements) == 1
+
+
 def test_get_teams_for_session(gocog_preload, godb, session, go_p1, go_p2, go_p3):
     team1 = godb.create_team("tn1", [go_p1], session, None, seas)
     team1.team_rating = 1234.56
@@ -384,3 +515,64 @@ def test_get_teams_for_session(gocog_preload, godb, session, go_p1, go_p2, go_p3
 
     teams5 = godb.get_teams_for_session(session_id=channel5, session=session)
     assert len(teams5) == 0
+
+
+def test_read_team_listings(gocog_preload, godb, engine, session, pf_p1, pf_p2, pf_p3, go_p1, go_p2, go_p3):
+    team1 = godb.create_team("tn1", [go_p1], session, None, seas)
+    team23 = godb.create_team("tn23", [go_p2, go_p3], session, None, seas)
+    team12 = godb.create_team("tn12", [go_p1, go_p2], session, None, seas)
+
+    godb.add_signup(team=team23, session_id=channel1, session=session, signup_time=date1)
+    godb.add_signup(team=team1, session_id=channel1, session=session, signup_time=date2)
+    godb.add_signup(team=team12, session_id=channel2, session=session, signup_time=date1)
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        listings = godb.read_team_listings(session_id=channel1, session=session)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)
+    assert len(statements) == 1
+
+    assert [t.team_id for t in listings] == [team23.id, team1.id]
+    assert listings[0].team_name == "tn23"
+    assert listings[0].team_rating == team23.team_rating
+    assert listings[0].igns == [pf_p2.ign, pf_p3.ign]
+    assert listings[1].igns == [pf_p1.ign]
+
+    assert godb.read_team_listings(session_id=channel5, session=session) == []
+
+
+def test_read_session_summaries(gocog_preload, godb, engine, session, go_p1, go_p2, go_p3):
+    godb.set_session_time(session_id=channel2, session_time=date2, session=session)
+    godb.set_session_time(session_id=channel1, session_time=date1, session=session)
+    godb.set_session_time(session_id=channel3, session_time=date3, session=session)
+
+    team1 = godb.create_team("tn1", [go_p1], session, None, seas)
+    team23 = godb.create_team("tn23", [go_p2, go_p3], session, None, seas)
+    godb.add_signup(team=team1, session_id=channel1, session=session)
+    godb.add_signup(team=team23, session_id=channel1, session=session)
+    godb.add_signup(team=team23, session_id=channel2, session=session)
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        summaries = godb.read_session_summaries(session=session)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)
+    assert len(statements) == 1
+
+    assert [s.session_id for s in summaries] == [channel1, channel2, channel3]
+    assert [(s.team_count, s.player_count) for s in summaries] == [(2, 3), (1, 2), (0, 0)]
+    assert summaries[0].signup_state == "open"
+
+    summaries = godb.read_session_summaries(session=session, since=date2)
+    assert [s.session_id for s in summaries] == [channel2, channel3]
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+from go.bot.ign_index import IgnIndex
+from go.bot.models import PfIgnHistory
+
+
+def test_ign_index_refresh(pfdb, session, pf_p1, pf_p2, pf_p1v2):
+    pfdb.create_player(player=pf_p1, session=session)
+    pfdb.create_player(player=pf_p2, session=session)
+
+    index = IgnIndex()
+    assert index.lookup("IGN1") == []
+
+    assert 4 == index.refresh(session)
+    assert index.lookup("ign1") == [pf_p1.id]
+    assert index.lookup("IGN2") == [pf_p2.id]
+    assert index.lookup("IGN") == []
+
+    # a rename is picked up incrementally and the old ign still finds the player
+    pfdb.update_player(session=session, pf_player_id=pf_p1.id, ign="Renamed")
+    index.refresh(session)
+    assert index.lookup("renamed") == [pf_p1.id]
+    assert index.lookup("IGN1") == [pf_p1.id]
+
+    # the player currently using an ign comes before the one who used to
+    pfdb.create_player(player=pf_p1v2, session=session)
+    index.refresh(session)
+    assert index.lookup("IGN1") == [pf_p1v2.id, pf_p1.id]
+    assert index.lookup_holders("IGN1") == [pf_p1v2.id]
+    assert index.lookup_holders("renamed") == [pf_p1.id]
+
+
+def test_ign_index_incremental(session, pf_p1):
+    session.add(pf_p1)
+    session.add(PfIgnHistory(pf_player_id=pf_p1.id, date=datetime(2023, 1, 1), ign="Old"))
+    session.commit()
+
+    index = IgnIndex(overlap=timedelta(0))
+    assert 2 == index.refresh(session)
+    assert index.watermark == datetime(2023, 1, 1)
+
+    # only the new history row is read
+    session.add(PfIgnHistory(pf_player_id=pf_p1.id, date=datetime(2023, 2, 1), ign="New"))
+    session.commit()
+    assert 1 == index.refresh(session)
+    assert 0 == index.refresh(session)
+
+    assert index.lookup("old") == [pf_p1.id]
+    assert index.lookup("new") == [pf_p1.id]
+    assert index.current_ign[pf_p1.id] == "new"
+    assert len(index) == 3
+
+
+def test_ign_index_lock_not_held_during_reads(session, pf_p1, monkeypatch):
+    session.add(pf_p1)
+    session.commit()
+    index = IgnIndex()
+    exec_ = session.exec
+
+    def exec_unlocked(statement):
+        # lookups from the event loop and the other DB workers don't wait on the DB
+        assert not index.lock.locked()
+        assert index.lookup("ign1") == ([pf_p1.id] if index.loaded else [])
+        return exec_(statement)
+
+    monkeypatch.setattr(session, "exec", exec_unlocked)
+    index.refresh(session)
+    index.refresh(session)
+    assert index.lookup_holders("IGN1") == [pf_p1.id]
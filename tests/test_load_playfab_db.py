@@ -0,0 +1,134 @@
+import requests
+from sqlmodel import func, select
+
+from go.bot.models import PfCareerStats
+from go.bot.playfab_api import PlayfabApi, RateLimiter
+from load_playfab_db import crawl
+
+
+def test_crawl_concurrent(pfdb, engine, session, fake_playfab):
+    pfapi = PlayfabApi(api_url=fake_playfab.url, rate_limiter=RateLimiter(rate=1000.0, max_rate=1000.0))
+    pfapi.login_to_playfab()
+
+    crawl(engine=engine, pfapi=pfapi, start=0, end=250, batchsize=100, workers=4)
+
+    assert 250 == pfdb.player_count(session=session)
+    assert 250 == session.exec(select(func.count(PfCareerStats.pf_player_id))).one()
+    assert 3 == fake_playfab.request_counts["GetLeaderboard"]
+    assert 250 == fake_playfab.request_counts["GetPlayerCombinedInfo"]
+
+    player = pfdb.read_player(pf_player_id=1042, session=session)
+    assert player.ign == "ign1042"
+    assert player.career_stats[-1].damage == 1042
+
+    # stats are recent so a second crawl only refreshes the players
+    crawl(engine=engine, pfapi=pfapi, start=0, end=250, batchsize=100, workers=4)
+    assert 250 == pfdb.player_count(session=session)
+    assert 6 == fake_playfab.request_counts["GetLeaderboard"]
+    assert 250 == fake_playfab.request_counts["GetPlayerCombinedInfo"]
+
+
+def test_crawl_stops_at_min(pfdb, engine, session, fake_playfab):
+    pfapi = PlayfabApi(api_url=fake_playfab.url, rate_limiter=RateLimiter(rate=1000.0, max_rate=1000.0))
+
+    # StatValue is 300 - rank so ranks 0..149 have values >= 151
+    crawl(engine=engine, pfapi=pfapi, start=0, end=300, batchsize=50, min_value=151, workers=2)
+
+    assert 150 == pfdb.player_count(session=session)
+    assert 150 == fake_playfab.request_counts["GetPlayerCombinedInfo"]
+
+
+def test_crawl_skips_failed_stats(pfdb, engine, session, fake_playfab):
+    pfapi = PlayfabApi(
+        api_url=fake_playfab.url, rate_limiter=RateLimiter(rate=1000.0, max_rate=1000.0), max_retries=0
+    )
+
+    # the first two stats requests fail
+    fake_playfab.error_count = 2
+    fake_playfab.error_command = "GetPlayerCombinedInfo"
+    crawl(engine=engine, pfapi=pfapi, start=0, end=4, batchsize=4)
+
+    assert 4 == pfdb.player_count(session=session)
+    # no rows of zeros are written for the players whose stats failed
+    assert 2 == session.exec(select(func.count(PfCareerStats.pf_player_id))).one()
+
+
+def test_crawl_stops_on_failed_page(pfdb, engine, session, fake_playfab, monkeypatch):
+    pfapi = PlayfabApi(api_url=fake_playfab.url, rate_limiter=RateLimiter(rate=1000.0, max_rate=1000.0))
+    get_leaderboard = pfapi.get_leaderboard
+
+    def flaky_leaderboard(start_rank, batchsize, stat_name):
+        if start_rank == 100:
+            raise requests.ConnectionError("connection reset")
+        return get_leaderboard(start_rank, batchsize, stat_name)
+
+    monkeypatch.setattr(pfapi, "get_leaderboard", flaky_leaderboard)
+    crawl(engine=engine, pfapi=pfapi, start=0, end=250, batchsize=100, workers=2)
+
+    # the crawl stops at the last page that loaded, a resume retries the failed one
+    assert 100 == pfdb.player_count(session=session)
+    checkpoint = pfdb.read_crawl_checkpoint(stat_name="CareerWins", session=session)
+    assert checkpoint.last_rank == 99
+    assert not checkpoint.completed
+
+
+def test_crawl_resume(pfdb, engine, session, fake_playfab):
+    pfapi = PlayfabApi(api_url=fake_playfab.url, rate_limiter=RateLimiter(rate=1000.0, max_rate=1000.0))
+
+    # the leaderboard runs out at rank 150 so the crawl stops early
+    fake_playfab.player_count = 150
+    crawl(engine=engine, pfapi=pfapi, start=0, end=250, batchsize=100, run_id="run1")
+    assert 150 == pfdb.player_count(session=session)
+
+    checkpoint = pfdb.read_crawl_checkpoint(stat_name="CareerWins", session=session)
+    assert checkpoint.run_id == "run1"
+    # only the ranks that came back are checkpointed
+    assert checkpoint.last_rank == 149
+    assert not checkpoint.completed
+
+    # resuming picks up right after the last rank loaded
+    fake_playfab.player_count = 300
+    leaderboard_requests = fake_playfab.request_counts["GetLeaderboard"]
+    crawl(engine=engine, pfapi=pfapi, start=0, end=10, batchsize=100, resume=True)
+    assert 250 == pfdb.player_count(session=session)
+    assert leaderboard_requests + 1 == fake_playfab.request_counts["GetLeaderboard"]
+    for rank in [149, 150, 199, 200, 249]:
+        assert pfdb.read_player(pf_player_id=1000 + rank, session=session) is not None
+    assert pfdb.read_player(pf_player_id=1000 + 250, session=session) is None
+
+    session.expire_all()
+    checkpoint = pfdb.read_crawl_checkpoint(stat_name="CareerWins", run_id="run1", session=session)
+    assert checkpoint.last_rank == 249
+    assert checkpoint.completed
+
+    # nothing left to do for a completed run
+    crawl(engine=engine, pfapi=pfapi, start=0, end=10, batchsize=100, resume=True)
+    assert leaderboard_requests + 1 == fake_playfab.request_counts["GetLeaderboard"]
+
+
+def test_crawl_multiple_stats(pfdb, engine, session, fake_playfab):
+    pfapi = PlayfabApi(api_url=fake_playfab.url, rate_limiter=RateLimiter(rate=1000.0, max_rate=1000.0))
+
+    # the two leaderboards share players 1050..1099
+    fake_playfab.stat_offsets["WeeklyKillsTotal"] = 50
+    crawl(
+        engine=engine,
+        pfapi=pfapi,
+        stat_names=["CareerWins", "WeeklyKillsTotal"],
+        start=0,
+        end=100,
+        batchsize=25,
+        recent_days=0,
+        workers=3,
+        run_id="multi",
+    )
+
+    assert 150 == pfdb.player_count(session=session)
+    assert 8 == fake_playfab.request_counts["GetLeaderboard"]
+    # each player's stats are only fetched once
+    assert 150 == fake_playfab.request_counts["GetPlayerCombinedInfo"]
+
+    for stat_name in ["CareerWins", "WeeklyKillsTotal"]:
+        checkpoint = pfdb.read_crawl_checkpoint(stat_name=stat_name, run_id="multi", session=session)
+        assert checkpoint.last_rank == 99
+        assert checkpoint.completed
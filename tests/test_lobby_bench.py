@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from bench_lobbies import load_rating_pool, make_session, run_session
+from go.bot.lobby_engine import LOBBY_MAX_PLAYERS
+
+pool = load_rating_pool()
+
+
+def random_session(seed):
+    rng = random.Random(seed)
+    team_count = rng.choice([0, 1, 2, 5, 10, 20, 30, 60, 150])
+    host_count = rng.randint(0, 6)
+    # sometimes more lobbies than the bot would open, to stress the packing
+    lobby_count = rng.choice([None, None, host_count])
+    return make_session(rng, pool, team_count, host_count, lobby_count=lobby_count)
+
+
+def test_load_rating_pool():
+    assert len(pool) > 1000
+    assert all(0 <= rating < 5000 for rating in pool)
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_lobby_invariants(seed):
+    session = random_session(seed)
+    assignment, stats = run_session(session)
+    teams = {t.team_id: t for t in session.teams}
+    hosting_dids = set(assignment.hosts)
+
+    # every host can open a lobby, even if their team is on the waitlist
+    host_count = len(session.hosts_not_on_teams) + len({t.host_did for t in session.teams if t.host_did})
+    assert len(assignment.lobbies) == min(session.lobby_count, host_count, len(teams))
+
+    # no lobby over the cap, and the counts add up
+    for team_ids, players in zip(assignment.lobbies, assignment.players):
+        assert team_ids
+        assert players == sum(teams[team_id].team_size for team_id in team_ids)
+        assert players <= LOBBY_MAX_PLAYERS
+
+    # every team is in exactly one lobby or on the waitlist
+    assigned = [team_id for team_ids in assignment.lobbies for team_id in team_ids]
+    assert sorted(assigned + assignment.waitlist) == sorted(teams)
+
+    # one host per lobby, and at most one host team per lobby -- the one with that lobby's host on it
+    assert len(hosting_dids) == len(assignment.hosts)
+    for host_did, team_ids in zip(assignment.hosts, assignment.lobbies):
+        host_teams = [team_id for team_id in team_ids if teams[team_id].host_did in hosting_dids]
+        assert len(host_teams) <= 1
+        if host_teams:
+            assert teams[host_teams[0]].host_did == host_did
+        else:
+            waitlisted_hosts = {teams[team_id].host_did for team_id in assignment.waitlist}
+            assert host_did in session.hosts_not_on_teams or host_did in waitlisted_hosts
+
+    # hosts on teams host their own lobby whenever there are enough lobbies for them
+    lobby_of = {team_id: i for i, team_ids in enumerate(assignment.lobbies) for team_id in team_ids}
+    host_teams_in = [team_id for team_id in assigned if teams[team_id].host_did is not None]
+    if len(host_teams_in) <= len(assignment.lobbies):
+        for team_id in host_teams_in:
+            assert assignment.hosts[lobby_of[team_id]] == teams[team_id].host_did
+
+    # the waitlist is the teams that signed up after they'd no longer fit
+    capacity = len(assignment.lobbies) * LOBBY_MAX_PLAYERS
+    assert assignment.waitlist == sorted(assignment.waitlist)
+    for team_id in assignment.waitlist:
+        earlier = sum(teams[t].team_size for t in assigned if t < team_id)
+        assert earlier + teams[team_id].team_size > capacity
+
+    assert stats.spread == assignment.spread
+    assert stats.variance <= stats.spread**2
+    assert 0 <= stats.fill_rate <= 1
+    assert stats.waitlist_teams == len(assignment.waitlist)
+
+
+def test_lobby_speed():
+    rng = random.Random(0)
+    for team_count in [100, 300]:
+        _, stats = run_session(make_session(rng, pool, team_count, host_count=3))
+        assert stats.seconds < 1.0
+        assert stats.fill_rate > 0.9
+
+    # far more lobbies than the bot ever opens
+    _, stats = run_session(make_session(rng, pool, 400, host_count=40, lobby_count=40))
+    assert stats.seconds < 1.0
@@ -0,0 +1,73 @@
+import random
+import time
+
+from go.bot.lobby_engine import LobbyTeam, assign_lobbies
+
+
+def make_teams(n, seed=0, host_dids=()):
+    rng = random.Random(seed)
+    teams = [
+        LobbyTeam(team_id=i + 1, team_size=rng.randint(1, 4), team_rating=rng.uniform(500, 2500)) for i in range(n)
+    ]
+    for team, host_did in zip(teams, host_dids):
+        team.host_did = host_did
+    return teams
+
+
+def test_assign_lobbies_balances():
+    # a snake draft of these puts 4000 vs 3000 in the lobbies' top slots, the engine evens it out
+    ratings = [4000, 3000, 2000, 1000, 1500, 2500]
+    teams = [LobbyTeam(team_id=i, team_size=3, team_rating=r) for i, r in enumerate(ratings)]
+    assignment = assign_lobbies(teams, hosts_not_on_teams=[1, 2], lobby_count=2)
+
+    assert assignment.hosts == [1, 2]
+    assert assignment.players == [9, 9]
+    assert assignment.waitlist == []
+    assert assignment.spread < 1e-6
+
+
+def test_assign_lobbies_hosts_and_waitlist():
+    teams = make_teams(40, host_dids=[101, 102, 102])
+    assignment = assign_lobbies(teams, hosts_not_on_teams=[201], lobby_count=3)
+
+    # team 3's host is already hosting with team 2, so team 3 plays in someone else's lobby
+    assert sorted(assignment.hosts) == [101, 102, 201]
+    lobby_of = {team_id: i for i, team_ids in enumerate(assignment.lobbies) for team_id in team_ids}
+    assert assignment.hosts[lobby_of[1]] == 101
+    assert assignment.hosts[lobby_of[2]] == 102
+
+    assert all(players <= 24 for players in assignment.players)
+    assigned = set(lobby_of)
+    assert assigned.isdisjoint(assignment.waitlist)
+    assert assigned | set(assignment.waitlist) == {t.team_id for t in teams}
+    # the waitlist is whoever signed up after the lobbies filled
+    assert assignment.waitlist == sorted(assignment.waitlist)
+    first_out = teams[assignment.waitlist[0] - 1]
+    assert sum(assignment.players) + first_out.team_size > 3 * 24
+
+
+def test_assign_lobbies_not_enough_hosts():
+    teams = make_teams(30)
+    assignment = assign_lobbies(teams, hosts_not_on_teams=[201], lobby_count=3)
+    assert assignment.hosts == [201]
+    assert assignment.players[0] <= 24
+
+
+def test_assign_lobbies_speed():
+    teams = make_teams(400, seed=1)
+    hosts = list(range(1000, 1040))
+    start = time.perf_counter()
+    assignment = assign_lobbies(teams, hosts_not_on_teams=hosts, lobby_count=40)
+    assert time.perf_counter() - start < 1.0
+    assert all(players <= 24 for players in assignment.players)
+
+
+def test_assign_lobbies_host_team_waitlisted():
+    # the only host's team signs up after the lobby is full, they still host it
+    teams = [LobbyTeam(team_id=i, team_size=4, team_rating=1000) for i in range(1, 7)]
+    teams.append(LobbyTeam(team_id=7, team_size=2, team_rating=1000, host_did=99))
+    assignment = assign_lobbies(teams, hosts_not_on_teams=[], lobby_count=1)
+
+    assert assignment.hosts == [99]
+    assert assignment.lobbies == [[1, 2, 3, 4, 5, 6]]
+    assert assignment.waitlist == [7]
@@ -0,0 +1,103 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+from sqlmodel import select
+
+from go.bot.dm_delivery import DmDelivery
+from go.bot.models import GoOutbox
+from go.bot.outbox import OutboxDispatcher
+
+
+def test_add_outbox_dedupes(godb, session):
+    rows = godb.add_outbox([(1, "hello"), (2, "hello"), (1, "bye")], source="i1", session=session)
+    session.commit()
+    assert len(rows) == 3
+
+    # the same interaction queuing the same DMs again is a no-op, a new one isn't
+    assert [] == godb.add_outbox([(1, "hello"), (1, "hello")], source="i1", session=session)
+    assert 1 == len(godb.add_outbox([(1, "hello")], source="i2", session=session))
+    session.commit()
+    assert 4 == len(session.exec(select(GoOutbox)).all())
+
+
+@pytest.mark.asyncio
+async def test_signup_writes_outbox(interaction1, gocog_preload_teams, session, du1, du2):
+    gocog = gocog_preload_teams
+    gocog.dms_enabled = False
+
+    await gocog.cancel.callback(gocog, interaction1)
+    await gocog.signup.callback(gocog, interaction1, "team_name", du1, du2)
+    interaction1.assert_msg_count('Signed up "team_name" for')
+
+    rows = session.exec(select(GoOutbox).order_by(GoOutbox.id)).all()
+    assert [r.discord_id for r in rows] == [du1.id, du1.id, du2.id]
+    assert "has been **cancelled**" in rows[0].message
+    assert "Team Signup #1" in rows[1].message
+    assert all(r.sent_at is None for r in rows)
+
+    # a signup that fails doesn't leave DMs behind
+    await gocog.signup.callback(gocog, interaction1, "other_team", du2)
+    interaction1.assert_msg_count("already signed up")
+    assert 3 == len(session.exec(select(GoOutbox)).all())
+
+
+@pytest.mark.asyncio
+async def test_outbox_dispatcher(gocog, godb, engine, session, fake_bot):
+    ok = fake_bot.add_user(1)
+    down = fake_bot.add_user(2, failures=10, error=OSError("connection reset"))
+    delivery = DmDelivery(fake_bot, max_retries=0)
+    outbox = OutboxDispatcher(engine, godb, delivery, gocog.run_db, batchsize=2, max_attempts=2)
+
+    godb.add_outbox([(1, "one"), (2, "two"), (1, "three")], source="i1", session=session)
+    session.commit()
+
+    assert 2 == await asyncio.wait_for(outbox.drain(), timeout=5)
+    assert ok.messages == ["one", "three"]
+
+    session.expire_all()
+    rows = {r.message: r for r in session.exec(select(GoOutbox)).all()}
+    assert rows["one"].sent_at is not None
+    assert rows["two"].sent_at is None
+    assert rows["two"].attempts == 1
+
+    # failed DMs are retried on the next drain until they run out of attempts
+    down.failures = 0
+    assert 1 == await asyncio.wait_for(outbox.drain(), timeout=5)
+    assert down.messages == ["two"]
+    assert 0 == await asyncio.wait_for(outbox.drain(), timeout=5)
+    assert ok.messages == ["one", "three"]
+    await delivery.stop()
+
+
+@pytest.mark.asyncio
+async def test_outbox_undeliverable(gocog, godb, engine, session, fake_bot):
+    fake_bot.add_user(1, failures=1, error=discord.Forbidden(SimpleNamespace(status=403, reason="no DMs"), "no DMs"))
+    delivery = DmDelivery(fake_bot)
+    outbox = OutboxDispatcher(engine, godb, delivery, gocog.run_db, max_attempts=5)
+
+    godb.add_outbox([(1, "blocked"), (999, "unknown")], source="i1", session=session)
+    session.commit()
+
+    # given up on after the first try
+    assert 0 == await asyncio.wait_for(outbox.drain(), timeout=5)
+    session.expire_all()
+    assert [5, 5] == [r.attempts for r in session.exec(select(GoOutbox)).all()]
+    assert [] == godb.read_outbox(session)
+    await delivery.stop()
+
+
+@pytest.mark.asyncio
+async def test_outbox_kick_waits_for_ready(gocog, godb, engine, fake_bot):
+    outbox = OutboxDispatcher(engine, godb, DmDelivery(fake_bot), gocog.run_db)
+
+    # before the bot is ready the dispatch_outbox loop sends everything instead
+    fake_bot.ready = False
+    outbox.kick()
+    assert not outbox.draining
+
+    fake_bot.ready = True
+    outbox.kick()
+    assert 1 == len(outbox.draining)
+    await asyncio.wait_for(asyncio.gather(*outbox.draining), timeout=5)
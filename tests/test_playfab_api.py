@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from go.bot.playfab_api import PlayfabApi, RateLimiter
+
+
+def test_connections_are_reused(fake_playfab):
+    limiter = RateLimiter(rate=1000.0, max_rate=1000.0)
+    with PlayfabApi(api_url=fake_playfab.url, pool_size=2, rate_limiter=limiter) as pfapi:
+        pfapi.login_to_playfab()
+        for i in range(20):
+            stats = pfapi.get_player_career_stats(player_id=1000 + i)
+            assert stats.damage == 1000 + i
+
+    assert 21 == sum(fake_playfab.request_counts.values())
+    assert fake_playfab.connection_count == 1
+
+
+@pytest.mark.asyncio
+async def test_run_request_async(fake_playfab):
+    with PlayfabApi(api_url=fake_playfab.url) as pfapi:
+        response = await pfapi.run_request_async("GetLeaderboard", {"StartPosition": 0, "MaxResultsCount": 5})
+        assert response is not None
+        assert len(response.json()["data"]["Leaderboard"]) == 5
+
+
+def test_throttled_requests_are_retried(fake_playfab):
+    limiter = RateLimiter(rate=50.0)
+    with PlayfabApi(api_url=fake_playfab.url, rate_limiter=limiter, backoff_base=0.01) as pfapi:
+        fake_playfab.throttle_count = 2
+        stats = pfapi.get_player_career_stats(player_id=1001)
+
+    assert stats is not None
+    assert stats.damage == 1001
+    assert 3 == fake_playfab.request_counts["GetPlayerCombinedInfo"]
+    # halved twice, then one success
+    assert limiter.rate == pytest.approx(12.5 + limiter.increase_step)
+
+
+def test_server_errors_are_retried(fake_playfab):
+    with PlayfabApi(api_url=fake_playfab.url, backoff_base=0.01) as pfapi:
+        fake_playfab.error_count = 2
+        stats = pfapi.get_player_career_stats(player_id=1001)
+
+    assert stats is not None
+    assert 3 == fake_playfab.request_counts["GetPlayerCombinedInfo"]
+
+
+def test_no_stats_after_max_retries(fake_playfab):
+    with PlayfabApi(api_url=fake_playfab.url, max_retries=2, backoff_base=0.01) as pfapi:
+        fake_playfab.throttle_count = 100
+        stats = pfapi.get_player_career_stats(player_id=1001)
+
+    # an empty row of stats is never returned
+    assert stats is None
+    assert 3 == fake_playfab.request_counts["GetPlayerCombinedInfo"]
+
+
+def test_rate_limiter_spaces_requests():
+    limiter = RateLimiter(rate=100.0, max_rate=100.0)
+    start = time.monotonic()
+    for _ in range(21):
+        limiter.acquire()
+    # the first request is free, the other 20 wait 1/100th of a second each
+    assert time.monotonic() - start >= 0.18
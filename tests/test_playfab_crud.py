@@ -1,9 +1,11 @@
 from datetime import datetime, timedelta
 
 import pytest
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateTable
 
-from go.bot.exceptions import PlayerNotFoundError
-from go.bot.models import PfPlayer
+from go.bot.exceptions import GoDbError, PlayerNotFoundError
+from go.bot.models import PfIgnTrigram, PfPlayer
 from go.bot.playfab_api import is_playfab_str
 from go.bot.playfab_db import PfIgnHistory
 
@@ -102,6 +104,61 @@ def test_read_players_by_ign_test_cases_and_limit(pfdb, session, pf_p1, pf_p2):
     assert len(players) == 1
 
 
+def test_read_players_by_ign_ranked(pfdb, session, pf_p1, pf_p2):
+    page = [
+        PfPlayer(id=11, ign="Stooobe", account_created=pf_p1.account_created, last_login=pf_p1.last_login),
+        PfPlayer(id=12, ign="stooobe_alt", account_created=pf_p1.account_created, last_login=pf_p1.last_login),
+        PfPlayer(id=13, ign="Stoobert", account_created=pf_p1.account_created, last_login=pf_p1.last_login),
+        PfPlayer(id=14, ign="50% off", account_created=pf_p1.account_created, last_login=pf_p1.last_login),
+    ]
+    pfdb.upsert_players(players=page, session=session)
+    pfdb.create_player(player=pf_p1, session=session)
+
+    # exact matches hide the prefix matches
+    players = pfdb.read_players_by_ign(ign="STOOOBE", session=session)
+    assert [_.id for _ in players] == [11]
+
+    # prefix matches, shortest first
+    players = pfdb.read_players_by_ign(ign="stoo", session=session)
+    assert [_.id for _ in players] == [11, 13, 12]
+
+    # fuzzy matches on shared trigrams, closest first
+    players = pfdb.read_players_by_ign(ign="stooobee", session=session)
+    assert [_.id for _ in players] == [11, 12, 13]
+    # ties go to the shortest ign
+    players = pfdb.read_players_by_ign(ign="oobe", session=session)
+    assert [_.id for _ in players] == [11, 13, 12]
+
+    # LIKE wildcards are matched literally
+    players = pfdb.read_players_by_ign(ign="50%", session=session)
+    assert [_.id for _ in players] == [14]
+    players = pfdb.read_players_by_ign(ign="5_", session=session)
+    assert players == []
+
+    # renaming a player updates the trigrams
+    pfdb.update_player(session=session, pf_player_id=13, ign="Bertie")
+    players = pfdb.read_players_by_ign(ign="ertie", session=session)
+    assert [_.id for _ in players] == [13]
+
+    # a rebuild recreates the same trigrams
+    pfdb.rebuild_ign_trigrams(session=session, batchsize=2)
+    players = pfdb.read_players_by_ign(ign="stooobee", session=session)
+    assert [_.id for _ in players] == [11, 12]
+    players = pfdb.read_players_by_ign(ign="gn1", session=session)
+    assert [_.id for _ in players] == [pf_p1.id]
+
+
+def test_ign_trigram_binary_collation(pfdb, session, pf_p1):
+    # MySQL's default collation would make these trigrams the same key
+    ddl = str(CreateTable(PfIgnTrigram.__table__).compile(dialect=mysql.dialect()))  # type: ignore
+    assert "COLLATE utf8mb4_bin" in ddl
+
+    pf_p1.ign = "oké oke"
+    pfdb.upsert_players(players=[pf_p1], session=session)
+    players = pfdb.read_players_by_ign(ign="oké ok", session=session)
+    assert [_.id for _ in players] == [pf_p1.id]
+
+
 def test_player_exists(pfdb, session, pf_p1, pf_p2):
     assert pfdb.player_exists(pf_player_id=pf_p1.id, session=session) == False
 
@@ -224,6 +281,45 @@ def test_update_player_missing(pfdb, session, pf_p1):
         pfdb.update_player(session=session, pf_player_id=bad_id, ign="new ign")
 
 
+def test_upsert_players(pfdb, session, pf_p1, pf_p2, pf_p3):
+    pfdb.create_player(player=pf_p1, session=session)
+    assert 1 == pfdb.ign_history_count(session=session)
+
+    new_login = datetime(2023, 5, 5, 5, 5, 5)
+    page = [
+        PfPlayer(id=pf_p1.id, ign="IGN1 renamed", account_created=pf_p1.account_created, last_login=new_login),
+        PfPlayer(id=pf_p2.id, ign=pf_p2.ign, account_created=pf_p2.account_created, last_login=pf_p2.last_login),
+        PfPlayer(id=pf_p3.id, ign=pf_p3.ign, account_created=pf_p3.account_created, last_login=pf_p3.last_login),
+    ]
+    pfdb.upsert_players(players=page, session=session)
+
+    assert 3 == pfdb.player_count(session=session)
+    player1 = pfdb.read_player(pf_player_id=pf_p1.id, session=session)
+    assert player1.ign == "IGN1 renamed"
+    assert player1.last_login == new_login
+    assert player1.account_created == pf_p1.account_created
+    assert [_.ign for _ in player1.ign_history] == ["IGN1", "IGN1 renamed"]
+
+    player3 = pfdb.read_player(pf_player_id=pf_p3.id, session=session)
+    assert player3.ign == pf_p3.ign
+    assert [_.ign for _ in player3.ign_history] == [pf_p3.ign]
+
+    # upserting the same page again doesn't add history
+    assert 4 == pfdb.ign_history_count(session=session)
+    pfdb.upsert_players(players=page, session=session)
+    assert 3 == pfdb.player_count(session=session)
+    assert 4 == pfdb.ign_history_count(session=session)
+
+    pfdb.upsert_players(players=[], session=session)
+    assert 3 == pfdb.player_count(session=session)
+
+
+def test_upsert_players_unsupported_dialect(pfdb, engine, session, pf_p1, monkeypatch):
+    monkeypatch.setattr(engine.dialect, "name", "postgresql")
+    with pytest.raises(GoDbError):
+        pfdb.upsert_players(players=[pf_p1], session=session)
+
+
 def test_career_stats_create_and_read(pfdb, session, pf_p1, stats_p1_1, stats_p1_2, pf_p2, stats_p2_1, stats_p2_2):
     pfdb.create_player(player=pf_p1, session=session)
     assert 1 == pfdb.player_count(session=session)
@@ -557,3 +653,22 @@ def test_is_playfab_str():
     assert is_playfab_str("abc") == False
     assert is_playfab_str("") == False
     assert is_playfab_str(None) == False
+
+
+def test_career_stats_bulk(pfdb, session, pf_p1, pf_p2, pf_p3, stats_p1_1, stats_p1_2, stats_p2_1):
+    pfdb.create_player(player=pf_p1, session=session)
+    pfdb.create_player(player=pf_p2, session=session)
+    pfdb.create_player(player=pf_p3, session=session)
+
+    assert {} == pfdb.latest_career_stats_dates([pf_p1.id, pf_p2.id], session=session)
+
+    pfdb.add_career_stats_bulk(stats=[stats_p1_1, stats_p1_2, stats_p2_1], session=session)
+    pfdb.add_career_stats_bulk(stats=[], session=session)
+
+    player1 = pfdb.read_player(pf_player_id=pf_p1.id, session=session)
+    assert len(player1.career_stats) == 2
+    assert player1.career_stats[-1].games == stats_p1_2.games
+
+    latest = pfdb.latest_career_stats_dates([pf_p1.id, pf_p2.id, pf_p3.id], session=session)
+    assert latest == {pf_p1.id: stats_p1_2.date, pf_p2.id: stats_p2_1.date}
+    assert {} == pfdb.latest_career_stats_dates([], session=session)
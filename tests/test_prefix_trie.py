@@ -0,0 +1,21 @@
+from go.bot.prefix_trie import PrefixTrie
+
+
+def test_prefix_trie_search():
+    trie = PrefixTrie()
+    for name in ["Stooobe", "stooobe_alt", "Stoobert", "Bertie", "STOOOBE"]:
+        trie.insert(name, name)
+    trie.insert("Bertie", "Bertie")
+    assert len(trie) == 5
+
+    # case-insensitive, shortest first
+    assert trie.search("sToO") == ["Stooobe", "STOOOBE", "Stoobert", "stooobe_alt"]
+    assert trie.search("stoob") == ["Stoobert"]
+    assert trie.search("x") == []
+    assert len(trie.search("", limit=3)) == 3
+    assert trie.search("sto", limit=1) == ["Stooobe"]
+
+    trie.remove("Stoobert", "Stoobert")
+    trie.remove("Nobody", "Nobody")
+    assert trie.search("stoob") == []
+    assert len(trie) == 4
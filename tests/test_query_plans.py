@@ -0,0 +1,101 @@
+import re
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlmodel import SQLModel, select
+
+from config import _config
+from go.bot.models import GoTeam
+
+seas = _config.go_season
+channel1 = 1111
+
+# "SCAN go_signup" is a full table scan, "SCAN go_signup USING INDEX ..." is not
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?(?P<table>\w+)( AS \w+)?$")
+
+
+def explain(engine, session, func):
+    """
+    Run func and return {statement: [tables it fully scans]} for every SELECT it made.
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        func()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    assert statements, "func didn't run any queries"
+
+    # scans of materialized subqueries are scans of their (already filtered) results, not of a table
+    tables = set(SQLModel.metadata.tables)
+    connection = session.connection()
+    scans = {}
+    for statement, parameters in statements:
+        rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        matches = (FULL_SCAN.match(row[3]) for row in rows)
+        scans[statement] = [m.group("table") for m in matches if m and m.group("table") in tables]
+    return scans
+
+
+def assert_no_full_scans(engine, session, func):
+    for statement, tables in explain(engine, session, func).items():
+        assert not tables, f"full scan of {tables} in:\n{statement}"
+
+
+def test_go_db_query_plans(gocog_preload, godb, engine, session, go_p1, go_p2, go_p3, pf_p1, pf_p2):
+    godb.set_session_time(session_id=channel1, session_time=datetime(2023, 1, 1), session=session)
+    team = godb.create_team("tn12", [go_p1, go_p2], session, None, seas)
+    godb.add_signup(team=team, session_id=channel1, session=session)
+    godb.set_host(discord_id=go_p3.discord_id, session_id=channel1, status="confirmed", session=session)
+    ids = {go_p1.discord_id, go_p2.discord_id}
+
+    hot_queries = [
+        lambda: godb.read_player(discord_id=go_p1.discord_id, session=session),
+        lambda: godb.get_signup_for_session(go_p1.discord_id, channel1, session),
+        lambda: godb.read_team_with_roster(discord_ids=ids, session=session),
+        lambda: godb.read_team_with_roster_key(GoTeam.make_roster_key(ids), session),
+        lambda: godb.read_team_listings(session_id=channel1, session=session),
+        lambda: godb.get_teams_for_session(session_id=channel1, session=session),
+        lambda: godb.check_signup_conflict(session_id=channel1, discord_ids={go_p3.discord_id}, session=session),
+        lambda: godb.get_hosts(session_id=channel1, session=session, status="confirmed"),
+        lambda: godb.get_lobbies(session_id=channel1, session=session),
+        lambda: godb.get_session(channel1, session),
+        lambda: godb.read_session_summaries(session=session, since=datetime(2023, 1, 1)),
+        lambda: godb.get_official_rating(pf_p1.id, session, season=seas),
+        lambda: godb.get_official_ratings([pf_p1.id, pf_p2.id], session, season=seas),
+        lambda: godb.rating_cache.warm(session, season=seas),
+        lambda: godb.read_outbox(session),
+    ]
+    for func in hot_queries:
+        assert_no_full_scans(engine, session, func)
+
+
+def test_playfab_db_query_plans(gocog_preload, pfdb, engine, session, pf_p1, pf_p2):
+    hot_queries = [
+        lambda: pfdb.read_player(pf_player_id=pf_p1.id, session=session),
+        # exact, prefix and trigram searches
+        lambda: pfdb.read_players_by_ign(ign=pf_p1.ign, session=session),
+        lambda: pfdb.read_players_by_ign(ign="ig", session=session),
+        lambda: pfdb.read_players_by_ign(ign="xgn1", session=session),
+        lambda: pfdb.latest_career_stats_dates([pf_p1.id, pf_p2.id], session=session),
+        lambda: pfdb.calc_rating_from_stats(pf_player_id=pf_p1.id, session=session),
+    ]
+    for func in hot_queries:
+        assert_no_full_scans(engine, session, func)
+
+
+def test_short_ign_search_query_plan(gocog_preload, pfdb, engine, session):
+    # under 3 characters there are no trigrams, only the substring search falls back to a scan
+    scans = explain(engine, session, lambda: pfdb.read_players_by_ign(ign="n1", session=session))
+    assert list(scans.values()) == [[], [], ["pf_player"]]
+
+
+def test_full_scan_is_caught(gocog_preload, engine, session):
+    # go_team.team_size has no index
+    scans = explain(engine, session, lambda: session.exec(select(GoTeam).where(GoTeam.team_size == 2)).all())
+    assert list(scans.values()) == [["go_team"]]
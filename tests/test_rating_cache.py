@@ -0,0 +1,74 @@
+from sqlalchemy import event
+from sqlmodel import delete
+
+from config import _config
+from go.bot.models import GoRatings
+from go.bot.rating_cache import RatingCache
+
+seas = _config.go_season
+
+
+def test_rating_cache_warm(session, pf_p1, pf_p2):
+    session.add(pf_p1)
+    session.add(pf_p2)
+    session.add(GoRatings(pf_player_id=pf_p1.id, season=seas, rating_type="official", go_rating=1000.0))
+    session.add(GoRatings(pf_player_id=pf_p2.id, season=seas, rating_type="combined", go_rating=1200.0))
+    session.add(GoRatings(pf_player_id=pf_p2.id, season="old season", rating_type="official", go_rating=900.0))
+    session.commit()
+
+    cache = RatingCache()
+    assert cache.get(seas, "official", pf_p1.id) == (False, None)
+
+    assert 1 == cache.warm(session, season=seas)
+    assert cache.is_warm(seas)
+    assert not cache.is_warm("old season")
+    assert cache.get(seas, "official", pf_p1.id) == (True, 1000.0)
+    # warmed and not there means no rating
+    assert cache.get(seas, "official", pf_p2.id) == (True, None)
+    assert cache.get("old season", "official", pf_p2.id) == (False, None)
+
+    # a written player is read from the DB until its rating is put back
+    cache.invalidate_player(seas, "official", pf_p2.id)
+    assert cache.get(seas, "official", pf_p2.id) == (False, None)
+    cache.put(seas, "official", pf_p2.id, None)
+    assert cache.get(seas, "official", pf_p2.id) == (False, None)
+    cache.put(seas, "official", pf_p2.id, 1100.0)
+    assert cache.get(seas, "official", pf_p2.id) == (True, 1100.0)
+
+    cache.invalidate(seas)
+    assert not cache.is_warm(seas)
+    assert len(cache) == 0
+    assert cache.get(seas, "official", pf_p1.id) == (False, None)
+
+
+def test_rating_cache_reads_skip_db(gocog_preload, godb, engine, session, pf_p1, pf_p2, pf_p3):
+    godb.rating_cache.warm(session, season=seas)
+    rating1 = godb.get_official_rating(pf_p1.id, session, season=seas)
+    assert rating1 is not None
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        if "go_ratings" in statement:
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_statements)
+    try:
+        assert rating1 == godb.get_official_rating(pf_p1.id, session, season=seas)
+        ratings = godb.get_official_ratings([pf_p1.id, pf_p2.id, pf_p3.id], session, season=seas)
+        assert set(ratings) == {pf_p1.id, pf_p2.id, pf_p3.id}
+        assert len(statements) == 0
+
+        # a rating written by set_rating_if_needed is read back from the DB once
+        session.exec(delete(GoRatings).where(GoRatings.pf_player_id == pf_p3.id))
+        session.commit()
+        godb.rating_cache.invalidate_player(seas, "official", pf_p3.id)
+        rating3 = gocog_preload.set_rating_if_needed(pf_p3.id, session, season=seas)
+        session.commit()
+        statements.clear()
+
+        assert rating3 == godb.get_official_rating(pf_p3.id, session, season=seas)
+        assert rating3 == godb.get_official_rating(pf_p3.id, session, season=seas)
+        assert len(statements) == 1
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statements)